@@ -0,0 +1,34 @@
+/*
+Secondary indexes for the hot query paths in BookSwapDatabase.
+ */
+
+-- get_listed_books, get_userBooksID, get_trade_info, get_num_trade_requests,
+-- get_num_open_trades: a user's listings, optionally only the available ones
+CREATE INDEX IF NOT EXISTS UserBooks_userId_available
+    ON UserBooks (userId, available);
+
+-- get_available_copies and the wishlist aggregates: copies of one book
+CREATE INDEX IF NOT EXISTS UserBooks_bookId_available
+    ON UserBooks (bookId, available);
+
+-- get_recent_additions: newest available listings first
+CREATE INDEX IF NOT EXISTS UserBooks_recent_available
+    ON UserBooks (dateCreated DESC)
+    WHERE available = 1;
+
+-- get_trade_status, get_trade_requester, get_trade_age and every trade
+-- transition look up the trade for one listing, sometimes by status too
+CREATE INDEX IF NOT EXISTS Trades_userBookId_statusId
+    ON Trades (userBookId, statusId);
+
+-- get_all_open_requests: trades a user has requested, by status
+CREATE INDEX IF NOT EXISTS Trades_userRequestedId_statusId
+    ON Trades (userRequestedId, statusId);
+
+-- get_books_by_ISBN, user_add_book_by_isbn, add_to_wish
+CREATE INDEX IF NOT EXISTS Books_ISBN
+    ON Books (ISBN);
+
+-- get_wishlists_by_userid, user_add_book_to_wishlist_by_id
+CREATE INDEX IF NOT EXISTS Wishlists_userId
+    ON Wishlists (userId);
@@ -0,0 +1,40 @@
+/*
+Full-text index over Books.title and Books.author for local search.
+BooksSearch is an external-content FTS5 table: it stores only the index, reads
+the text from Books, and is kept in step with Books by the triggers below.
+ */
+
+CREATE VIRTUAL TABLE IF NOT EXISTS BooksSearch USING fts5
+(
+    title,
+    author,
+    content = 'Books',
+    content_rowid = 'id',
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS Books_search_insert
+    AFTER INSERT ON Books
+BEGIN
+    INSERT INTO BooksSearch (rowid, title, author)
+    VALUES (new.id, new.title, new.author);
+END;
+
+CREATE TRIGGER IF NOT EXISTS Books_search_delete
+    AFTER DELETE ON Books
+BEGIN
+    INSERT INTO BooksSearch (BooksSearch, rowid, title, author)
+    VALUES ('delete', old.id, old.title, old.author);
+END;
+
+CREATE TRIGGER IF NOT EXISTS Books_search_update
+    AFTER UPDATE OF title, author ON Books
+BEGIN
+    INSERT INTO BooksSearch (BooksSearch, rowid, title, author)
+    VALUES ('delete', old.id, old.title, old.author);
+    INSERT INTO BooksSearch (rowid, title, author)
+    VALUES (new.id, new.title, new.author);
+END;
+
+-- Index the books that are already there
+INSERT INTO BooksSearch (BooksSearch) VALUES ('rebuild');
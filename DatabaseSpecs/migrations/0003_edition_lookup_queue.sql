@@ -0,0 +1,22 @@
+/*
+Queue of Books rows still waiting for an Open Library edition (ISBN and
+cover).  Rows are added when a work is stored straight from search data, and
+drained in the background by edition_enrichment.py.
+ */
+
+-- Jobs refer to Books ids, so they can't outlive a rebuild of Books
+DROP TABLE IF EXISTS EditionLookups;
+
+CREATE TABLE EditionLookups
+(
+    bookId      INTEGER NOT NULL PRIMARY KEY REFERENCES Books (id) ON DELETE CASCADE,
+    editionKeys TEXT    NOT NULL,           -- comma separated, in Open Library's order
+    checked     INTEGER NOT NULL DEFAULT 0, -- how many of editionKeys have been looked at
+    attempts    INTEGER NOT NULL DEFAULT 0, -- failed Open Library calls so far
+    nextAttempt REAL    NOT NULL,           -- unix time; pushed ahead while a worker holds the job
+    dateQueued  REAL    NOT NULL
+);
+
+-- The worker picks the jobs that are due, oldest first
+CREATE INDEX EditionLookups_nextAttempt
+    ON EditionLookups (nextAttempt);
@@ -0,0 +1,68 @@
+/*
+Per-user counts of the trades on a user's listings, for the badges shown on
+every page: requests waiting for the user to review (statusId 2) and accepted
+trades still to complete (statusId 3).  Kept exact by the triggers on Trades
+below; `python consistency.py` recomputes them and reports any drift.
+ */
+
+-- Counters are derived from Trades, so they are rebuilt along with it
+DROP TABLE IF EXISTS UserTradeCounters;
+
+CREATE TABLE UserTradeCounters
+(
+    userId           INTEGER NOT NULL PRIMARY KEY REFERENCES Users (id) ON DELETE CASCADE,
+    numTradeRequests INTEGER NOT NULL DEFAULT 0,
+    numOpenTrades    INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS Trades_counters_insert
+    AFTER INSERT ON Trades
+    WHEN new.statusId IN (2, 3)
+BEGIN
+    INSERT OR IGNORE INTO UserTradeCounters (userId)
+    SELECT userId FROM UserBooks WHERE id = new.userBookId;
+    UPDATE UserTradeCounters
+    SET numTradeRequests = numTradeRequests + (new.statusId = 2),
+        numOpenTrades    = numOpenTrades + (new.statusId = 3)
+    WHERE userId = (SELECT userId FROM UserBooks WHERE id = new.userBookId);
+END;
+
+CREATE TRIGGER IF NOT EXISTS Trades_counters_delete
+    AFTER DELETE ON Trades
+    WHEN old.statusId IN (2, 3)
+BEGIN
+    UPDATE UserTradeCounters
+    SET numTradeRequests = numTradeRequests - (old.statusId = 2),
+        numOpenTrades    = numOpenTrades - (old.statusId = 3)
+    WHERE userId = (SELECT userId FROM UserBooks WHERE id = old.userBookId);
+END;
+
+CREATE TRIGGER IF NOT EXISTS Trades_counters_update
+    AFTER UPDATE OF statusId, userBookId ON Trades
+    WHEN old.statusId IN (2, 3) OR new.statusId IN (2, 3)
+BEGIN
+    UPDATE UserTradeCounters
+    SET numTradeRequests = numTradeRequests - (old.statusId = 2),
+        numOpenTrades    = numOpenTrades - (old.statusId = 3)
+    WHERE userId = (SELECT userId FROM UserBooks WHERE id = old.userBookId);
+    INSERT OR IGNORE INTO UserTradeCounters (userId)
+    SELECT userId FROM UserBooks WHERE id = new.userBookId;
+    UPDATE UserTradeCounters
+    SET numTradeRequests = numTradeRequests + (new.statusId = 2),
+        numOpenTrades    = numOpenTrades + (new.statusId = 3)
+    WHERE userId = (SELECT userId FROM UserBooks WHERE id = new.userBookId);
+END;
+
+-- Count the trades that are already there
+INSERT INTO UserTradeCounters (userId, numTradeRequests, numOpenTrades)
+SELECT
+    UserBooks.userId,
+    COUNT(CASE WHEN Trades.statusId = 2 THEN 1 END),
+    COUNT(CASE WHEN Trades.statusId = 3 THEN 1 END)
+FROM
+    Trades INNER JOIN
+    UserBooks ON Trades.userBookId = UserBooks.id
+WHERE
+    Trades.statusId IN (2, 3)
+GROUP BY
+    UserBooks.userId;
@@ -0,0 +1,49 @@
+/*
+Version counters for the data behind cached queries (see query_cache.py).
+Every write that changes what a listing shows bumps the 'listings' version,
+from whichever code path or worker process makes it, so each process can tell
+whether its cached results are still current with one primary key read.
+ */
+
+CREATE TABLE IF NOT EXISTS DataVersions
+(
+    name    TEXT    NOT NULL PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+-- Also runs after a reset of the sample data, which must invalidate caches too
+INSERT INTO DataVersions (name, version) VALUES ('listings', 1)
+ON CONFLICT (name) DO UPDATE SET version = version + 1;
+
+-- Listings added, removed, re-priced, or made (un)available
+CREATE TRIGGER IF NOT EXISTS UserBooks_version_insert
+    AFTER INSERT ON UserBooks
+BEGIN
+    UPDATE DataVersions SET version = version + 1 WHERE name = 'listings';
+END;
+
+CREATE TRIGGER IF NOT EXISTS UserBooks_version_delete
+    AFTER DELETE ON UserBooks
+BEGIN
+    UPDATE DataVersions SET version = version + 1 WHERE name = 'listings';
+END;
+
+CREATE TRIGGER IF NOT EXISTS UserBooks_version_update
+    AFTER UPDATE ON UserBooks
+BEGIN
+    UPDATE DataVersions SET version = version + 1 WHERE name = 'listings';
+END;
+
+-- Details shown alongside listings: book details (e.g. a cover found later)
+-- and the listing user's name
+CREATE TRIGGER IF NOT EXISTS Books_version_update
+    AFTER UPDATE OF title, author, ISBN, coverImageUrl, externalLink ON Books
+BEGIN
+    UPDATE DataVersions SET version = version + 1 WHERE name = 'listings';
+END;
+
+CREATE TRIGGER IF NOT EXISTS Users_version_update
+    AFTER UPDATE OF username ON Users
+BEGIN
+    UPDATE DataVersions SET version = version + 1 WHERE name = 'listings';
+END;
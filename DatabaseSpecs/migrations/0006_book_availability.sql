@@ -0,0 +1,91 @@
+/*
+Per-book summary of the copies available to trade: how many there are, the
+fewest points one costs and when the newest was listed.  Books with no
+available copies have no row.  Kept up to date one listing at a time by the
+triggers on UserBooks below, so wishlist and search pages read one row per
+book instead of aggregating its copies; `python consistency.py` recomputes
+it and reports any drift, and `python consistency.py --rebuild` rebuilds it.
+ */
+
+-- Derived from UserBooks, so rebuilt along with it
+DROP TABLE IF EXISTS BookAvailability;
+
+CREATE TABLE BookAvailability
+(
+    bookId         INTEGER NOT NULL PRIMARY KEY REFERENCES Books (id) ON DELETE CASCADE,
+    availableCount INTEGER NOT NULL,
+    minPoints      INTEGER,
+    newestListing  DATETIME
+);
+
+-- A copy becoming available can only raise the count, lower the minimum and
+-- move the newest listing later.  A copy going away only needs the minimum
+-- or newest listing looked up again if it was that copy.
+CREATE TRIGGER IF NOT EXISTS UserBooks_availability_insert
+    AFTER INSERT ON UserBooks
+    WHEN new.available = 1 AND new.bookId IS NOT NULL
+BEGIN
+    INSERT INTO BookAvailability (bookId, availableCount, minPoints, newestListing)
+    VALUES (new.bookId, 1, new.points, new.dateCreated)
+    ON CONFLICT (bookId) DO UPDATE
+        SET availableCount = availableCount + 1,
+            minPoints      = min(minPoints, excluded.minPoints),
+            newestListing  = max(newestListing, excluded.newestListing);
+END;
+
+CREATE TRIGGER IF NOT EXISTS UserBooks_availability_delete
+    AFTER DELETE ON UserBooks
+    WHEN old.available = 1
+BEGIN
+    UPDATE BookAvailability
+    SET availableCount = availableCount - 1,
+        minPoints      = CASE
+                             WHEN old.points > minPoints THEN minPoints
+                             ELSE (SELECT min(points) FROM UserBooks WHERE bookId = old.bookId AND available = 1)
+                         END,
+        newestListing  = CASE
+                             WHEN old.dateCreated < newestListing THEN newestListing
+                             ELSE (SELECT max(dateCreated) FROM UserBooks WHERE bookId = old.bookId AND available = 1)
+                         END
+    WHERE bookId = old.bookId;
+    DELETE FROM BookAvailability WHERE bookId = old.bookId AND availableCount <= 0;
+END;
+
+-- The old copy goes away and the new one arrives; UserBooks already holds the
+-- new values when the minimum and newest listing are looked up again
+CREATE TRIGGER IF NOT EXISTS UserBooks_availability_update
+    AFTER UPDATE OF bookId, points, dateCreated, available ON UserBooks
+    WHEN old.available = 1 OR new.available = 1
+BEGIN
+    UPDATE BookAvailability
+    SET availableCount = availableCount - 1,
+        minPoints      = CASE
+                             WHEN old.points > minPoints THEN minPoints
+                             ELSE (SELECT min(points) FROM UserBooks WHERE bookId = old.bookId AND available = 1)
+                         END,
+        newestListing  = CASE
+                             WHEN old.dateCreated < newestListing THEN newestListing
+                             ELSE (SELECT max(dateCreated) FROM UserBooks WHERE bookId = old.bookId AND available = 1)
+                         END
+    WHERE bookId = old.bookId AND old.available = 1;
+    DELETE FROM BookAvailability WHERE bookId = old.bookId AND availableCount <= 0;
+    INSERT INTO BookAvailability (bookId, availableCount, minPoints, newestListing)
+    SELECT new.bookId, 1, new.points, new.dateCreated
+    WHERE new.available = 1 AND new.bookId IS NOT NULL
+    ON CONFLICT (bookId) DO UPDATE
+        SET availableCount = availableCount + 1,
+            minPoints      = min(minPoints, excluded.minPoints),
+            newestListing  = max(newestListing, excluded.newestListing);
+END;
+
+-- The wishlist queries take a user's own copies of a wished book off the count
+CREATE INDEX IF NOT EXISTS UserBooks_available_userId_bookId
+    ON UserBooks (userId, bookId)
+    WHERE available = 1;
+
+-- Summarise the copies that are already there
+INSERT INTO BookAvailability (bookId, availableCount, minPoints, newestListing)
+SELECT bookId, COUNT(*), min(points), max(dateCreated)
+FROM UserBooks
+WHERE available = 1 AND bookId IS NOT NULL
+GROUP BY bookId;
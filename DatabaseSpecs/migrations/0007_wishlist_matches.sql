@@ -0,0 +1,81 @@
+/*
+"Now available" notices for wishlists.  Every listing that becomes available
+is queued in WishlistMatchQueue by the triggers on UserBooks below;
+wishlist_matches.py matches queued listings against wishlists in batches,
+through the bookId -> wishlist index, and writes one WishlistInbox row per
+user and book.  WishlistInboxCounts keeps each user's unseen count for the
+badge, so it is read with one primary key lookup.
+ */
+
+-- Inverted index: the wishlists wanting a book (the primary key only finds a
+-- wishlist's books)
+CREATE INDEX IF NOT EXISTS WishlistsBooks_bookId
+    ON WishlistsBooks (bookId, wishlistId);
+
+-- Queued listings and notices refer to UserBooks ids, so they can't outlive a
+-- rebuild of UserBooks
+DROP TABLE IF EXISTS WishlistMatchQueue;
+DROP TABLE IF EXISTS WishlistInbox;
+DROP TABLE IF EXISTS WishlistInboxCounts;
+
+CREATE TABLE WishlistMatchQueue
+(
+    userBookId INTEGER NOT NULL PRIMARY KEY REFERENCES UserBooks (id) ON DELETE CASCADE,
+    dateQueued REAL    NOT NULL
+);
+
+CREATE TABLE WishlistInbox
+(
+    userId     INTEGER  NOT NULL REFERENCES Users (id) ON DELETE CASCADE,
+    bookId     INTEGER  NOT NULL REFERENCES Books (id) ON DELETE CASCADE,
+    userBookId INTEGER  NOT NULL,           -- the latest listing of the book
+    dateAdded  DATETIME NOT NULL DEFAULT current_timestamp,
+    seen       INTEGER  NOT NULL DEFAULT 0,
+    PRIMARY KEY (userId, bookId)
+);
+
+CREATE TABLE WishlistInboxCounts
+(
+    userId INTEGER NOT NULL PRIMARY KEY REFERENCES Users (id) ON DELETE CASCADE,
+    unseen INTEGER NOT NULL DEFAULT 0
+);
+
+-- New listings, and copies made available again (e.g. a rejected trade)
+CREATE TRIGGER IF NOT EXISTS UserBooks_match_insert
+    AFTER INSERT ON UserBooks
+    WHEN new.available = 1
+BEGIN
+    INSERT OR IGNORE INTO WishlistMatchQueue (userBookId, dateQueued)
+    VALUES (new.id, (julianday('now') - 2440587.5) * 86400.0);
+END;
+
+CREATE TRIGGER IF NOT EXISTS UserBooks_match_update
+    AFTER UPDATE OF available ON UserBooks
+    WHEN old.available = 0 AND new.available = 1
+BEGIN
+    INSERT OR IGNORE INTO WishlistMatchQueue (userBookId, dateQueued)
+    VALUES (new.id, (julianday('now') - 2440587.5) * 86400.0);
+END;
+
+CREATE TRIGGER IF NOT EXISTS WishlistInbox_counts_insert
+    AFTER INSERT ON WishlistInbox
+    WHEN new.seen = 0
+BEGIN
+    INSERT INTO WishlistInboxCounts (userId, unseen) VALUES (new.userId, 1)
+    ON CONFLICT (userId) DO UPDATE SET unseen = unseen + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS WishlistInbox_counts_update
+    AFTER UPDATE OF seen ON WishlistInbox
+    WHEN (old.seen = 0) != (new.seen = 0)
+BEGIN
+    INSERT INTO WishlistInboxCounts (userId, unseen) VALUES (new.userId, (new.seen = 0) - (old.seen = 0))
+    ON CONFLICT (userId) DO UPDATE SET unseen = unseen + excluded.unseen;
+END;
+
+CREATE TRIGGER IF NOT EXISTS WishlistInbox_counts_delete
+    AFTER DELETE ON WishlistInbox
+    WHEN old.seen = 0
+BEGIN
+    UPDATE WishlistInboxCounts SET unseen = unseen - 1 WHERE userId = old.userId;
+END;
@@ -0,0 +1,8 @@
+/*
+Indexes that hand back the paged lists in cursor order, so each page starts
+at the previous page's last row instead of sorting the whole list again.
+ */
+
+-- get_all_open_requests: a user's requests, newest first (the rowid breaks ties)
+CREATE INDEX IF NOT EXISTS Trades_userRequestedId_dateInitiated
+    ON Trades (userRequestedId, dateInitiated);
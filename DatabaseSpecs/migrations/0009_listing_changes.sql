@@ -0,0 +1,68 @@
+/*
+Change log for the listing export (listing_export.py).  ListingChanges has one
+row per listing with the `version` of its latest change: a counter that goes
+up by one with every change to a listing, or to the book details or username
+exported with it.  `/api/listings/export?since=N` sends only the listings
+whose version is above N, found through the unique index on version.  Rows
+outlive their listing, so a removed listing is still reported as removed.
+ */
+
+-- Refers to UserBooks ids, so it can't outlive a rebuild of UserBooks
+DROP TABLE IF EXISTS ListingChanges;
+
+CREATE TABLE ListingChanges
+(
+    userBookId INTEGER NOT NULL PRIMARY KEY,
+    version    INTEGER NOT NULL UNIQUE
+);
+
+CREATE TRIGGER IF NOT EXISTS UserBooks_changes_insert
+    AFTER INSERT ON UserBooks
+BEGIN
+    INSERT INTO ListingChanges (userBookId, version)
+    VALUES (new.id, (SELECT coalesce(max(version), 0) + 1 FROM ListingChanges))
+    ON CONFLICT (userBookId) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS UserBooks_changes_update
+    AFTER UPDATE OF userId, bookId, copyQualityId, points, dateCreated, available ON UserBooks
+BEGIN
+    INSERT INTO ListingChanges (userBookId, version)
+    VALUES (new.id, (SELECT coalesce(max(version), 0) + 1 FROM ListingChanges))
+    ON CONFLICT (userBookId) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS UserBooks_changes_delete
+    AFTER DELETE ON UserBooks
+BEGIN
+    INSERT INTO ListingChanges (userBookId, version)
+    VALUES (old.id, (SELECT coalesce(max(version), 0) + 1 FROM ListingChanges))
+    ON CONFLICT (userBookId) DO UPDATE SET version = excluded.version;
+END;
+
+-- Book details and usernames are exported with every listing of the book or
+-- user, so each of those listings gets a new version
+CREATE TRIGGER IF NOT EXISTS Books_changes_update
+    AFTER UPDATE OF title, author, ISBN, coverImageUrl ON Books
+BEGIN
+    INSERT INTO ListingChanges (userBookId, version)
+    SELECT id, (SELECT coalesce(max(version), 0) FROM ListingChanges) + row_number() OVER (ORDER BY id)
+    FROM UserBooks
+    WHERE bookId = new.id
+    ON CONFLICT (userBookId) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS Users_changes_update
+    AFTER UPDATE OF username ON Users
+BEGIN
+    INSERT INTO ListingChanges (userBookId, version)
+    SELECT id, (SELECT coalesce(max(version), 0) FROM ListingChanges) + row_number() OVER (ORDER BY id)
+    FROM UserBooks
+    WHERE userId = new.id
+    ON CONFLICT (userBookId) DO UPDATE SET version = excluded.version;
+END;
+
+-- The listings that are already there, oldest first
+INSERT INTO ListingChanges (userBookId, version)
+SELECT id, row_number() OVER (ORDER BY id)
+FROM UserBooks;
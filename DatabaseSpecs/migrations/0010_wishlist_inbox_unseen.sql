@@ -0,0 +1,7 @@
+/*
+The wishlist page reads a user's unseen notices, newest first, straight from
+this index; seen notices are never read again.
+ */
+
+CREATE INDEX IF NOT EXISTS WishlistInbox_userId_seen_dateAdded
+    ON WishlistInbox (userId, seen, dateAdded);
@@ -0,0 +1,60 @@
+/*
+UserBooks.points may be NULL, and SQLite's scalar min() and max() return NULL
+if either argument is, so a copy listed without points wiped out its book's
+BookAvailability.minPoints (and one without a date, newestListing) until the
+next lookup.  The triggers that add a copy now keep the other value, as the
+min() and max() aggregates in `python consistency.py` do, and every book's
+summary is recomputed in case it has already drifted.
+ */
+
+DROP TRIGGER IF EXISTS UserBooks_availability_insert;
+DROP TRIGGER IF EXISTS UserBooks_availability_update;
+
+CREATE TRIGGER UserBooks_availability_insert
+    AFTER INSERT ON UserBooks
+    WHEN new.available = 1 AND new.bookId IS NOT NULL
+BEGIN
+    INSERT INTO BookAvailability (bookId, availableCount, minPoints, newestListing)
+    VALUES (new.bookId, 1, new.points, new.dateCreated)
+    ON CONFLICT (bookId) DO UPDATE
+        SET availableCount = availableCount + 1,
+            minPoints      = coalesce(min(minPoints, excluded.minPoints), minPoints, excluded.minPoints),
+            newestListing  = coalesce(max(newestListing, excluded.newestListing), newestListing,
+                                      excluded.newestListing);
+END;
+
+-- The old copy goes away and the new one arrives; UserBooks already holds the
+-- new values when the minimum and newest listing are looked up again
+CREATE TRIGGER UserBooks_availability_update
+    AFTER UPDATE OF bookId, points, dateCreated, available ON UserBooks
+    WHEN old.available = 1 OR new.available = 1
+BEGIN
+    UPDATE BookAvailability
+    SET availableCount = availableCount - 1,
+        minPoints      = CASE
+                             WHEN old.points > minPoints THEN minPoints
+                             ELSE (SELECT min(points) FROM UserBooks WHERE bookId = old.bookId AND available = 1)
+                         END,
+        newestListing  = CASE
+                             WHEN old.dateCreated < newestListing THEN newestListing
+                             ELSE (SELECT max(dateCreated) FROM UserBooks WHERE bookId = old.bookId AND available = 1)
+                         END
+    WHERE bookId = old.bookId AND old.available = 1;
+    DELETE FROM BookAvailability WHERE bookId = old.bookId AND availableCount <= 0;
+    INSERT INTO BookAvailability (bookId, availableCount, minPoints, newestListing)
+    SELECT new.bookId, 1, new.points, new.dateCreated
+    WHERE new.available = 1 AND new.bookId IS NOT NULL
+    ON CONFLICT (bookId) DO UPDATE
+        SET availableCount = availableCount + 1,
+            minPoints      = coalesce(min(minPoints, excluded.minPoints), minPoints, excluded.minPoints),
+            newestListing  = coalesce(max(newestListing, excluded.newestListing), newestListing,
+                                      excluded.newestListing);
+END;
+
+DELETE FROM BookAvailability;
+
+INSERT INTO BookAvailability (bookId, availableCount, minPoints, newestListing)
+SELECT bookId, COUNT(*), min(points), max(dateCreated)
+FROM UserBooks
+WHERE available = 1 AND bookId IS NOT NULL
+GROUP BY bookId;
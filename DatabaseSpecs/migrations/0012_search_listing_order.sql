@@ -0,0 +1,9 @@
+/*
+Search results page through each matched book's available copies by
+(dateCreated, id), the cursor search_local_books hands out; this index reads
+them in that order.
+ */
+
+CREATE INDEX IF NOT EXISTS UserBooks_available_bookId_dateCreated
+    ON UserBooks (bookId, dateCreated, id)
+    WHERE available = 1;
@@ -1,5 +1,19 @@
+import os
 import sys
 import sqlite3
+import db_connector
+import edition_enrichment
+import listing_export
+import log_config
+import metrics
+import migrations
+import openlibrary
+import openlibrary_cache
+import query_cache
+import sql_trace
+import template_cache
+import wishlist_matches
+import time
 from book_search import BookSearch
 from wishlists import Wishlists
 from my_requests import MyRequests
@@ -8,48 +22,122 @@ from cancel_request import CancelTradeRequest
 from book_received import BookReceived
 from flask import Flask, render_template, url_for, flash, redirect, session, g, json
 from flask import request as req
-from db_connector import get_db, BookSwapDatabase, get_bsdb
+from flask.ctx import _AppCtxGlobals
+from db_connector import get_db, release_db, pool_stats, BookSwapDatabase, get_bsdb
 from forms import (RegistrationForm, LoginForm, BookSearchForm,
                    AccountSettingsChangeForm, PasswordChangeForm)
 from auth import login_required, guest_required
 import logging
 
-app = Flask(__name__)
+class BookSwapGlobals(_AppCtxGlobals):
+    """
+    Flask's `g`, plus the logged-in user's summary (g.username, g.points,
+    g.num_trade_requests, g.num_open_trades, g.num_wishlist_matches).  The summary is looked up with
+    one query the first time a view or template reads any of it, so requests
+    that never show it (static files, redirects, JSON) don't touch the
+    database.
+    """
+    USER_SUMMARY = {"username": "username",
+                    "points": "points",
+                    "num_trade_requests": "numTradeRequests",
+                    "num_open_trades": "numOpenTrades",
+                    "num_wishlist_matches": "numWishlistMatches"}
+
+    def __getattr__(self, name):
+        if (name in self.USER_SUMMARY and self.__dict__.get("user_num") is not None
+                and not self.__dict__.get("_user_summary_loaded")):
+            self._load_user_summary()
+            if name in self.__dict__:
+                return self.__dict__[name]
+        raise AttributeError(name)
+
+    def _load_user_summary(self):
+        self._user_summary_loaded = True
+        try:
+            summary = get_bsdb().get_user_summary(self.user_num)
+        except (sqlite3.Error, db_connector.PoolTimeoutError):
+            app.logger.error("Error setting up g")
+            summary = None
+        if summary is None:
+            session['user_num'] = None
+            return
+        for name, column in self.USER_SUMMARY.items():
+            setattr(self, name, summary[column])
+        app.logger.debug("Current user status: %s", dict(summary))
+
+
+# Log records are written by a background thread, see log_config
+log_config.configure()
+
+# Named for the logger log_config sets up rather than __name__, which depends
+# on how the app is started ('__main__' with `python app.py`)
+app = Flask(log_config.LOGGER, root_path=os.path.dirname(os.path.abspath(__file__)))
+app.app_ctx_globals_class = BookSwapGlobals
 
 # Secret Key for Flask Forms security
 app.config['SECRET_KEY'] = '31c46d586e5489fa9fbc65c9d8fd21ed'
 
+# The /_*-stats routes do work on every hit, so they are off unless
+# BOOKSWAP_STATS=1; /metrics has the same figures for every worker
+STATS_ROUTES = os.environ.get('BOOKSWAP_STATS', '0') == '1'
 
-# Code automatically created with each request
+# Templates are compiled now, not by the first request for each; see template_cache
+template_cache.configure(app)
+
+# Finds editions for newly searched works in the background, if enabled
+if db_connector.DEFER_EDITION_LOOKUPS:
+    edition_enrichment.start_worker()
+
+
+# Records the SQL run by each request, see sql_trace, and the request's metrics
 @app.before_request
-def populate_g():
-    bsdb = get_bsdb()
-    user_num = session.get("user_num")
-    if user_num is not None:
-        try:
-            user_info = bsdb.get_account_settings(user_num)
-            g.username = user_info["username"]
-            g.points = user_info["points"]
-            g.num_trade_requests = bsdb.get_num_trade_requests(user_num)
-            g.num_open_trades = bsdb.get_num_open_trades(user_num)
-            app.logger.info(f"Request made.  Current user status:"
-                            f"\t g.username: {g.username}" +
-                            f"\t g.points: {g.points}"
-                            f"\t g.num_trade_requests: {g.num_trade_requests}" +
-                            f"\t g.num_open_trades: {g.num_open_trades}")
+def start_sql_trace():
+    g._request_start = time.perf_counter()
+    g._sql_log, g._sql_log_token = sql_trace.start()
+
+
+@app.after_request
+def report_sql_trace(response):
+    statements = getattr(g, "_sql_log", None)
+    if statements is None:
+        return response
+    request_ms = (time.perf_counter() - g._request_start) * 1000
+    endpoint = req.endpoint or "none"
+    metrics.inc("bookswap_http_requests_total", endpoint=endpoint, method=req.method, status=response.status_code)
+    metrics.observe("bookswap_http_request_duration_seconds", request_ms / 1000,
+                    endpoint=endpoint, method=req.method, status=response.status_code)
+    metrics.observe("bookswap_db_request_seconds", statements.total_ms / 1000, endpoint=endpoint)
+    metrics.inc("bookswap_db_statements_total", statements.count, endpoint=endpoint)
+    metrics.start_flusher()
+    response.headers.add("Server-Timing", f'db;dur={statements.total_ms:.1f};desc="{statements.count} queries"')
+    response.headers.add("Server-Timing", f"total;dur={request_ms:.1f}")
+    for sql, (times, callers) in statements.repeated().items():
+        app.logger.warning("Possible N+1 query: %s ran %d times in %s %s, from %s",
+                           sql, times, req.method, req.path, ", ".join(sorted(callers)))
+    sql_trace.remember({"method": req.method, "path": req.path, "status": response.status_code,
+                        "request_ms": round(request_ms, 3)}, statements)
+    return response
+
+
+@app.teardown_request
+def stop_sql_trace(exception):
+    token = getattr(g, "_sql_log_token", None)
+    if token is not None:
+        sql_trace.stop(token)
+        g._sql_log_token = None
 
 
-        except Exception:
-            app.logger.error(f"Error setting up g")
-            session['user_num'] = None
+# Code automatically created with each request
+@app.before_request
+def populate_g():
+    # The user's summary is looked up lazily, see BookSwapGlobals
+    g.user_num = session.get("user_num")
 
 
-# Auto-closes db connection at the end of each request
+# Returns the db connection to the pool at the end of each request
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
-    if db is not None:
-        db.close()
+    release_db()
 
 
 # Landing Page
@@ -175,12 +263,18 @@ def browse_books():
     recent_books_arr = [dict(book) for book in recent_books]
     local_results = {}
     external_results = {}
+    local_next = None
+    after = req.form.get('after')
     if req.method == 'POST':
         book_search_query = (form.ISBN.data, form.author.data, form.title.data)
         book_search = BookSearch(book_search_query, bsdb)
         # TODO magic numbers here
-        # book_results = book_search.local_book_search(10)
-        local_results, external_results = book_search.combined_book_search(10, 10)
+        if after:
+            # "More listings": the next page of local results only
+            local_results = book_search.local_book_search(10, after)
+        else:
+            local_results, external_results = book_search.combined_book_search(10, 10)
+        local_next = local_results.next_cursor
         show_recent = False
         show_search = False
         show_results = True
@@ -194,7 +288,7 @@ def browse_books():
     if session.get('user_num'):
         try:
             points_available = bsdb.get_current_user_points(session['user_num'])
-            app.logger.info(f"User {session['user_num']} has {points_available} points.")
+            app.logger.info("User %s has %s points.", session['user_num'], points_available)
         except Exception:
             app.logger.error(
                 f"APP: Browse_books -- Could not determine number of points for user {session['user_num']}.")
@@ -206,11 +300,9 @@ def browse_books():
     else:
         points_available = 0
 
-    app.logger.info(f"\n\t recent_books: {recent_books_arr}" +
-                    f"\t local_results: {local_results}" +
-                    f"\t external_results: {external_results}" +
-                    f"\t form: {form}" +
-                    f"\t Visiting user has {points_available} points available.")
+    app.logger.debug("\n\t recent_books: %s\t local_results: %s\t external_results: %s\t form: %r"
+                     "\t Visiting user has %s points available.",
+                     recent_books_arr, local_results, external_results, form, points_available)
     return render_template('browse-books.html',
                            recent_books=recent_books_arr,
                            local_results=local_results,
@@ -219,7 +311,9 @@ def browse_books():
                            show_recent=show_recent,
                            show_search=show_search,
                            show_results=show_results,
-                           points_available=points_available
+                           points_available=points_available,
+                           local_next=local_next,
+                           more_listings=bool(after)
                            )
 
 
@@ -267,15 +361,18 @@ def change_points():
 def received_requests():
     bsdb = get_bsdb()
     user = session['user_num']
-    num_trade_reqs = bsdb.get_num_trade_requests(user)
-    num_open_trades = bsdb.get_num_open_trades(user)
+    # Same counts as the badges in the layout, so read them once through g
+    num_trade_reqs = g.num_trade_requests
+    num_open_trades = g.num_open_trades
     if num_trade_reqs == 0 and num_open_trades == 0:
         return render_template('user/no-trades.html')
     else:
-        trade_info = bsdb.get_trade_info(user)
+        # The page only shows requested and accepted trades
+        trade_info = bsdb.get_trade_info(user, statuses=(2, 3), after=req.args.get('after'))
         trade_info_dicts = [dict(row) for row in trade_info]
         return render_template('user/received-requests.html',
                                trade_info=trade_info_dicts,
+                               next_cursor=trade_info.next_cursor,
                                num_open_trades=num_open_trades,
                                num_trade_reqs=num_trade_reqs)
 
@@ -286,11 +383,12 @@ def my_requests():
     bsdb = get_bsdb()
     user = session['user_num']
     my_request = MyRequests(user, bsdb)
+    next_cursor = None
     try:
-        requests = my_request.get_all_open_requests()
+        requests = my_request.get_all_open_requests(req.args.get('after'))
         requests_dicts = [dict(row) for row in requests]
-        for trade in requests_dicts:
-            print(trade['tradeAge'])
+        next_cursor = requests.next_cursor
+        app.logger.debug("User %s has %d open requests on this page", user, len(requests_dicts))
     except Exception:
         app.logger.error("Couldn't fill my-requests")
         requests_dicts = []
@@ -298,7 +396,7 @@ def my_requests():
     if len(requests_dicts) == 0:
         return render_template('user/no-trades.html', no_sent_requests=True)
     else:
-        return render_template('user/my-requests.html', requests=requests_dicts)
+        return render_template('user/my-requests.html', requests=requests_dicts, next_cursor=next_cursor)
 
 
 @app.route('/accept-trade/<user_books_id>')
@@ -434,15 +532,15 @@ def signup():
 def wishlist():
     bsdb = get_bsdb()
     wishlists = Wishlists(session['user_num'], bsdb)
-    data = req.get_json()
+    data = req.get_json(silent=True)  # None on a page load
     # User asks to see copies of a book
     if req.method == "POST" and data.get("request") == "copiesModal":
         book = eval(data['book'])
-        app.logger.info(f"Request incoming for copies of book {book} from user {session['user_num']}")
+        app.logger.info("Request incoming for copies of book %s from user %s", book, session['user_num'])
         try:
-            copies = bsdb.get_available_copies(book["bookId"], session["user_num"])
+            copies = bsdb.get_available_copies(book["bookId"], session["user_num"], after=data.get("after"))
             copies_arr = [dict(copy) for copy in copies]
-            app.logger.info(f"Copies available: {copies_arr}")
+            app.logger.debug("Copies available: %s", copies_arr)
         except Exception:
             app.logger.error(f"Error retrieving copies of {book} for user {session['user_num']}")
             flash("Error retrieving copies of the book.  Maybe try again?", "warning")
@@ -450,7 +548,8 @@ def wishlist():
         return {
             "title": copies_arr[0]['title'],
             "copies": copies_arr,
-            "count": len(copies_arr),
+            "count": book.get("numberAvailable", len(copies_arr)),
+            "next": copies.next_cursor,
             "points_available": g.points
         }
     # Page load
@@ -461,7 +560,15 @@ def wishlist():
         app.logger.error(f"Error making wishlists for user {session['user_num']}")
         flash("We had an error fetching your wishlist", "warning")
         books = []
-    return render_template('user/wishlist.html', books=books)
+    # Books listed since the user last looked; showing them clears the badge
+    try:
+        matches = [dict(match) for match in bsdb.get_wishlist_matches(session['user_num'])]
+        if matches:
+            bsdb.mark_wishlist_matches_seen(session['user_num'], matches)
+    except Exception:
+        app.logger.error(f"Error getting wishlist notices for user {session['user_num']}")
+        matches = []
+    return render_template('user/wishlist.html', books=books, matches=matches)
 
 
 @app.route('/add-to-wishlist/<bookid>', methods=['GET'])
@@ -470,7 +577,6 @@ def wishlist():
 def add_to_wish(bookid=None):
     bsdb = get_bsdb()
     db = get_db()
-    db.row_factory = sqlite3.Row
 
     # Queries used for SELECTing and INSERTing
     get_books_isbn_query = 'SELECT * FROM Books WHERE ISBN = ?'
@@ -496,7 +602,6 @@ def add_to_wish(bookid=None):
             app.logger.info(f"Book {id} successfully added to " +
                             f"user {session['user_num']}'s wishlist")
         db.commit()
-        db.close()
         return redirect(url_for('browse_books'))
     data = req.args.get("isbn")
     if data == "":
@@ -526,7 +631,6 @@ def add_to_wish(bookid=None):
         flash("Book already in your wishlist.", "warning")
         app.logger.warning(f"Book {bookId} attempted to add to wishlist {wishlist}, but it was already in that list.")
     db.commit()
-    db.close()
     return redirect('/wishlist')
 
 
@@ -534,8 +638,6 @@ def add_to_wish(bookid=None):
 @login_required
 def remove_wish():
     db = get_db()
-    db.row_factory = sqlite3.Row
-
     c = db.cursor()
 
     wishID = req.args.get("wishlistRem")
@@ -545,7 +647,6 @@ def remove_wish():
     c.execute("DELETE FROM WishlistsBooks WHERE wishlistId = ? AND bookId = (SELECT id FROM Books WHERE title = ?)",
               (wishID, bookID))
     db.commit()
-    db.close()
 
     return redirect('/wishlist')
 
@@ -713,17 +814,20 @@ def search_book():
 @login_required
 def remove_book():
     db = get_db()
-    db.row_factory = sqlite3.Row
-
     c = db.cursor()
 
     bookID = req.args.get("bookRem")
-    c.execute("DELETE FROM UserBooks WHERE id = ?",
-              (bookID,))
+    try:
+        c.execute("DELETE FROM UserBooks WHERE id = ?",
+                  (bookID,))
+    except sqlite3.IntegrityError:
+        # Foreign keys are enforced, so books with trade history stay put
+        app.logger.warning(f"Book {bookID} has trade history and cannot be removed")
+        flash("That book has trade history, so it can't be removed.", "warning")
+        return redirect('/my-books')
     new_points = c.execute("SELECT points FROM Users WHERE id = (?)", (session['user_num'],)).fetchone()['points'] - 0.1
     c.execute("""UPDATE Users SET points = (?) WHERE id = (?)""", (new_points, session['user_num']))
     db.commit()
-    db.close()
     app.logger.info(f"Book {bookID} removed from user {session['user_num']}")
     flash("Book removed from your BookSwap library.", "success")
     return redirect('/my-books')
@@ -734,7 +838,7 @@ def remove_book():
 def my_books():
     bsdb = get_bsdb()
     # Get the data of books currently listed
-    rows = bsdb.get_listed_books(session['user_num'])
+    rows = bsdb.get_listed_books(session['user_num'], after=req.args.get('after'))
     copyqualities = bsdb.get_book_qualities()
     # Build the data to be passed to Jinja
     headers = ["Title", "Author", "Quality", "Points", "ISBN", "ID", "Cover"]
@@ -742,7 +846,8 @@ def my_books():
     data = {"headers": headers,
             "rows": table_content,
             "caption": "",
-            "copyqualities": copyqualities
+            "copyqualities": copyqualities,
+            "next_cursor": rows.next_cursor
             }
     return render_template('user/my-books.html', data=data)
 
@@ -756,17 +861,130 @@ def logout():
 @app.route('/reset-db')
 def reset_db():
     """
-    A "secret" route for resetting database specs and content.
+    A "secret" route for resetting database specs and content.  This throws
+    away all data; to upgrade an existing database in place, run
+    `python migrations.py` instead.
     """
-    with app.app_context():
+    with app.app_context(), sql_trace.untraced():
         db = get_db()
+        # Dropping populated tables trips the foreign key checks
+        db.commit()
+        db.execute("PRAGMA foreign_keys = OFF")
         with app.open_resource('DatabaseSpecs/database-definition-queries.sql',
                                mode='r') as f:
             db.cursor().executescript(f.read())
         db.commit()
+        db.execute("PRAGMA foreign_keys = ON")
+        # The tables were rebuilt from scratch, so re-apply every migration
+        db.execute("PRAGMA user_version = 0")
+        migrations.upgrade(db)
     return "Database reset :)"
 
 
+@app.route('/_db-pool-stats')
+def db_pool_stats():
+    """
+    Reports this worker's database connection pool counters.  Only available
+    with BOOKSWAP_STATS=1.
+    """
+    if not STATS_ROUTES:
+        return error_four_oh_four(None)
+    return pool_stats()
+
+
+@app.route('/_openlibrary-stats')
+def openlibrary_stats():
+    """
+    Reports this worker's Open Library call counts and latencies, and its
+    response cache counters.  Only available with BOOKSWAP_STATS=1.
+    """
+    if not STATS_ROUTES:
+        return error_four_oh_four(None)
+    return {"calls": openlibrary.stats(),
+            "cache": openlibrary_cache.stats()}
+
+
+@app.route('/_query-cache-stats')
+def query_cache_stats():
+    """
+    Reports this worker's front-page query cache hits and misses.
+    Only available with BOOKSWAP_STATS=1.
+    """
+    if not STATS_ROUTES:
+        return error_four_oh_four(None)
+    return query_cache.stats()
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """
+    Reports request, database, Open Library and cache metrics for every
+    worker, in the Prometheus text format.
+    """
+    return app.response_class(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/api/listings/export')
+def export_listings():
+    """
+    Streams every available listing with its book details, as NDJSON or
+    (format=csv) CSV, or with `since` only the listings changed after that
+    version.  See listing_export.py.
+    """
+    fmt = req.args.get('format', 'ndjson')
+    if fmt not in listing_export.FORMATS:
+        return {"error": f"format must be one of {', '.join(listing_export.FORMATS)}"}, 400
+    since = req.args.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return {"error": "since must be a version number from X-Export-Version"}, 400
+    compress = req.accept_encodings['gzip'] > 0
+    version, body = listing_export.export(fmt, since, compress)
+    response = app.response_class(body, mimetype=listing_export.FORMATS[fmt])
+    response.headers['X-Export-Version'] = str(version)
+    response.headers['Vary'] = 'Accept-Encoding'
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+@app.route('/_sql-debug')
+def sql_debug():
+    """
+    Shows every statement run by this worker's most recent requests, with
+    timings, rows and callers.  Only available with BOOKSWAP_SQL_DEBUG=1.
+    """
+    if not sql_trace.DEBUG:
+        return error_four_oh_four(None)
+    return {"requests": sql_trace.history()}
+
+
+@app.route('/_wishlist-match-stats')
+def wishlist_match_stats():
+    """
+    Reports this worker's wishlist matching counters and the number of
+    listings still waiting to be matched.  Only available
+    with BOOKSWAP_STATS=1.
+    """
+    if not STATS_ROUTES:
+        return error_four_oh_four(None)
+    return wishlist_matches.stats()
+
+
+@app.route('/_edition-lookup-stats')
+def edition_lookup_stats():
+    """
+    Reports this worker's background edition lookup counters and the number
+    of books still waiting for an edition.  Only available
+    with BOOKSWAP_STATS=1.
+    """
+    if not STATS_ROUTES:
+        return error_four_oh_four(None)
+    return edition_enrichment.stats()
+
+
 if __name__ == '__main__':
     """
     `host` keyword arg added by Ben to make it work on his server.  It seems to 
@@ -0,0 +1,4 @@
+"""
+Stand-alone benchmarks.  Run them from the repo root, for example:
+    python -m benchmarks.trade_transactions
+"""
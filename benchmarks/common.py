@@ -0,0 +1,67 @@
+"""
+Helpers shared by the benchmarks: a throwaway copy of the sample database
+and a Flask app context pointed at it.
+"""
+import contextlib
+import os
+import sqlite3
+import tempfile
+import time
+
+from flask import Flask
+
+import db_connector as dbc
+
+SCHEMA = os.path.join(os.path.dirname(__file__), os.pardir, 'DatabaseSpecs', 'database-definition-queries.sql')
+
+
+def make_sample_db(directory=None):
+    """
+    Creates a fresh sample database in a temporary directory and returns its
+        path.
+    """
+    directory = directory or tempfile.mkdtemp(prefix="bookswap-bench-")
+    path = os.path.join(directory, "bookswap.db")
+    conn = sqlite3.connect(path)
+    with open(SCHEMA) as f:
+        conn.executescript(f.read())
+    conn.commit()
+    conn.close()
+    return path
+
+
+@contextlib.contextmanager
+def bench_app(path):
+    """
+    Yields a Flask test request context whose pooled connections point at
+        the database at `path`.
+    """
+    dbc.DATABASE = path
+    app = Flask(__name__)
+    with app.test_request_context():
+        yield app
+        dbc.release_db()
+    dbc.get_pool(path).close_all()
+
+
+class Timer:
+    """
+    Collects per-iteration wall times in milliseconds.
+    """
+
+    def __init__(self):
+        self.samples = []
+
+    @contextlib.contextmanager
+    def time(self):
+        start = time.perf_counter()
+        yield
+        self.samples.append((time.perf_counter() - start) * 1000)
+
+    def summary(self):
+        ordered = sorted(self.samples)
+        n = len(ordered)
+        return {"n": n,
+                "mean_ms": sum(ordered) / n,
+                "p50_ms": ordered[n // 2],
+                "p95_ms": ordered[min(n - 1, int(n * 0.95))]}
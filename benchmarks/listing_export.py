@@ -0,0 +1,117 @@
+"""
+Memory and speed of the streaming listing export.
+
+Adds `listings` extra available listings to a sample database, then exports
+them through /api/listings/export as NDJSON, gzipped NDJSON and CSV, each in
+a fresh process, reading the body as a client would and throwing it away.
+Reports the time taken and the process's peak RSS before and during the
+export; for comparison, "buffered" builds the whole NDJSON body in memory
+first, as a non-streaming endpoint would.  The streaming exports' growth is
+SQLite's page cache and memory-mapped file (see PRAGMAS in db_connector.py),
+so it stops at about 80 MB however many listings there are.
+
+    python -m benchmarks.listing_export [listings]
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import db_connector as dbc
+from benchmarks.common import make_sample_db
+
+BATCH = 50000
+
+
+def add_listings(path, listings):
+    pool = dbc.get_pool(path)
+    db = pool.acquire()
+    try:
+        users = [row[0] for row in db.execute("SELECT id FROM Users")]
+        books = [row[0] for row in db.execute("SELECT id FROM Books")]
+        for start in range(0, listings, BATCH):
+            with dbc.transaction(db):
+                db.executemany("INSERT INTO UserBooks (userId, bookId, copyQualityId, points) VALUES (?, ?, 1, ?)",
+                               [(users[i % len(users)], books[i % len(books)], 1 + i % 5)
+                                for i in range(start, min(start + BATCH, listings))])
+        # Not timed here, and would only grow with the listings
+        with dbc.transaction(db):
+            db.execute("DELETE FROM WishlistMatchQueue")
+        # So the exports don't start by reading a large write-ahead log
+        db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        pool.release(db)
+    pool.close_all()
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # kB on Linux
+
+
+def measure(path, mode):
+    """
+    Runs one export in this process and prints its figures as JSON.
+    """
+    dbc.DATABASE = path
+    from app import app
+    client = app.test_client()
+    client.get(f"/api/listings/export?since={10 ** 12}")  # warm up imports and the pool; sends nothing
+    before = peak_rss_mb()
+    start = time.perf_counter()
+    size = 0
+    if mode == "buffered":
+        db = dbc.get_pool(path).acquire()
+        rows = db.execute("""SELECT ListingChanges.version, UserBooks.id, Books.title, Books.author, Books.ISBN,
+                                    Books.coverImageUrl, UserBooks.points, Users.username, UserBooks.dateCreated
+                             FROM ListingChanges JOIN UserBooks ON UserBooks.id = ListingChanges.userBookId
+                                 JOIN Books ON Books.id = UserBooks.bookId JOIN Users ON Users.id = UserBooks.userId
+                             WHERE UserBooks.available = 1 ORDER BY ListingChanges.version""").fetchall()
+        body = "".join(json.dumps(dict(row)) + "\n" for row in rows).encode()
+        size = len(body)
+    else:
+        url = "/api/listings/export?format=csv" if mode == "csv" else "/api/listings/export"
+        headers = {"Accept-Encoding": "gzip"} if mode == "ndjson+gzip" else {}
+        response = client.get(url, headers=headers, buffered=False)
+        for chunk in response.response:
+            size += len(chunk)
+        response.close()
+    seconds = time.perf_counter() - start
+    print(json.dumps({"mode": mode, "seconds": seconds, "mb": size / 2 ** 20,
+                      "rss_before_mb": before, "rss_peak_mb": peak_rss_mb()}))
+
+
+def run(*args):
+    """
+    Runs this script in a new process and returns its last line of output.
+        Everything heavy happens in child processes: a child's peak RSS
+        starts at its parent's.
+    """
+    out = subprocess.run([sys.executable, "-m", "benchmarks.listing_export", *args],
+                         capture_output=True, text=True, check=True).stdout
+    return out.strip().splitlines()[-1]
+
+
+def main():
+    listings = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    path = make_sample_db()
+    start = time.perf_counter()
+    run("--build", path, str(listings))
+    print(f"Added {listings} listings in {time.perf_counter() - start:.0f} s "
+          f"({os.path.getsize(path) / 2 ** 20:.0f} MB database)")
+    for mode in ("ndjson", "ndjson+gzip", "csv", "buffered"):
+        result = json.loads(run("--measure", path, mode))
+        print(f"  {mode:12} {result['seconds']:6.1f} s  {listings / result['seconds']:8.0f} rows/s  "
+              f"{result['mb']:6.0f} MB sent  peak RSS {result['rss_peak_mb']:5.0f} MB "
+              f"(+{result['rss_peak_mb'] - result['rss_before_mb']:.0f} MB)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 3 and sys.argv[1] == "--build":
+        add_listings(sys.argv[2], int(sys.argv[3]))
+        print("done")
+    elif len(sys.argv) > 3 and sys.argv[1] == "--measure":
+        measure(sys.argv[2], sys.argv[3])
+    else:
+        main()
@@ -0,0 +1,71 @@
+"""
+Local search over tens of thousands of matching listings, through
+BookSearch.local_book_search as the search page runs it.
+
+Lists `listings` copies spread over a few books that match the search in
+overlapping tiers (one by ISBN, author and title; the others by author and
+title, or by title alone), then times the first page of `num` results and
+paging through every match a MAX_PAGE_SIZE page at a time.  Ranking, dedupe
+across tiers and the LIMIT all run in search_local_books' single query.
+
+    python -m benchmarks.local_search [listings] [num]
+"""
+import sys
+
+import db_connector as dbc
+from benchmarks.common import Timer, bench_app, make_sample_db
+from book_search import BookSearch
+
+ISBN = "9780000000017"
+AUTHOR = "Benchmark Writer"
+TITLE = "Benchmark Searching"
+BOOKS = ((ISBN, AUTHOR, TITLE), (None, AUTHOR, f"{TITLE} Again"), (None, AUTHOR, TITLE),
+         (None, "Someone Else", f"{TITLE} Elsewhere"))
+BATCH = 50000
+ROUNDS = 20
+
+
+def add_listings(db, listings):
+    users = [row[0] for row in db.execute("SELECT id FROM Users")]
+    with dbc.transaction(db):
+        books = [db.execute("INSERT INTO Books (ISBN, author, title) VALUES (?, ?, ?)", book).lastrowid
+                 for book in BOOKS]
+    for start in range(0, listings, BATCH):
+        with dbc.transaction(db):
+            db.executemany("INSERT INTO UserBooks (userId, bookId, copyQualityId, points) VALUES (?, ?, 1, ?)",
+                           [(users[i % len(users)], books[i % len(books)], 1 + i % 5)
+                            for i in range(start, min(start + BATCH, listings))])
+        # Not timed here, and would only grow with the listings
+        with dbc.transaction(db):
+            db.execute("DELETE FROM WishlistMatchQueue")
+
+
+def main():
+    listings = int(sys.argv[1]) if len(sys.argv) > 1 else 40000
+    num = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    with bench_app(make_sample_db()):
+        bsdb = dbc.BookSwapDatabase()
+        add_listings(bsdb.db, listings)
+        search = BookSearch((ISBN, AUTHOR, TITLE), bsdb)
+        first_page, every_page = Timer(), Timer()
+        for _ in range(ROUNDS):
+            with first_page.time():
+                results = search.local_book_search(num)
+        assert len(results) == num
+        for _ in range(max(1, ROUNDS // 10)):
+            with every_page.time():
+                seen, page = 0, search.local_book_search(dbc.MAX_PAGE_SIZE)
+                seen += len(page)
+                while page.next_cursor:
+                    page = search.local_book_search(dbc.MAX_PAGE_SIZE, page.next_cursor)
+                    seen += len(page)
+        assert seen == listings, seen
+    print(f"{listings} matching listings over {len(BOOKS)} books")
+    for label, timer in ((f"first {num}", first_page), (f"all, {dbc.MAX_PAGE_SIZE} a page", every_page)):
+        summary = timer.summary()
+        print(f"  {label:>18}: mean {summary['mean_ms']:8.1f} ms, p50 {summary['p50_ms']:8.1f} ms, "
+              f"p95 {summary['p95_ms']:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Request latency with and without debug logging.
+
+Runs the same browse and search requests through the app (Open Library
+answered by the local stand-in) with the 'app' loggers at WARNING, at DEBUG
+with the default sampling, and at DEBUG with every record written.  Log lines
+go to a temporary file through log_config's queue and listener thread.
+
+    python -m benchmarks.logging_overhead [rounds]
+"""
+import os
+import sys
+import tempfile
+
+import db_connector as dbc
+import log_config
+import metrics
+import openlibrary
+import openlibrary_cache
+from app import app
+from benchmarks.common import Timer, make_sample_db
+from tests.openlibrary_stub import OpenLibraryStub
+
+SETTINGS = [("WARNING", {"app": "WARNING"}, log_config.SAMPLE_EVERY),
+            (f"DEBUG, 1 in {log_config.SAMPLE_EVERY}", {"app": "DEBUG"}, log_config.SAMPLE_EVERY),
+            ("DEBUG, every record", {"app": "DEBUG"}, 1)]
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    directory = tempfile.mkdtemp(prefix="bookswap-bench-")
+    dbc.DATABASE = make_sample_db(directory)
+    metrics.METRICS_DATABASE = os.path.join(directory, "metrics.db")
+    openlibrary_cache.CACHE_ENABLED = False
+    client = app.test_client()
+    with OpenLibraryStub(latency=0, num_docs=10) as stub:
+        openlibrary.BASE_URL = stub.url
+        client.post('/browse-books', data={"title": "warm up"})
+        for name, levels, sample_every in SETTINGS:
+            with open(os.path.join(directory, "app.log"), "w") as out:
+                log_config.configure(levels, stream=out, sample_every=sample_every)
+                browse, search = Timer(), Timer()
+                for r in range(rounds):
+                    with browse.time():
+                        client.get('/browse-books')
+                    with search.time():
+                        client.post('/browse-books', data={"title": "query"})
+                log_config.shutdown()
+                size = out.tell()
+            for label, timer in (("browse", browse), ("search", search)):
+                summary = timer.summary()
+                print(f"{name:>22} {label}: mean {summary['mean_ms']:.2f} ms, p50 {summary['p50_ms']:.2f} ms, "
+                      f"p95 {summary['p95_ms']:.2f} ms")
+            print(f"{'':>22} {size / 1024:.0f} KiB of log written")
+
+
+if __name__ == "__main__":
+    main()
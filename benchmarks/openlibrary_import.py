@@ -0,0 +1,48 @@
+"""
+Import speed of openlibrary_import on a synthetic gzipped editions dump.
+
+Writes a dump of `num_editions` edition records (about two thirds of them
+English printed editions with a cover and ISBN-13, several per work) plus
+their authors, imports it into a fresh sample database, and prints the
+import report.
+
+    python -m benchmarks.openlibrary_import [num_editions]
+"""
+import gzip
+import json
+import os
+import sys
+import tempfile
+
+import openlibrary_import
+from benchmarks.common import bench_app, make_sample_db
+
+
+def write_dump(path, num_editions):
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for a in range(num_editions // 20 + 1):
+            record = {"key": f"/authors/OL{a}A", "type": {"key": "/type/author"}, "name": f"Author {a}"}
+            f.write(f"/type/author\t{record['key']}\t1\t2023-01-01\t{json.dumps(record)}\n")
+        for e in range(num_editions):
+            record = {"key": f"/books/OL{e}M", "type": {"key": "/type/edition"},
+                      "title": f"Book {e // 3}", "works": [{"key": f"/works/OL{e // 3}W"}],
+                      "authors": [{"key": f"/authors/OL{e // 60}A"}],
+                      "languages": [{"key": "/languages/eng" if e % 3 else "/languages/fre"}],
+                      "isbn_13": [str(9780000000000 + e)], "covers": [e + 1],
+                      "physical_format": "Paperback"}
+            f.write(f"/type/edition\t{record['key']}\t1\t2023-01-01\t{json.dumps(record)}\n")
+
+
+def main():
+    num_editions = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+    directory = tempfile.mkdtemp(prefix="bookswap-bench-")
+    dump = os.path.join(directory, "ol_dump_editions.txt.gz")
+    write_dump(dump, num_editions)
+    path = make_sample_db(directory)
+    with bench_app(path):
+        report = openlibrary_import.import_dumps([dump], path)
+    print(f"{os.path.getsize(dump) / 1024 / 1024:.1f} MiB dump: {report}")
+
+
+if __name__ == "__main__":
+    main()
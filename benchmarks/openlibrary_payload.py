@@ -0,0 +1,174 @@
+"""
+Bytes transferred and Open Library calls per search, before and after asking
+search.json for only the fields and number of results we use.
+
+Open Library is replaced by a synthetic catalogue that answers like the real
+API: search.json returns 100 full work documents unless given `limit`, and
+only the requested `fields` when given them; /api/books returns full edition
+details for each bibkey.  "before" replays the original client (whole search
+page, then /api/books in the original overlapping batches of 10); "after" is
+openlibrary.search() plus openlibrary.find_english_edition().
+
+    python -m benchmarks.openlibrary_payload [num_searches]
+"""
+import json
+import random
+import sys
+
+import openlibrary
+
+NUM_RESULTS = 10
+DEFAULT_PAGE = 100
+
+
+class FakeOpenLibrary:
+    """
+    A deterministic catalogue of works and editions that counts the calls
+        made to it and the bytes it sends back.
+    """
+
+    def __init__(self, seed, works=2000):
+        rng = random.Random(seed)
+        self.works = []
+        for w in range(works):
+            num_editions = rng.choice([1, 3, 8, 20, 45, 120])
+            editions = []
+            for e in range(num_editions):
+                isbn = 9780000000000 + w * 1000 + e
+                editions.append({"key": f"/books/OL{w}E{e}M",
+                                 "title": f"Work {w}, edition {e}",
+                                 "language": [rng.choice(["eng", "eng", "fre", "ger", "spa"])],
+                                 "isbn": [str(isbn)[3:], str(isbn)] if rng.random() < 0.7 else [str(isbn)[3:]],
+                                 "cover_i": 100000 + e if rng.random() < 0.6 else None,
+                                 "publishers": [f"Publisher {rng.randrange(500)}"],
+                                 "publish_date": str(rng.randrange(1900, 2024)),
+                                 "number_of_pages": rng.randrange(80, 900)})
+            self.works.append({"key": f"/works/OL{w}W",
+                               "title": f"Work {w}",
+                               "author_name": [f"Author {w % 300}"],
+                               "author_key": [f"OL{w % 300}A"],
+                               "subject": [f"Subject {rng.randrange(1000)}" for _ in range(25)],
+                               "first_sentence": ["It was a dark and stormy night. " * 3],
+                               "editions": editions})
+        self.calls = 0
+        self.bytes = 0
+
+    @staticmethod
+    def _suitable(edition):
+        return (edition["language"] == ["eng"] and edition["cover_i"] is not None
+                and any(len(isbn) == 13 for isbn in edition["isbn"]))
+
+    def _search_doc(self, work, fields):
+        editions = work["editions"]
+        best = next((e for e in editions if self._suitable(e)), editions[0])
+        best = {k: v for k, v in best.items() if v is not None}
+        doc = {"key": work["key"],
+               "title": work["title"],
+               "author_name": work["author_name"],
+               "author_key": work["author_key"],
+               "subject": work["subject"],
+               "first_sentence": work["first_sentence"],
+               "edition_key": [e["key"].split("/")[-1] for e in editions],
+               "edition_count": len(editions),
+               "isbn": [isbn for e in editions for isbn in e["isbn"]],
+               "language": sorted({lang for e in editions for lang in e["language"]}),
+               "publisher": [p for e in editions for p in e["publishers"]],
+               "publish_date": [e["publish_date"] for e in editions],
+               "seed": [e["key"] for e in editions] + [work["key"]]}
+        if fields is None:
+            return doc
+        doc["editions"] = {"numFound": len(editions), "start": 0, "numFoundExact": True,
+                           "docs": [best]}
+        out = {}
+        for field in fields:
+            if field.startswith("editions."):
+                continue
+            if field in doc:
+                out[field] = doc[field]
+        if "editions" in out:
+            wanted = {f.split(".", 1)[1] for f in fields if f.startswith("editions.")}
+            out["editions"] = dict(out["editions"],
+                                   docs=[{k: v for k, v in best.items() if k in wanted}])
+        return out
+
+    def get_json(self, endpoint, params=None):
+        params = params or {}
+        if endpoint == "/search.json":
+            limit = int(params.get("limit") or DEFAULT_PAGE)
+            fields = params["fields"].split(",") if params.get("fields") else None
+            start = random.Random(params.get("title")).randrange(len(self.works) - limit)
+            docs = [self._search_doc(work, fields) for work in self.works[start:start + limit]]
+            data = {"numFound": len(docs), "start": 0, "docs": docs}
+        else:
+            data = {}
+            for bibkey in params["bibkeys"].split(","):
+                w, e = bibkey[2:-1].split("E")
+                edition = self.works[int(w)]["editions"][int(e)]
+                details = {"title": edition["title"],
+                           "languages": [{"key": f"/languages/{lang}"} for lang in edition["language"]],
+                           "isbn_10": [isbn for isbn in edition["isbn"] if len(isbn) == 10],
+                           "publishers": edition["publishers"],
+                           "publish_date": edition["publish_date"],
+                           "number_of_pages": edition["number_of_pages"],
+                           "works": [{"key": f"/works/OL{w}W"}],
+                           "subjects": self.works[int(w)]["subject"],
+                           "key": edition["key"]}
+                if edition["cover_i"] is not None:
+                    details["covers"] = [edition["cover_i"]]
+                if any(len(isbn) == 13 for isbn in edition["isbn"]):
+                    details["isbn_13"] = [isbn for isbn in edition["isbn"] if len(isbn) == 13]
+                data[bibkey] = {"bib_key": bibkey, "info_url": f"https://openlibrary.org{edition['key']}",
+                                "details": details}
+        self.calls += 1
+        self.bytes += len(json.dumps(data))
+        return data
+
+
+def legacy_search(fake, title):
+    """The original client: the whole search page, then overlapping batches of 10 edition keys."""
+    results = fake.get_json("/search.json", {"title": title})["docs"][:NUM_RESULTS]
+    for result in results:
+        editions = result.get("edition_key", [])
+        n = len(editions)
+        i = 0
+        found = False
+        while i < n // 10 + 1 and not found:
+            data = fake.get_json("/api/books", {"format": "json", "jscmd": "details",
+                                                "bibkeys": ",".join(editions[i:i + 10])})
+            for candidate in data:
+                details = data[candidate]["details"]
+                if "languages" in details and "covers" in details and "isbn_13" in details:
+                    if len(details["languages"]) == 1 and details["languages"][0]["key"] == "/languages/eng":
+                        found = True
+                        break
+            i += 10
+
+
+def current_search(fake, title):
+    results = openlibrary.search(title=title, limit=NUM_RESULTS)
+    for result in results:
+        openlibrary.find_english_edition(result)
+
+
+def measure(search, num_searches):
+    fake = FakeOpenLibrary(seed=1024)
+    real_get_json = openlibrary.get_json
+    openlibrary.get_json = fake.get_json
+    try:
+        for s in range(num_searches):
+            search(fake, f"title {s}")
+    finally:
+        openlibrary.get_json = real_get_json
+    return fake.bytes / num_searches, fake.calls / num_searches
+
+
+def main():
+    num_searches = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    print(f"{num_searches} searches of {NUM_RESULTS} results, per search:")
+    for label, search in (("before", legacy_search), ("after ", current_search)):
+        size, calls = measure(search, num_searches)
+        print(f"  {label}: {size / 1024:8.1f} KiB transferred, {calls:5.1f} calls")
+
+
+if __name__ == "__main__":
+    main()
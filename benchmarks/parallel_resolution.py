@@ -0,0 +1,72 @@
+"""
+Wall time of search_books_openlibrary with the per-result edition lookups run
+one after another versus fanned out on the lookup thread pool.
+
+Open Library is replaced by a stub with a fixed latency per call: 50 ms for
+search.json and a random 50-300 ms for each /api/books lookup.  With the
+lookups in parallel, the search should take about the search call plus the
+slowest lookup, rather than the sum of all of them.
+
+    python -m benchmarks.parallel_resolution [num_results]
+"""
+import random
+import sys
+import time
+
+import db_connector as dbc
+import openlibrary
+from benchmarks.common import bench_app, make_sample_db
+
+SEARCH_LATENCY = 0.05
+
+
+def make_stub(num_results, seed):
+    rng = random.Random(seed)
+    latencies = {f"OL{i}M": rng.uniform(0.05, 0.3) for i in range(num_results)}
+
+    def get_json(endpoint, params=None):
+        if endpoint == '/search.json':
+            time.sleep(SEARCH_LATENCY)
+            return {"docs": [{"key": f"/works/OL{i}W", "title": f"Benchmark Book {i}",
+                              "author_name": ["A. Writer"], "edition_key": [f"OL{i}M"]}
+                             for i in range(num_results)]}
+        bibkey = params['bibkeys']
+        time.sleep(latencies[bibkey])
+        return {bibkey: {"details": {"languages": [{"key": "/languages/eng"}], "covers": [1],
+                                     "isbn_13": [str(9780000000000 + int(bibkey[2:-1]))]}}}
+    return get_json, latencies
+
+
+def run(num_results, workers):
+    stub, latencies = make_stub(num_results, seed=361)
+    openlibrary.get_json = stub
+    openlibrary.LOOKUP_WORKERS = workers
+    openlibrary._executor = None
+    with bench_app(make_sample_db()):
+        bsdb = dbc.BookSwapDatabase()
+        start = time.perf_counter()
+        out = bsdb.search_books_openlibrary(title="benchmark", num_results=num_results)
+        wall = time.perf_counter() - start
+    assert [book['OLWorkKey'] for book in out] == [f"OL{i}W" for i in range(num_results)]
+    return wall, latencies
+
+
+def main():
+    num_results = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    real_get_json = openlibrary.get_json
+    workers = openlibrary.LOOKUP_WORKERS
+    try:
+        serial, latencies = run(num_results, workers=1)
+        parallel, _ = run(num_results, workers=workers)
+    finally:
+        openlibrary.get_json = real_get_json
+        openlibrary.LOOKUP_WORKERS = workers
+        openlibrary._executor = None
+    print(f"{num_results} results: lookups sum to {sum(latencies.values()) * 1000:.0f} ms, "
+          f"slowest {max(latencies.values()) * 1000:.0f} ms, search call {SEARCH_LATENCY * 1000:.0f} ms")
+    print(f"  one at a time: {serial * 1000:.0f} ms")
+    print(f"  fanned out   : {parallel * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+End-to-end search_books_openlibrary over HTTP against the local Open Library
+stand-in (tests/openlibrary_stub.py), so runs are reproducible and offline.
+
+Each round searches for a new query (nothing cached, no works stored yet),
+with the stub adding a fixed latency to every call.
+
+    python -m benchmarks.search_path [rounds] [latency_seconds]
+"""
+import sys
+
+import db_connector as dbc
+import openlibrary
+import openlibrary_cache
+from benchmarks.common import Timer, bench_app, make_sample_db
+from tests.openlibrary_stub import OpenLibraryStub
+
+NUM_RESULTS = 10
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    openlibrary_cache.CACHE_ENABLED = False
+    timer = Timer()
+    with OpenLibraryStub(latency=latency, num_docs=NUM_RESULTS) as stub:
+        openlibrary.BASE_URL = stub.url
+        with bench_app(make_sample_db()):
+            for r in range(rounds):
+                with timer.time():
+                    dbc.BookSwapDatabase().search_books_openlibrary(title=f"query {r}", num_results=NUM_RESULTS)
+        calls = stub.requests
+    summary = timer.summary()
+    print(f"{rounds} searches of {NUM_RESULTS} results, {latency * 1000:.0f} ms per Open Library call, "
+          f"{calls / rounds:.1f} calls per search")
+    print(f"  mean {summary['mean_ms']:.0f} ms, p50 {summary['p50_ms']:.0f} ms, p95 {summary['p95_ms']:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
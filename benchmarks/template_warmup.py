@@ -0,0 +1,95 @@
+"""
+First-request latency of the main pages, with and without template_cache.
+
+Each page is requested twice in a fresh process, as the first requests of a
+newly started worker; the first request's time, less the second's, is what
+the worker spends on its first request, mostly loading templates.  Each is
+timed with:
+    before       no bytecode cache, no preloading: templates compiled on first use
+    bytecode     bytecode cache (already filled by an earlier worker), no preloading
+    preloaded    bytecode cache and preloading at startup, as the app now starts
+plus the time `import app` takes in each case, which now includes preloading.
+What is left of the extra once templates are preloaded is the worker's other
+first-use costs, such as opening its first database connection.
+
+    python -m benchmarks.template_warmup [runs]
+"""
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import make_sample_db
+
+PAGES = {  # page -> (template, user logged in)
+    "/": ("home.html", None),
+    "/browse-books": ("browse-books.html", None),
+    "/my-requests": ("user/my-requests.html", 1),
+    "/received-requests": ("user/received-requests.html", 2),
+    "/my-books": ("user/my-books.html", 1),
+    "/wishlist": ("user/wishlist.html", 3),
+}
+MODES = {"before": (False, False), "bytecode": (True, False), "preloaded": (True, True)}
+
+
+def measure(path, cache_dir, mode, page):
+    """
+    Starts the app in this process, requests `page` twice and prints the
+        timings (ms) as JSON.
+    """
+    import db_connector as dbc
+    import template_cache
+    dbc.DATABASE = path
+    template_cache.CACHE_DIR = cache_dir
+    template_cache.BYTECODE_CACHE, template_cache.PRELOAD = MODES[mode]
+    start = time.perf_counter()
+    from app import app
+    startup = (time.perf_counter() - start) * 1000
+    client = app.test_client()
+    user = PAGES[page][1]
+    if user is not None:
+        with client.session_transaction() as session:
+            session["user_num"] = user
+    times = []
+    for _ in range(2):
+        start = time.perf_counter()
+        response = client.get(page)
+        times.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, (page, response.status_code)
+    print(json.dumps({"startup": startup, "first": times[0], "second": times[1]}))
+
+
+def run(*args):
+    out = subprocess.run([sys.executable, "-m", "benchmarks.template_warmup", *args],
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    path = make_sample_db()
+    cache_dir = tempfile.mkdtemp(prefix="bookswap-jinja-")
+    run("--measure", path, cache_dir, "preloaded", "/")  # fill the bytecode cache
+    print(f"First request after worker start, ms (median of {runs}); "
+          f"in brackets, the extra over a second request")
+    print(f"  {'page':34}" + "".join(f"{mode:>20}" for mode in MODES))
+    startups = {mode: [] for mode in MODES}
+    for page, (template, _) in PAGES.items():
+        row = f"  {template:34}"
+        for mode in MODES:
+            results = [run("--measure", path, cache_dir, mode, page) for _ in range(runs)]
+            startups[mode].extend(result["startup"] for result in results)
+            first = statistics.median(result["first"] for result in results)
+            extra = statistics.median(result["first"] - result["second"] for result in results)
+            row += f"{first:12.1f} ({extra:5.1f})"
+        print(row)
+    print(f"  {'import app':34}" + "".join(f"{statistics.median(startups[mode]):12.0f}{'':8}" for mode in MODES))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 5 and sys.argv[1] == "--measure":
+        measure(*sys.argv[2:6])
+    else:
+        main()
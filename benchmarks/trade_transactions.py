@@ -0,0 +1,97 @@
+"""
+Trade transition cost, before and after running each transition as a single
+transaction.
+
+"Before" replays the old statement sequence for a request + rejection cycle
+with a commit after every statement.  "After" runs
+BookSwapDatabase.request_book and reject_trade, one BEGIN IMMEDIATE ... COMMIT
+each.  Both run on a pooled connection (see PRAGMAS in db_connector.py), so
+the difference is only the number of transactions, not the journal mode.
+
+Commits are counted with a trace callback.  Every commit takes the write lock
+and appends a commit frame to the write-ahead log.
+
+    python -m benchmarks.trade_transactions [cycles]
+"""
+import sys
+
+import db_connector as dbc
+from benchmarks.common import Timer, bench_app, make_sample_db
+
+USER_BOOKS_ID = 16
+REQUESTER = 1
+POINTS = 3
+
+LEGACY_STATEMENTS = (
+    # request_book
+    ("INSERT INTO Trades (userRequestedId, userBookId, statusId) VALUES (?, ?, 2)", (REQUESTER, USER_BOOKS_ID)),
+    ("UPDATE Users SET points = points - ? WHERE id = ?", (POINTS, REQUESTER)),
+    ("UPDATE UserBooks SET available = 0 WHERE id = ?", (USER_BOOKS_ID,)),
+    # reject_trade
+    ("UPDATE Trades SET statusId = 4 WHERE userBookId = ?", (USER_BOOKS_ID,)),
+    ("""UPDATE Users SET points = points + (SELECT points FROM UserBooks WHERE id = ?)
+        WHERE id = (SELECT userRequestedId FROM Trades WHERE userBookId = ? AND statusId = 4)""",
+     (USER_BOOKS_ID, USER_BOOKS_ID)),
+    ("UPDATE UserBooks SET available = 1 WHERE id = ?", (USER_BOOKS_ID,)),
+    # tidy up so the next cycle starts from the same state
+    ("DELETE FROM Trades WHERE userBookId = ?", (USER_BOOKS_ID,)),
+)
+
+
+def count_commits(conn, commits):
+    def trace(statement):
+        if statement == "COMMIT":
+            commits[0] += 1
+    conn.set_trace_callback(trace)
+
+
+def run_before(cycles):
+    path = make_sample_db()
+    commits = [0]
+    timer = Timer()
+    with bench_app(path):
+        conn = dbc.get_db()
+        count_commits(conn, commits)
+        for _ in range(cycles):
+            with timer.time():
+                for statement, params in LEGACY_STATEMENTS[:-1]:
+                    conn.execute(statement, params)
+                    conn.commit()
+            conn.execute(*LEGACY_STATEMENTS[-1])
+            conn.commit()
+            commits[0] -= 1  # the tidy-up is not part of the trade
+        conn.set_trace_callback(None)
+    return timer.summary(), commits[0] / cycles
+
+
+def run_after(cycles):
+    path = make_sample_db()
+    commits = [0]
+    timer = Timer()
+    with bench_app(path):
+        bsdb = dbc.BookSwapDatabase()
+        count_commits(bsdb.db, commits)
+        book = {"userBooksId": USER_BOOKS_ID, "pointsNeeded": POINTS}
+        for _ in range(cycles):
+            with timer.time():
+                bsdb.request_book(book, REQUESTER)
+                bsdb.reject_trade(USER_BOOKS_ID)
+            bsdb.db.execute(*LEGACY_STATEMENTS[-1])
+            bsdb.db.commit()
+            commits[0] -= 1
+        bsdb.db.set_trace_callback(None)
+    return timer.summary(), commits[0] / cycles
+
+
+def main():
+    cycles = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(f"{cycles} request + reject cycles")
+    for label, run in (("before (commit per statement)", run_before),
+                       ("after  (one transaction each)", run_after)):
+        summary, commits = run(cycles)
+        print(f"{label}: {commits:.1f} commits/cycle, "
+              f"mean {summary['mean_ms']:.3f} ms, p50 {summary['p50_ms']:.3f} ms, p95 {summary['p95_ms']:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
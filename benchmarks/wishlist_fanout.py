@@ -0,0 +1,65 @@
+"""
+Fan-out of one listing to everyone wishing for the book.
+
+Gives a sample book `wishers` extra users with it on their wishlists, then
+lists it and times the listing request (which only queues the match when
+matching runs in the background), the match round that writes every wisher's
+notice, and reading one wisher's badge count afterwards.
+
+    python -m benchmarks.wishlist_fanout [wishers]
+"""
+import sys
+import time
+
+import db_connector as dbc
+import wishlist_matches
+from benchmarks.common import Timer, bench_app, make_sample_db
+
+BOOK_ID = 1
+LISTER = 1
+BATCH = 10000
+
+
+def add_wishers(db, wishers):
+    first = db.execute("SELECT max(id) FROM Users").fetchone()[0] + 1
+    with dbc.transaction(db):
+        for start in range(first, first + wishers, BATCH):
+            ids = range(start, min(start + BATCH, first + wishers))
+            db.executemany("""INSERT INTO Users (id, username, email, password, fName, lName, streetAddress, city,
+                                                 state, postCode)
+                              VALUES (?, ?, ?, 'x', 'Wish', 'Er', '1 Main St', 'Springfield', 'Oregon', '97477')""",
+                           [(i, f"wisher{i}", f"wisher{i}@example.com") for i in ids])
+            db.executemany("INSERT INTO Wishlists (id, userId) VALUES (?, ?)", [(i + 1000000, i) for i in ids])
+            db.executemany("INSERT INTO WishlistsBooks (wishlistId, bookId) VALUES (?, ?)",
+                           [(i + 1000000, BOOK_ID) for i in ids])
+    return first
+
+
+def main():
+    wishers = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    wishlist_matches.BACKGROUND = True
+    wishlist_matches.start_worker = lambda database=None: None  # match in the foreground, to time it
+    with bench_app(make_sample_db()):
+        bsdb = dbc.BookSwapDatabase()
+        first = add_wishers(bsdb.db, wishers)
+        listing, badge = Timer(), Timer()
+        with listing.time():
+            bsdb.user_add_book_by_id(BOOK_ID, LISTER, 1, 1)
+        start = time.perf_counter()
+        rounds = 0
+        while wishlist_matches.drain_once(bsdb.db):
+            rounds += 1
+        match_ms = (time.perf_counter() - start) * 1000
+        for user_num in range(first, first + min(wishers, 1000)):
+            with badge.time():
+                bsdb.get_user_summary(user_num)["numWishlistMatches"]
+        notices = bsdb.db.execute("SELECT COUNT(*) FROM WishlistInbox WHERE bookId = ?", (BOOK_ID,)).fetchone()[0]
+    print(f"1 listing fanned out to {notices} wishers")
+    print(f"  listing request: {listing.summary()['mean_ms']:.2f} ms")
+    print(f"  matching: {match_ms:.0f} ms in {rounds} round(s), {notices / match_ms * 1000:.0f} notices/s")
+    summary = badge.summary()
+    print(f"  badge read: mean {summary['mean_ms']:.3f} ms, p95 {summary['p95_ms']:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
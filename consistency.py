@@ -0,0 +1,248 @@
+"""
+Consistency checks for the tables the database keeps up to date itself with
+triggers.
+
+Each check recomputes a derived table from scratch, reports every row that
+has drifted from the recomputed value, and can repair it.
+
+Check (or repair) a database file from the command line with:
+    python consistency.py [--repair] [path/to/database.db]
+or recompute every derived table from scratch with:
+    python consistency.py --rebuild [path/to/database.db]
+"""
+import sys
+import logging
+
+import db_connector as dbc
+
+log = logging.getLogger('app.sub')
+
+EXPECTED_TRADE_COUNTERS = """
+    SELECT
+        Users.id AS userId,
+        COUNT(CASE WHEN Trades.statusId = 2 THEN 1 END) AS numTradeRequests,
+        COUNT(CASE WHEN Trades.statusId = 3 THEN 1 END) AS numOpenTrades
+    FROM
+        Users LEFT JOIN
+        UserBooks ON UserBooks.userId = Users.id LEFT JOIN
+        Trades ON Trades.userBookId = UserBooks.id AND Trades.statusId IN (2, 3)
+    GROUP BY
+        Users.id"""
+
+
+def check_trade_counters(db, repair=False):
+    """
+    Recomputes every user's trade counts and compares them with
+        UserTradeCounters.
+    Accepts:
+        db (sqlite3.Connection): connection to the BookSwap database
+        repair (bool): overwrite drifted counters with the recomputed values
+    Returns:
+        List of (userId, stored (numTradeRequests, numOpenTrades),
+            expected (numTradeRequests, numOpenTrades)) tuples, one per
+            drifted user; a user with no counters row is stored as (0, 0)
+    """
+    with dbc.transaction(db):
+        drift = [(user_id, (stored_requests, stored_open), (requests, open_trades))
+                 for user_id, requests, open_trades, stored_requests, stored_open in db.execute(f"""
+                    SELECT
+                        Expected.userId, Expected.numTradeRequests, Expected.numOpenTrades,
+                        IFNULL(UserTradeCounters.numTradeRequests, 0), IFNULL(UserTradeCounters.numOpenTrades, 0)
+                    FROM
+                        ({EXPECTED_TRADE_COUNTERS}) AS Expected LEFT JOIN
+                        UserTradeCounters ON UserTradeCounters.userId = Expected.userId
+                    WHERE
+                        IFNULL(UserTradeCounters.numTradeRequests, 0) != Expected.numTradeRequests
+                        OR IFNULL(UserTradeCounters.numOpenTrades, 0) != Expected.numOpenTrades""")]
+        if repair and drift:
+            db.executemany("""INSERT OR REPLACE INTO UserTradeCounters (userId, numTradeRequests, numOpenTrades)
+                              VALUES (?, ?, ?)""",
+                           [(user_id, *expected) for user_id, _, expected in drift])
+    for user_id, stored, expected in drift:
+        log.warning(f"UserTradeCounters drift for user {user_id}: stored {stored}, expected {expected}"
+                    f"{' (repaired)' if repair else ''}")
+    return drift
+
+
+def rebuild_trade_counters(db):
+    """
+    Recomputes UserTradeCounters from scratch.
+    """
+    with dbc.transaction(db):
+        db.execute("DELETE FROM UserTradeCounters")
+        db.execute(f"INSERT INTO UserTradeCounters (userId, numTradeRequests, numOpenTrades) "
+                   f"{EXPECTED_TRADE_COUNTERS}")
+
+
+EXPECTED_BOOK_AVAILABILITY = """
+    SELECT
+        bookId,
+        COUNT(*) AS availableCount,
+        min(points) AS minPoints,
+        max(dateCreated) AS newestListing
+    FROM
+        UserBooks
+    WHERE
+        available = 1 AND bookId IS NOT NULL
+    GROUP BY
+        bookId"""
+
+
+def check_book_availability(db, repair=False):
+    """
+    Recomputes every book's available copies and compares them with
+        BookAvailability.
+    Accepts:
+        db (sqlite3.Connection): connection to the BookSwap database
+        repair (bool): overwrite drifted rows with the recomputed values
+    Returns:
+        List of (bookId, stored (availableCount, minPoints, newestListing),
+            expected (availableCount, minPoints, newestListing)) tuples, one
+            per drifted book; a missing row is None
+    """
+    with dbc.transaction(db):
+        rows = db.execute(f"""
+                    SELECT
+                        Expected.bookId,
+                        BookAvailability.availableCount, BookAvailability.minPoints, BookAvailability.newestListing,
+                        Expected.availableCount, Expected.minPoints, Expected.newestListing
+                    FROM
+                        ({EXPECTED_BOOK_AVAILABILITY}) AS Expected LEFT JOIN
+                        BookAvailability ON BookAvailability.bookId = Expected.bookId
+                    WHERE
+                        BookAvailability.bookId IS NULL
+                        OR BookAvailability.availableCount != Expected.availableCount
+                        OR BookAvailability.minPoints IS NOT Expected.minPoints
+                        OR BookAvailability.newestListing IS NOT Expected.newestListing
+                    UNION ALL
+                    SELECT
+                        BookAvailability.bookId,
+                        BookAvailability.availableCount, BookAvailability.minPoints, BookAvailability.newestListing,
+                        NULL, NULL, NULL
+                    FROM
+                        BookAvailability
+                    WHERE
+                        BookAvailability.bookId NOT IN (SELECT bookId FROM UserBooks WHERE available = 1 AND bookId IS NOT NULL)
+                    ORDER BY 1""").fetchall()
+        drift = [(book_id,
+                  None if stored_count is None else (stored_count, stored_min, stored_newest),
+                  None if count is None else (count, min_points, newest))
+                 for book_id, stored_count, stored_min, stored_newest, count, min_points, newest in rows]
+        if repair and drift:
+            db.executemany("DELETE FROM BookAvailability WHERE bookId = ?",
+                           [(book_id,) for book_id, _, expected in drift if expected is None])
+            db.executemany("""INSERT OR REPLACE INTO BookAvailability
+                                  (bookId, availableCount, minPoints, newestListing)
+                              VALUES (?, ?, ?, ?)""",
+                           [(book_id, *expected) for book_id, _, expected in drift if expected is not None])
+    for book_id, stored, expected in drift:
+        log.warning(f"BookAvailability drift for book {book_id}: stored {stored}, expected {expected}"
+                    f"{' (repaired)' if repair else ''}")
+    return drift
+
+
+def rebuild_book_availability(db):
+    """
+    Recomputes BookAvailability from scratch.
+    """
+    with dbc.transaction(db):
+        db.execute("DELETE FROM BookAvailability")
+        db.execute(f"INSERT INTO BookAvailability (bookId, availableCount, minPoints, newestListing) "
+                   f"{EXPECTED_BOOK_AVAILABILITY}")
+
+
+EXPECTED_INBOX_COUNTS = """
+    SELECT
+        userId,
+        COUNT(CASE WHEN seen = 0 THEN 1 END) AS unseen
+    FROM
+        WishlistInbox
+    GROUP BY
+        userId"""
+
+
+def check_wishlist_inbox_counts(db, repair=False):
+    """
+    Recounts every user's unseen wishlist notices and compares them with
+        WishlistInboxCounts.
+    Accepts:
+        db (sqlite3.Connection): connection to the BookSwap database
+        repair (bool): overwrite drifted counts with the recounted values
+    Returns:
+        List of (userId, stored unseen, expected unseen) tuples, one per
+            drifted user; a user with no counts row is stored as 0
+    """
+    with dbc.transaction(db):
+        drift = [tuple(row) for row in db.execute(f"""
+                    SELECT
+                        Users.id, IFNULL(WishlistInboxCounts.unseen, 0), IFNULL(Expected.unseen, 0)
+                    FROM
+                        Users LEFT JOIN
+                        ({EXPECTED_INBOX_COUNTS}) AS Expected ON Expected.userId = Users.id LEFT JOIN
+                        WishlistInboxCounts ON WishlistInboxCounts.userId = Users.id
+                    WHERE
+                        IFNULL(WishlistInboxCounts.unseen, 0) != IFNULL(Expected.unseen, 0)""")]
+        if repair and drift:
+            db.executemany("INSERT OR REPLACE INTO WishlistInboxCounts (userId, unseen) VALUES (?, ?)",
+                           [(user_id, expected) for user_id, _, expected in drift])
+    for user_id, stored, expected in drift:
+        log.warning(f"WishlistInboxCounts drift for user {user_id}: stored {stored}, expected {expected}"
+                    f"{' (repaired)' if repair else ''}")
+    return drift
+
+
+def rebuild_wishlist_inbox_counts(db):
+    """
+    Recounts WishlistInboxCounts from scratch.
+    """
+    with dbc.transaction(db):
+        db.execute("DELETE FROM WishlistInboxCounts")
+        db.execute(f"INSERT INTO WishlistInboxCounts (userId, unseen) {EXPECTED_INBOX_COUNTS}")
+
+
+CHECKS = {"UserTradeCounters": check_trade_counters,
+          "BookAvailability": check_book_availability,
+          "WishlistInboxCounts": check_wishlist_inbox_counts}
+REBUILDS = {"UserTradeCounters": rebuild_trade_counters,
+            "BookAvailability": rebuild_book_availability,
+            "WishlistInboxCounts": rebuild_wishlist_inbox_counts}
+
+
+def rebuild_all(db):
+    """
+    Recomputes every derived table from scratch, e.g. after a bulk load with
+        the triggers dropped.
+    """
+    for rebuild in REBUILDS.values():
+        rebuild(db)
+
+
+def check_all(db, repair=False):
+    """
+    Runs every check.
+    Returns:
+        Dict of table name to that check's list of drifted rows
+    """
+    return {name: check(db, repair) for name, check in CHECKS.items()}
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    repair = '--repair' in args
+    rebuild = '--rebuild' in args
+    args = [arg for arg in args if arg not in ('--repair', '--rebuild')]
+    database = args[0] if args else dbc.DATABASE
+    pool = dbc.get_pool(database)
+    db = pool.acquire()
+    try:
+        if rebuild:
+            rebuild_all(db)
+            print(f"Rebuilt {', '.join(REBUILDS)}")
+        results = check_all(db, repair)
+    finally:
+        pool.release(db)
+    for name, drift in results.items():
+        print(f"{name}: {len(drift)} drifted row(s){' repaired' if repair and drift else ''}")
+        for row in drift:
+            print(f"  {row}")
+    sys.exit(1 if any(results.values()) and not repair else 0)
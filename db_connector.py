@@ -1,23 +1,345 @@
+import base64
+import concurrent.futures
+import contextlib
+import json
+import os
+import queue
+import re
 import sqlite3
+import threading
 from flask import g, session, redirect, url_for, flash
-import requests
 import logging
+import edition_enrichment
+import migrations
+import openlibrary
+import query_cache
+import sql_trace
+import wishlist_matches
 
 log = logging.getLogger('app.sub')
 
 DATABASE = 'DatabaseSpecs/test-db.db'
 
+# Connection pool settings, per worker process
+POOL_SIZE = 8  # most connections a worker will hold open at once
+POOL_TIMEOUT = 10  # seconds to wait for a free connection before giving up
+
+# Applied once to every pooled connection when it is opened
+PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("busy_timeout", 5000),
+    ("cache_size", -16000),  # negative means KiB, so 16MB of page cache
+    ("mmap_size", 64 * 1024 * 1024),
+    ("foreign_keys", "ON"),
+)
+
+# Store new works from search data alone and find their editions in the
+# background (see edition_enrichment.py), so searches don't wait on /api/books;
+# on with BOOKSWAP_DEFER_EDITION_LOOKUPS=1
+DEFER_EDITION_LOOKUPS = os.environ.get('BOOKSWAP_DEFER_EDITION_LOOKUPS', '0') == '1'
+
+# Keyset pagination of long lists (listings, trades, copies, search results)
+PAGE_SIZE = 50  # rows per page unless asked for fewer
+MAX_PAGE_SIZE = 200  # most rows a page may ask for
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes free within POOL_TIMEOUT seconds"""
+    pass
+
+
+class ConnectionPool:
+    """
+    ConnectionPool keeps long-lived, pre-tuned connections to one Sqlite
+        database file, so each request borrows a warm connection instead of
+        opening (and cold-starting) a new one.  Pools are per worker process:
+        a forked worker never reuses its parent's connections.
+    """
+
+    def __init__(self, database, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        """
+        Class initializer.
+        Accepts:
+            database (string): path to the Sqlite database file
+            size (int): most connections to hold open at once
+            timeout (int): seconds to wait for a free connection
+        """
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        """
+        Forgets every connection and counter.  Used at start-up and when we
+            find ourselves in a freshly forked worker.
+        """
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._num_open = 0
+        self.hits = 0
+        self.waits = 0
+        self.opens = 0
+
+    def _connect(self):
+        """
+        Opens and configures a new connection.
+        """
+        conn = sqlite3.connect(self.database, timeout=self.timeout,
+                               check_same_thread=False, factory=sql_trace.TracedConnection)
+        conn.row_factory = sqlite3.Row
+        for name, value in PRAGMAS:
+            conn.execute(f"PRAGMA {name} = {value}")
+        log.info(f"Opened pooled connection to {self.database}")
+        return conn
+
+    def acquire(self):
+        """
+        Borrows a connection: an idle one if there is one, a new one if the
+            pool is not full, otherwise waits for one to be released.
+        Returns:
+            sqlite3.Connection
+        """
+        with self._lock:
+            if os.getpid() != self._pid:
+                self._reset()
+            try:
+                conn = self._idle.get_nowait()
+                self.hits += 1
+                return conn
+            except queue.Empty:
+                pass
+            opening = self._num_open < self.size
+            if opening:
+                self._num_open += 1
+                self.opens += 1
+            else:
+                self.waits += 1
+        if opening:
+            try:
+                return self._connect()
+            except sqlite3.Error:
+                with self._lock:
+                    self._num_open -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            log.error(f"No free connection to {self.database} after {self.timeout} seconds")
+            raise PoolTimeoutError()
+
+    def release(self, conn):
+        """
+        Returns a borrowed connection to the pool, rolling back anything the
+            borrower left uncommitted.
+        Accepts:
+            conn (sqlite3.Connection): connection from acquire()
+        """
+        if os.getpid() != self._pid:
+            conn.close()
+            return
+        if conn.in_transaction:
+            log.warning("Rolling back uncommitted work on released connection")
+            conn.rollback()
+        conn.row_factory = sqlite3.Row
+        self._idle.put(conn)
+
+    def close_all(self):
+        """
+        Closes every idle connection.  Borrowed connections are closed when
+            they come back.
+        """
+        with self._lock:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                conn.close()
+                self._num_open -= 1
+
+    def stats(self):
+        """
+        Returns a dict of pool counters: hits (reused an idle connection),
+            waits (pool was full), opens (new connections), plus current
+            open and idle counts.
+        """
+        with self._lock:
+            return {"database": self.database,
+                    "size": self.size,
+                    "open": self._num_open,
+                    "idle": self._idle.qsize(),
+                    "hits": self.hits,
+                    "waits": self.waits,
+                    "opens": self.opens}
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(database=None):
+    """
+    get_pool returns this worker's connection pool for the database file,
+        creating it on first use.  A new pool first brings the database
+        schema up to date.
+    """
+    database = database or DATABASE
+    with _pools_lock:
+        pool = _pools.get(database)
+        if pool is None:
+            pool = ConnectionPool(database)
+            conn = pool.acquire()
+            try:
+                migrations.upgrade(conn)
+            finally:
+                pool.release(conn)
+            _pools[database] = pool
+    return pool
+
 
 def get_db():
     """
-    get_db opens the connection to the Sqlite database file.
+    get_db borrows a pooled connection to the Sqlite database file for the
+        rest of the request.
     """
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
+        pool = g._database_pool = get_pool()
+        db = g._database = pool.acquire()
     return db
 
 
+def release_db():
+    """
+    release_db hands the request's connection back to its pool.
+    """
+    db = g.pop('_database', None)
+    pool = g.pop('_database_pool', None)
+    if db is not None and pool is not None:
+        pool.release(db)
+
+
+def pool_stats():
+    """
+    pool_stats returns the counters for this worker's connection pool.
+    """
+    return get_pool().stats()
+
+
+@contextlib.contextmanager
+def transaction(db):
+    """
+    transaction runs the enclosed statements as one BEGIN IMMEDIATE ... COMMIT
+        unit of work: one commit for the lot, and a rollback of the lot if any
+        of them raises.  Taking the write lock up front means checks made
+        inside the block still hold when the writes land.  Nested blocks join
+        the outer transaction.
+    Accepts:
+        db (sqlite3.Connection): connection to run the transaction on
+    """
+    if db.in_transaction:
+        yield db
+        return
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield db
+    except BaseException:
+        db.rollback()
+        raise
+    db.commit()
+
+
+def fts_prefix_query(text):
+    """
+    fts_prefix_query turns free text from a search box into an FTS5 query
+        that matches every word as a prefix, e.g. 'harry pot' becomes
+        '"harry"* "pot"*'.  Punctuation is dropped, so user input can never
+        be read as FTS5 syntax.
+    Accepts:
+        text (string): search words
+    Returns:
+        FTS5 query (string), or None if there are no words to search for
+    """
+    words = re.findall(r"\w+", text or "")
+    if len(words) == 0:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+class Page(list):
+    """
+    One page of rows from a paginated query.  `next_cursor` is the opaque
+    cursor for the following page (pass it back as `after`), or None on the
+    last page.
+    """
+
+    def __init__(self, rows, next_cursor=None):
+        super().__init__(rows)
+        self.next_cursor = next_cursor
+
+
+def page_size(limit):
+    """
+    Clamps a requested page size to 1..MAX_PAGE_SIZE, PAGE_SIZE if not given.
+    """
+    try:
+        limit = int(limit) if limit is not None else PAGE_SIZE
+    except (TypeError, ValueError):
+        limit = PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def encode_cursor(values):
+    """
+    Encodes the sort key of a page's last row as a URL-safe cursor.
+    """
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, length):
+    """
+    Decodes a cursor made by encode_cursor.
+    Accepts:
+        cursor (string): cursor, or None for the first page
+        length (int): number of values in the query's sort key
+    Returns:
+        List of sort key values, or None for the first page (also for a
+            cursor that is damaged or from another query)
+    """
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    # Only what a sort key can hold goes on to the query
+    if any(isinstance(value, bool) or not isinstance(value, (int, float, str, type(None))) for value in values):
+        return None
+    return values
+
+
+def make_page(rows, limit, key):
+    """
+    Builds a Page from up to limit + 1 rows: the extra row only shows that
+        there is a next page.
+    Accepts:
+        rows (list): rows fetched with LIMIT limit + 1
+        limit (int): page size
+        key (function): row -> sort key values, for the next cursor
+    Returns:
+        Page
+    """
+    if len(rows) <= limit:
+        return Page(rows)
+    rows = rows[:limit]
+    return Page(rows, encode_cursor(key(rows[-1])))
+
+
 class EditionDuplicationError(Exception):
     """Raised when we are about to insert an entry into the Books table with an OLEditionKey that already exists"""
     pass
@@ -35,6 +357,7 @@ class BookSwapDatabase:
     """
 
     def __init__(self):
+        self.database = DATABASE
         self.db = get_db()
         self.db.row_factory = sqlite3.Row  # This allows us to access values by column name later on
 
@@ -74,6 +397,7 @@ class BookSwapDatabase:
         Book_not_received_by_requester completes the trade request:
             changes Trades.statusId to not completed (7)
             awards points to requester 
+        Both changes are made in a single transaction.
         Accepts:
             user_books_id (int): UserBooks.id
             user_num (int): Users.id
@@ -81,44 +405,43 @@ class BookSwapDatabase:
             None
         """
         c = self.db.cursor()
-       # award points to requester
-        try:
-            c.execute("""
-                    UPDATE 
-                        Users
-                    SET
-                        points = points + (
-                            SELECT
-                                points
-                            FROM
-                                UserBooks
-                            WHERE
-                                id = ?
-                                )
-                    WHERE
-                        id = ?
-                    """,
-                    ( user_books_id, user_num) )
-            self.db.commit()
-        except sqlite3.Error as e:
-            log.error(f"Awarding points to receiving user for book {user_books_id} -- {e}")
-            raise Exception
-        # Change Trade to failed (7)
-        try:
-            c.execute("""
-                    UPDATE
-                        Trades
-                    SET
-                        statusId = 7
-                    WHERE
-                        userBookId = ?
-                    """, 
-                    ( user_books_id, ))
-            self.db.commit()
-        except sqlite3.Error as e:
-            log.error("Changing trade status on book {user_books_id} -- {e}")
-            raise Exception
-         # job's done
+        with transaction(self.db):
+            # award points to requester
+            try:
+                c.execute("""
+                        UPDATE 
+                            Users
+                        SET
+                            points = points + (
+                                SELECT
+                                    points
+                                FROM
+                                    UserBooks
+                                WHERE
+                                    id = ?
+                                    )
+                        WHERE
+                            id = ?
+                        """,
+                        ( user_books_id, user_num) )
+            except sqlite3.Error as e:
+                log.error(f"Awarding points to receiving user for book {user_books_id} -- {e}")
+                raise Exception
+            # Change Trade to failed (7)
+            try:
+                c.execute("""
+                        UPDATE
+                            Trades
+                        SET
+                            statusId = 7
+                        WHERE
+                            userBookId = ?
+                        """, 
+                        ( user_books_id, ))
+            except sqlite3.Error as e:
+                log.error(f"Changing trade status on book {user_books_id} -- {e}")
+                raise Exception
+        # job's done
         return
 
     def book_received_by_requester(self, user_books_id, user_num):
@@ -126,6 +449,7 @@ class BookSwapDatabase:
         Book_received_by_requester completes the trade request:
             changes Trades.statusId to completed (6)
             awards points to sender 
+        Both changes are made in a single transaction.
         Accepts:
             user_books_id (int): UserBooks.id
             user_num (int): Users.id
@@ -133,51 +457,50 @@ class BookSwapDatabase:
             None
         """
         c = self.db.cursor()
-       # award points to sender
-        try:
-            c.execute("""
-                    UPDATE 
-                        Users
-                    SET
-                        points = points + (
-                            SELECT
-                                points
-                            FROM
-                                UserBooks
-                            WHERE
-                                id = ?
-                                )
-                    WHERE
-                        id = (
-                            SELECT
-                                userId
-                            From
-                                UserBooks
-                            WHERE
-                                id = ?
-                                )
-                    """,
-                    ( user_books_id, user_books_id) )
-            self.db.commit()
-        except sqlite3.Error as e:
-            log.error(f"Awarding points to sending user for book {user_books_id} -- {e}")
-            raise Exception
-        # Change Trade to complted (6)
-        try:
-            c.execute("""
-                    UPDATE
-                        Trades
-                    SET
-                        statusId = 6
-                    WHERE
-                        userBookId = ?
-                    """, 
-                    ( user_books_id, ))
-            self.db.commit()
-        except sqlite3.Error as e:
-            log.error("Changing trade status on book {user_books_id} -- {e}")
-            raise Exception
-         # job's done
+        with transaction(self.db):
+            # award points to sender
+            try:
+                c.execute("""
+                        UPDATE 
+                            Users
+                        SET
+                            points = points + (
+                                SELECT
+                                    points
+                                FROM
+                                    UserBooks
+                                WHERE
+                                    id = ?
+                                    )
+                        WHERE
+                            id = (
+                                SELECT
+                                    userId
+                                From
+                                    UserBooks
+                                WHERE
+                                    id = ?
+                                    )
+                        """,
+                        ( user_books_id, user_books_id) )
+            except sqlite3.Error as e:
+                log.error(f"Awarding points to sending user for book {user_books_id} -- {e}")
+                raise Exception
+            # Change Trade to complted (6)
+            try:
+                c.execute("""
+                        UPDATE
+                            Trades
+                        SET
+                            statusId = 6
+                        WHERE
+                            userBookId = ?
+                        """, 
+                        ( user_books_id, ))
+            except sqlite3.Error as e:
+                log.error(f"Changing trade status on book {user_books_id} -- {e}")
+                raise Exception
+        # job's done
         return
 
     def cancel_trade_by_requester(self, user_books_id, user_num):
@@ -186,6 +509,7 @@ class BookSwapDatabase:
             removes Trades row, 
             returns points to requester
             marks book as available
+        All three changes are made in a single transaction.
         Accepts:
             user_books_id (int): UserBooks.id
             user_num (int): Users.id
@@ -193,66 +517,64 @@ class BookSwapDatabase:
             None
         """
         c = self.db.cursor()
-       # return points to requester
-        try:
-            c.execute("""
-                    UPDATE 
-                        Users
-                    SET
-                        points = points + (
-                            SELECT
-                                points
-                            FROM
-                                UserBooks
-                            WHERE
-                                id = ?
-                                )
-                    WHERE
-                        id = ?
-                    """,
-                    ( user_books_id, user_num) )
-            self.db.commit()
-        except sqlite3.Error as e:
-            log.error(f"Returning points to User {user_num} for book {user_books_id} -- {e}")
-            raise Exception
-        # Mark book as available
-        try:
-            c.execute("""
-                    UPDATE
-                        UserBooks
-                    SET
-                        available = 1
-                    WHERE
-                        id = ?
-                    """,
-                    (user_books_id, ))
-            self.db.commit()
-        except sqlite3.Error as e:
-            log.error(f"Setting book {user_books_id} as available -- {e}")
-            raise Exception
-        # Delete trade entry
-        try:
-            c.execute("""
-                    DELETE FROM 
-                        Trades 
-                    WHERE
-                        Trades.userBookId = ?
-                    """, 
-                    ( user_books_id, ))
-            self.db.commit()
-        except sqlite3.Error as e:
-            log.error("Deleting trade on book {user_books_id} -- {e}")
-            raise Exception
-         # job's done
+        with transaction(self.db):
+            # return points to requester
+            try:
+                c.execute("""
+                        UPDATE 
+                            Users
+                        SET
+                            points = points + (
+                                SELECT
+                                    points
+                                FROM
+                                    UserBooks
+                                WHERE
+                                    id = ?
+                                    )
+                        WHERE
+                            id = ?
+                        """,
+                        ( user_books_id, user_num) )
+            except sqlite3.Error as e:
+                log.error(f"Returning points to User {user_num} for book {user_books_id} -- {e}")
+                raise Exception
+            # Mark book as available
+            try:
+                c.execute("""
+                        UPDATE
+                            UserBooks
+                        SET
+                            available = 1
+                        WHERE
+                            id = ?
+                        """,
+                        (user_books_id, ))
+            except sqlite3.Error as e:
+                log.error(f"Setting book {user_books_id} as available -- {e}")
+                raise Exception
+            # Delete trade entry
+            try:
+                c.execute("""
+                        DELETE FROM 
+                            Trades 
+                        WHERE
+                            Trades.userBookId = ?
+                        """, 
+                        ( user_books_id, ))
+            except sqlite3.Error as e:
+                log.error(f"Deleting trade on book {user_books_id} -- {e}")
+                raise Exception
+        # job's done
         return
                         
 
     def close(self):
         """
-        Closes the db connection
+        Returns the db connection to the pool
         :return: Nothing
         """
-        self.db.close()
+        release_db()
 
     def get_account_settings(self, user_id):
         """
@@ -279,17 +601,54 @@ class BookSwapDatabase:
             raise KeyError("User ID did not return only one row")
         return rows[0]
 
-    def get_all_open_requests(self, user_num):
+    def get_user_summary(self, user_num):
         """
-        Returns a list of all of a user's open requests.
+        Gets what every page shows about the logged-in user, in one query: the
+            username and points, plus the trade counts kept in
+            UserTradeCounters and the unseen wishlist notices counted in
+            WishlistInboxCounts.
         Accepts:
             user_num (int): Users.id
         Returns:
-            list of Row objects
+            Row object with keys 'username', 'points', 'numTradeRequests',
+                'numOpenTrades' and 'numWishlistMatches', or None if there is
+                no such user
         """
         c = self.db.cursor()
+        c.execute("""
+                SELECT
+                    Users.username AS username,
+                    Users.points AS points,
+                    IFNULL(UserTradeCounters.numTradeRequests, 0) AS numTradeRequests,
+                    IFNULL(UserTradeCounters.numOpenTrades, 0) AS numOpenTrades,
+                    IFNULL(WishlistInboxCounts.unseen, 0) AS numWishlistMatches
+                FROM
+                    Users LEFT JOIN
+                    UserTradeCounters ON UserTradeCounters.userId = Users.id LEFT JOIN
+                    WishlistInboxCounts ON WishlistInboxCounts.userId = Users.id
+                WHERE
+                    Users.id = ?
+                    """,
+                  (user_num,))
+        return c.fetchone()
+
+    def get_all_open_requests(self, user_num, after=None, limit=None):
+        """
+        Returns a user's requests, newest first, one page at a time.
+        Accepts:
+            user_num (int): Users.id
+            after (string): cursor from the previous page's next_cursor, or
+                None for the first page
+            limit (int): page size, see page_size
+        Returns:
+            Page of Row objects
+        """
+        limit = page_size(limit)
+        after = decode_cursor(after, 2)
+        keyset = "AND (Trades.dateInitiated, Trades.id) < (?, ?)" if after else ""
+        c = self.db.cursor()
         try:
-            c.execute("""
+            c.execute(f"""
                     SELECT
                         Trades.statusId AS statusId,
                         Books.title AS title,
@@ -300,7 +659,8 @@ class BookSwapDatabase:
                         Trades.dateInitiated AS dateInitiated,
                         Books.isbn AS isbn,
                         UserBooks.id AS userBooksId,
-                        CAST ((julianday('now') - julianday(Trades.dateInitiated)) AS INTEGER) AS tradeAge
+                        CAST ((julianday('now') - julianday(Trades.dateInitiated)) AS INTEGER) AS tradeAge,
+                        Trades.id AS tradeId
                     FROM
                         Trades INNER JOIN 
                         UserBooks on Trades.userBookId = UserBooks.id INNER JOIN
@@ -309,15 +669,18 @@ class BookSwapDatabase:
                     WHERE
                         Trades.statusId IN (2, 3, 4, 5, 6, 7) AND
                         Trades.userRequestedId = ?
+                        {keyset}
                     ORDER BY
-                        dateInitiated ASC
+                        Trades.dateInitiated DESC,
+                        Trades.id DESC
+                    LIMIT ?
                         """,
-                      (user_num,))
+                      (user_num, *(after or ()), limit + 1))
             rows = c.fetchall()
         except sqlite3.Error as e:
             log.error(f"Receiving open trades from database -- {e}")
             raise Exception
-        return rows
+        return make_page(rows, limit, lambda row: (row['dateInitiated'], row['tradeId']))
 
     def get_book_qualities(self):
         """
@@ -332,13 +695,17 @@ class BookSwapDatabase:
             out.append((row["id"], row["qualityDescription"]))
         return out
 
-    def get_listed_books(self, user_num):
+    def get_listed_books(self, user_num, after=None, limit=None):
         """
         Returns the rows corresponding to the books that user_id has listed as
-        available for swapping.
+        available for swapping, oldest listing first, one page at a time.
         :param user_num: the ID of the user whose listed books to return
-        :return: a list of sqlite3.Row objects corresponding to the listed books
+        :param after: cursor from the previous page's next_cursor, or None for the first page
+        :param limit: page size, see page_size
+        :return: a Page of sqlite3.Row objects corresponding to the listed books
         """
+        limit = page_size(limit)
+        after = decode_cursor(after, 1)
         c = self.db.cursor()
         c.execute("""
                     SELECT 
@@ -359,36 +726,27 @@ class BookSwapDatabase:
                             userId = ?
                         AND
                             UB.available == 1
+                        AND
+                            UB.id > ?
+                        ORDER BY
+                            UB.id
+                        LIMIT ?
                     """,
-                  (user_num,))
+                  (user_num, after[0] if after else 0, limit + 1))
         rows = c.fetchall()
         self.db.commit()
-        return rows
+        return make_page(rows, limit, lambda row: (row['id'],))
 
     def get_num_open_trades(self, user_num: int) -> int:
         """
         Returns number of trade requests this user has agreed to, but are not 
-            yet completed.
+            yet completed.  Read from UserTradeCounters, kept by triggers on Trades.
         """
         try:
             c = self.db.cursor()
-            c.execute("""
-                    SELECT
-                        COUNT (*)
-                    FROM
-                        Trades INNER JOIN
-                        UserBooks on Trades.userBookId = UserBooks.Id
-                    WHERE
-                        UserBooks.userId = ?
-                        AND
-                        Trades.statusId = 3
-                        """,
-                      (user_num,))
-            rows = c.fetchall()
-            if len(rows) != 1:
-                log.error(f"Received wrong number of data from database")
-                raise Exception
-            return rows[0][0]
+            c.execute("""SELECT numOpenTrades FROM UserTradeCounters WHERE userId = ?""", (user_num,))
+            row = c.fetchone()
+            return 0 if row is None else row[0]
         except sqlite3.Error as e:
             log.error(f"database error {e}")
             raise Exception
@@ -396,26 +754,13 @@ class BookSwapDatabase:
     def get_num_trade_requests(self, user_num: int) -> int:
         """
         Returns number of trade requests this user has, as the listing user.
+            Read from UserTradeCounters, kept by triggers on Trades.
         """
         try:
             c = self.db.cursor()
-            c.execute("""
-                    SELECT
-                        COUNT (*)
-                    FROM
-                        Trades INNER JOIN
-                        UserBooks on Trades.userBookId = UserBooks.Id
-                    WHERE
-                        UserBooks.userId = ?
-                        AND
-                        Trades.statusId = 2
-                        """,
-                      (user_num,))
-            rows = c.fetchall()
-            if len(rows) != 1:
-                log.error(f"Received wrong number of data from database")
-                raise Exception
-            return rows[0][0]
+            c.execute("""SELECT numTradeRequests FROM UserTradeCounters WHERE userId = ?""", (user_num,))
+            row = c.fetchone()
+            return 0 if row is None else row[0]
         except sqlite3.Error as e:
             log.error(f"database error {e}")
             raise Exception
@@ -439,7 +784,7 @@ class BookSwapDatabase:
                         Trades.userBookId = ?
                     """,
                     (user_books_id, ))
-            print("GET TRADE AGE")
+            log.debug("Getting trade age for UserBooks %s", user_books_id)
             rows = c.fetchall()
         except sqlite3.Error as e:
                 log.error(f"Getting trade age -- {e}")
@@ -488,9 +833,30 @@ class BookSwapDatabase:
         return rows[0]
 
 
-    def get_trade_info(self, user_num):
+    def get_trade_info(self, user_num, statuses=None, after=None, limit=None):
+        """
+        Returns the trades on a user's listings, oldest first, one page at a
+            time.
+        Accepts:
+            user_num (int): Users.id of the listing user
+            statuses (tuple of ints): only trades in these statuses, or None
+                for all of them
+            after (string): cursor from the previous page's next_cursor, or
+                None for the first page
+            limit (int): page size, see page_size
+        Returns:
+            Page of Row objects
+        """
+        limit = page_size(limit)
+        after = decode_cursor(after, 1)
+        params = [user_num, after[0] if after else 0]
+        status_filter = ""
+        if statuses is not None:
+            status_filter = f"AND Trades.statusId IN ({','.join('?' * len(statuses))})"
+            params.extend(statuses)
+        params.append(limit + 1)
         c = self.db.cursor()
-        c.execute("""
+        c.execute(f"""
                 SELECT  Trades.statusId StatusId,
                         Trades.dateInitiated AS StartDate,
                         Books.title AS Title,
@@ -501,7 +867,8 @@ class BookSwapDatabase:
                         U1.username AS Owner,
                         U2.username AS Requester,
                         UserBooks.id AS userBooksId,
-                        Books.coverImageUrl as coverImageUrl
+                        Books.coverImageUrl as coverImageUrl,
+                        Trades.id AS tradeId
                 FROM    Users U1 INNER JOIN
                         UserBooks on U1.id = UserBooks.userId INNER JOIN
                         Trades on UserBooks.id = Trades.userBookId INNER JOIN
@@ -509,11 +876,16 @@ class BookSwapDatabase:
                         CopyQualities ON UserBooks.CopyQualityId = CopyQualities.Id INNER JOIN
                         Users U2 on U2.id = Trades.userRequestedId
                 WHERE
-                        UserBooks.userId = ?
-                """, (user_num,))
+                        UserBooks.userId = ? AND
+                        Trades.id > ?
+                        {status_filter}
+                ORDER BY
+                        Trades.id
+                LIMIT ?
+                """, tuple(params))
         rows = c.fetchall()
         self.db.commit()
-        return rows
+        return make_page(rows, limit, lambda row: (row['tradeId'],))
 
 
     def get_trade_requester(self, user_books_id):
@@ -545,7 +917,7 @@ class BookSwapDatabase:
         return rows[0]
 
 
-    def get_or_add_ol_book_details(self, search_result):
+    def get_or_add_ol_book_details(self, search_result, edition=None, defer=False):
         """
         Does the same thing as get_ol_book_details, but if the book is not yet stored then finds the first english
         language paperback/hardcover Edition of the Work corresponding to the given key in the Open Library API and
@@ -554,7 +926,12 @@ class BookSwapDatabase:
         required. To clarify: there is currently no way to add details for an Open Library Work, given a Work Key,
         unless we have access to the information from the search result.  
 
+        :param edition: optional (edition_key, isbn) tuple already found by openlibrary.find_english_edition, so
+        the Open Library lookup can be done elsewhere (e.g. on another thread) and only the insert happens here
+        :param defer: if no edition is given, store the book without one and queue the edition lookup for the
+        background worker in edition_enrichment, instead of looking it up now
         :returns a dict of the attributes for the Books row
+        :raises openlibrary.OpenLibraryError if Open Library can't be reached
         """
         # Get the Work Key from the search result
         work_key = search_result['key'].split('/')[2]
@@ -566,35 +943,20 @@ class BookSwapDatabase:
         d = {'title': search_result['title'] if 'title' in search_result else 'Unknown Title',
              'author': search_result['author_name'][0] if 'author_name' in search_result else 'Unknown Author',
              'OLWorkKey': work_key}
-        editions = search_result['edition_key']
-        # Check the editions 10 at a time
-        n = len(editions)
-        edition_key = None
-        isbn = None
-        i = 0
-        while (i < (n // 10) + 1) and (edition_key is None):
-            batch = editions[i:i + 10]
-            url = 'https://openlibrary.org/api/books'
-            payload = {'format': 'json',
-                       'jscmd': 'details',
-                       'bibkeys': ','.join(batch)}
-            r = requests.get(url, params=payload)
-            data = r.json()
-            for candidate in data.keys():
-                details = data[candidate]['details']
-                if 'languages' in details and 'covers' in details and 'isbn_13' in details:
-                    languages = details['languages']
-                    if len(languages) == 1 and languages[0]['key'] == '/languages/eng':
-                        edition_key = candidate
-                        isbn = int(details['isbn_13'][0].replace('-', '').replace(' ', ''))
-                        break
-            i += 10
+        edition_keys = search_result.get('edition_key', [])
+        queue_lookup = False
+        if edition is None and defer:
+            edition = (None, None)
+            queue_lookup = len(edition_keys) > 0
+        elif edition is None:
+            edition = openlibrary.find_english_edition(search_result)
+        edition_key, isbn = edition
         # Note that edition_key could still be None if we didn't find a suitable one, that's fine
         # Insert the book info now
         d['OLEditionKey'] = edition_key
         d['ISBN'] = isbn
         if edition_key is not None:
-            d['coverImageUrl'] = "http://covers.openlibrary.org/b/olid/" + edition_key + "-L.jpg"
+            d['coverImageUrl'] = openlibrary.cover_url(edition_key)
             # Check if we are about to duplicate an edition key
             local_edition = self.get_ol_edition_details(edition_key)
             if local_edition is not None:
@@ -602,15 +964,18 @@ class BookSwapDatabase:
         else:
             d['coverImageUrl'] = None
         c = self.db.cursor()
-        print(
-            f'About to insert Books row with OLWorkKey value {work_key} and OLEditionKey value {edition_key} - the '
-            f'book is {d["title"]} by {d["author"]}')
-        c.execute(
-            """INSERT INTO Books (title, author, ISBN, OLWorkKey, OLEditionKey, coverImageUrl) VALUES (?, ?, ?, ?, ?, 
-            ?)""",
-            (d['title'], d['author'], isbn, work_key, edition_key, d['coverImageUrl']))
-        self.db.commit()
-        d['id'] = c.lastrowid  # ID of the recently inserted Books row
+        log.debug('About to insert Books row with OLWorkKey value %s and OLEditionKey value %s - the book is %s by %s',
+                  work_key, edition_key, d["title"], d["author"])
+        with transaction(self.db):
+            c.execute(
+                """INSERT INTO Books (title, author, ISBN, OLWorkKey, OLEditionKey, coverImageUrl) VALUES (?, ?, ?, ?, ?, 
+                ?)""",
+                (d['title'], d['author'], isbn, work_key, edition_key, d['coverImageUrl']))
+            d['id'] = c.lastrowid  # ID of the recently inserted Books row
+            if queue_lookup:
+                edition_enrichment.enqueue(self.db, d['id'], edition_keys)
+        if queue_lookup:
+            edition_enrichment.notify()
         return d
 
     def get_ol_book_details(self, work_key):
@@ -662,7 +1027,7 @@ class BookSwapDatabase:
             # Book does not exist - must call 'get_or_add_ol_book_details' with a list of Edition keys
             return None
 
-    def search_books_openlibrary(self, title=None, author=None, isbn=None, num_results=1, book_id_ignorelist=[]):
+    def search_books_openlibrary(self, title=None, author=None, isbn=None, num_results=1, book_id_ignorelist=()):
         """
         Searches for books that match the provided details, and then returns the results. The search is conducted on
         the Open Library API. This method automatically searches for matching books and stores a local copy of the
@@ -681,7 +1046,7 @@ class BookSwapDatabase:
         :param author: Search is done for books whose author contains this string
         :param isbn: Must be a STRING
         :param num_results: int, the number of results to return
-        :param book_id_ignorelist: a list of book IDs to not include in the results
+        :param book_id_ignorelist: a set (or other container) of book IDs to not include in the results
 
         :return: A 'num_results' long list of dicts/sqlite.Rows corresponding to search results.
                     Each row has the following keys:
@@ -693,24 +1058,44 @@ class BookSwapDatabase:
                     'coverImageUrl'
         """
         # Clean inputs and get the search results
-        url = "http://openlibrary.org/search.json"
         if title == '':
             title = None
         if author == '':
             author = None
-        payload = {'title': title, 'author': author, 'isbn': isbn}
-        r = requests.get(url, params=payload)  # auto-ignores 'None' values
-        if r.status_code != 200:
-            results = []
-        else:
-            results = r.json()['docs'][:num_results]
+        if isbn == '':
+            isbn = None
+        book_id_ignorelist = set(book_id_ignorelist)
         out = []
-        # Return the book info
-        for idx, result in enumerate(results):
-            print(f'Processing search result number {idx}')
-            book_info = self.get_or_add_ol_book_details(result)  # This does the heavy lifting
-            if book_info['id'] not in book_id_ignorelist:
-                out.append(book_info)
+        with openlibrary.record_calls() as calls:
+            try:
+                results = openlibrary.search(title=title, author=author, isbn=isbn, limit=num_results)
+            except openlibrary.OpenLibraryError:
+                results = []
+            # Start the edition lookups for works we haven't stored yet, all at once; they only touch the network.
+            # Most search results already name a suitable edition, and need no lookup at all.
+            lookups = {}
+            for idx, result in enumerate(results):
+                if self.get_ol_book_details(result['key'].split('/')[2]) is None:
+                    edition = openlibrary.edition_from_search_result(result)
+                    if edition is None and not DEFER_EDITION_LOOKUPS:
+                        lookups[idx] = openlibrary.submit(openlibrary.find_english_edition, result)
+                    else:
+                        lookups[idx] = edition  # None if deferred: queued for the background worker
+            # Return the book info, in search order, storing new books from this thread
+            for idx, result in enumerate(results):
+                log.debug('Processing search result number %d', idx)
+                try:
+                    edition = lookups.get(idx)
+                    if isinstance(edition, concurrent.futures.Future):
+                        edition = edition.result()
+                    book_info = self.get_or_add_ol_book_details(result, edition, defer=DEFER_EDITION_LOOKUPS)
+                except openlibrary.OpenLibraryError:
+                    log.warning(f"Skipping search result {idx}, Open Library could not be reached for its details")
+                    continue
+                if book_info['id'] not in book_id_ignorelist:
+                    out.append(book_info)
+        log.info("Open Library search made %d calls (%d failed) taking %.0f ms in total",
+                 calls.count, calls.failures, calls.total_ms)
         return out
 
     def user_add_book_by_id(self, book_id, user_num, copyquality, points):
@@ -725,6 +1110,7 @@ class BookSwapDatabase:
         cur_points += 0.1
         c.execute("""UPDATE Users SET points = (?) WHERE id = (?)""", (cur_points, user_num))
         self.db.commit()
+        wishlist_matches.notify(self.db)
         return
 
     def user_add_book_to_wishlist_by_id(self, book_id, user_num):
@@ -776,6 +1162,7 @@ class BookSwapDatabase:
         c.execute("""INSERT INTO UserBooks (userId, bookId, copyQualityId) VALUES (?, ?, ?)""",
                   (user_num, book_id, copyquality))
         self.db.commit()
+        wishlist_matches.notify(self.db)
 
     def get_username_id(self, username):
         """
@@ -940,9 +1327,11 @@ class BookSwapDatabase:
             log.error(e)
             raise Exception
 
+    @query_cache.cached('listings')
     def get_recent_additions(self, num):
         """
-        Returns the most recent available additions to the site.
+        Returns the most recent available additions to the site.  Cached until
+            a listing changes, see query_cache.
         Accepts:
             num (int): Number of recent additions to be returned
         Returns:
@@ -980,11 +1369,13 @@ class BookSwapDatabase:
             log.error(e)
             return {}
 
-    def get_books_by_ISBN(self, ISBN):
+    def get_books_by_ISBN(self, ISBN, limit=None):
         """
-        Checks UserBooks table for all books with ISBN.
+        Checks UserBooks table for books with ISBN, oldest listing first.
+            search_local_books pages through every result.
         Accepts:
             ISBN (string): ISBN search criteria
+            limit (int): most rows to return, see page_size
         Returns:
             Array of Row objects
         """
@@ -1015,34 +1406,191 @@ class BookSwapDatabase:
                         UserBooks.available == 1
                     ORDER BY
                         UserBooks.dateCreated
+                    LIMIT ?
                         """,
-                      (ISBN,))
+                      (ISBN, page_size(limit)))
             isbn_match = c.fetchall()
-            log.info("BSDB: Get_Books_By_ISBN (local) Results")
-            self.print_results(isbn_match)
+            self.log_results("Get_Books_By_ISBN", isbn_match)
             return isbn_match
         except sqlite3.Error as e:
             log.error(e)
             return {}
 
-    def get_books_by_author_and_title(self, author, title):
+    def get_books_by_author_and_title(self, author, title, limit=None):
         """
-        Checks Books table for books with both author and title match.
+        Checks Books table for books with both author and title match, using
+            the BooksSearch full-text index.  Each word of the search matches
+            any word starting with it, and results are ranked by bm25.
         Accepts:
             author (string): author search criteria
             title (string): title search criteria
+            limit (int): most rows to return, see page_size
         Returns:
             Array of Row objects
         """
-        c = self.db.cursor()
-        if len(author) == 0 or len(title) == 0:
+        match = self._author_and_title_match(author, title)
+        if match is None:
+            return {}
+        return self._full_text_search(match, "get_books_by_author_and_title", limit)
+
+    def get_books_by_author_or_title(self, author, title, limit=None):
+        """
+        Checks Books table for books with author or title match, using the
+            BooksSearch full-text index.  Each word of the search matches any
+            word starting with it, and results are ranked by bm25.
+        Accepts:
+            author (string): author search criteria
+            title (string): title search criteria
+            limit (int): most rows to return, see page_size
+        Returns:
+            Array of Row objects
+        """
+        match = self._author_or_title_match(author, title)
+        if match is None:
             return {}
+        return self._full_text_search(match, "get_books_by_author_or_title", limit)
+
+    def _author_and_title_match(self, author, title):
+        """
+        Builds the BooksSearch query for books matching both author and title.
+        Returns:
+            FTS5 query (string), or None if either is blank
+        """
+        author_query = fts_prefix_query(author)
+        title_query = fts_prefix_query(title)
+        if author_query is None or title_query is None:
+            return None
+        return f"(author : ({author_query})) AND (title : ({title_query}))"
+
+    def _author_or_title_match(self, author, title):
+        """
+        Builds the BooksSearch query for books matching author or title.
+        Returns:
+            FTS5 query (string), or None if both are blank
+        """
+        filters = []
+        author_query = fts_prefix_query(author)
+        title_query = fts_prefix_query(title)
+        if author_query is not None:
+            filters.append(f"(author : ({author_query}))")
+        if title_query is not None:
+            filters.append(f"(title : ({title_query}))")
+        if len(filters) == 0:
+            return None
+        return " OR ".join(filters)
+
+    def search_local_books(self, isbn, author, title, num, after=None):
+        """
+        Search_local_books finds the available listings for a book search in
+            one ranked query.  ISBN matches come first, then author AND title
+            matches, then author OR title matches, oldest listing first within
+            each tier.  A listing matched by several tiers is returned once, at
+            its best tier, and only the first `num` rows leave SQLite.  Pages
+            follow listing columns, not match scores, which change with the
+            search index, so "load more" neither skips nor repeats a listing.
+        Accepts:
+            isbn (string): ISBN search criteria
+            author (string): author search criteria
+            title (string): title search criteria
+            num (int): most results to return, see page_size
+            after (string): cursor from the previous page's next_cursor, or
+                None for the first page
+        Returns:
+            Page of Row objects, with the same keys as get_books_by_ISBN
+        """
+        tiers = []
+        params = []
+        if isbn:
+            tiers.append("SELECT id AS bookId, 0 AS tier FROM Books WHERE ISBN = ?")
+            params.append(isbn)
+        for tier, match in ((1, self._author_and_title_match(author, title)),
+                            (2, self._author_or_title_match(author, title))):
+            if match is not None:
+                tiers.append(f"SELECT rowid AS bookId, {tier} AS tier FROM BooksSearch WHERE BooksSearch MATCH ?")
+                params.append(match)
+        if len(tiers) == 0:
+            return Page([])
+        num = page_size(num)
+        after = decode_cursor(after, 3)
+        keyset = ""
+        if after:
+            keyset = "AND (BestMatches.tier, UserBooks.dateCreated, UserBooks.id) > (?, ?, ?)"
+            params.extend(after)
+        params.append(num + 1)
+        c = self.db.cursor()
+        try:
+            # Only books with a copy available (a row in BookAvailability) are
+            # ranked, each at its best tier; their copies are read in cursor
+            # order from UserBooks_available_bookId_dateCreated
+            c.execute(f"""
+                    WITH Matches AS (
+                        {" UNION ALL ".join(tiers)}
+                    ),
+                    BestMatches AS (
+                        SELECT bookId, MIN(tier) AS tier
+                        FROM Matches
+                        WHERE bookId IN (SELECT bookId FROM BookAvailability)
+                        GROUP BY bookId
+                    )
+                    SELECT
+                        Books.title AS title,
+                        Books.author AS author,
+                        Books.ISBN AS ISBN,
+                        Books.externalLink AS externalLink,
+                        Users.username as listingUser,
+                        CopyQualities.qualityDescription as copyQuality,
+                        CAST ((julianday('now') - julianday(UserBooks.dateCreated)) AS INTEGER) AS timeHere,
+                        UserBooks.points as pointsNeeded,
+                        UserBooks.id as userBooksId,
+                        UserBooks.userId AS userId,
+                        Books.id AS booksId,
+                        IFNULL(Books.coverImageUrl, '/static/images/book.png') AS coverImageUrl,
+                        BestMatches.tier AS tier,
+                        UserBooks.dateCreated AS dateCreated
+                    FROM BestMatches
+                    INNER JOIN Books
+                        on Books.id = BestMatches.bookId
+                    INNER JOIN UserBooks
+                        on Books.id = UserBooks.bookId
+                    INNER JOIN CopyQualities
+                        on UserBooks.copyQualityId = CopyQualities.id
+                    INNER JOIN Users
+                        on UserBooks.userId = Users.id
+                    WHERE
+                        UserBooks.available == 1
+                        {keyset}
+                    ORDER BY
+                        BestMatches.tier,
+                        UserBooks.dateCreated,
+                        UserBooks.id
+                    LIMIT ?
+                    """,
+                      tuple(params))
+            return make_page(c.fetchall(), num,
+                             lambda row: (row['tier'], row['dateCreated'], row['userBooksId']))
+        except sqlite3.Error as e:
+            log.error(f"Error searching local books -- {e}")
+            return Page([])
+
+    def _full_text_search(self, match, caller, limit=None):
+        """
+        Runs a BooksSearch MATCH query and returns the available listings of
+            the matching books, best match first.  search_local_books pages
+            through every result.
+        Accepts:
+            match (string): FTS5 query
+            caller (string): name of calling method, for the log
+            limit (int): most rows to return, see page_size
+        Returns:
+            Array of Row objects
+        """
+        c = self.db.cursor()
         try:
             c.execute("""SELECT
-                    title,
-                    author,
-                    ISBN,
-                    externalLink,
+                    Books.title AS title,
+                    Books.author AS author,
+                    Books.ISBN AS ISBN,
+                    Books.externalLink AS externalLink,
                     Users.username as listingUser,
                     CopyQualities.qualityDescription as copyQuality,
                     CAST ((julianday('now') - julianday(UserBooks.dateCreated)) AS INTEGER) AS timeHere,
@@ -1050,8 +1598,10 @@ class BookSwapDatabase:
                     UserBooks.id as userBooksId,
                     UserBooks.userId AS userId,
                     Books.id AS booksId,
-                    IFNULL(coverImageUrl, '/static/images/book.png') AS coverImageUrl
-                    FROM Books
+                    IFNULL(Books.coverImageUrl, '/static/images/book.png') AS coverImageUrl
+                    FROM BooksSearch
+                    INNER JOIN Books
+                        on Books.id = BooksSearch.rowid
                     INNER JOIN UserBooks
                         on Books.id = UserBooks.bookId
                     INNER JOIN CopyQualities
@@ -1059,136 +1609,51 @@ class BookSwapDatabase:
                     INNER JOIN Users
                         on UserBooks.userId = Users.id
                     WHERE
-                        author LIKE '%'||?||'%'
-                    AND
-                        title LIKE '%'||?||'%'
+                        BooksSearch MATCH ?
                     AND
                         UserBooks.available == 1
                     ORDER BY
-                        author = ? DESC,
-                        title = ? DESC,
-                        author LIKE ?||'%' DESC,
-                        author LIKE '%'||? DESC,
-                        author
+                        bm25(BooksSearch),
+                        Books.author
+                    LIMIT ?
                         """,
-                      (author, title, author, title, author, author))
-            author_and_title_match = c.fetchall()
-            log.info("BSDB: get_books_by_author_and_title (local) Results")
-            self.print_results(author_and_title_match)
-            return author_and_title_match
-        except sqlite3.Error as e:
-            log.error(e)
-            return {}
-
-    def get_books_by_author_or_title(self, author, title):
-        """
-        Checks Books table for books with author or title match.
-        Accepts:
-            author (string): author search criteria
-            title (string): title search criteria
-        Returns:
-            Array of Row objects
-        """
-        if len(author) == len(title) == 0:
-            return {}
-        query_start = """
-            SELECT 
-                title, 
-                author, 
-                ISBN, 
-                externalLink,
-                Users.username as listingUser,
-                UserBooks.userId AS userId,
-                CopyQualities.qualityDescription as copyQuality,
-                Books.id AS booksId,
-                CAST 
-                    ((julianday('now') - julianday(UserBooks.dateCreated)) 
-                        AS INTEGER) AS timeHere,
-                UserBooks.points as pointsNeeded,
-                UserBooks.id as userBooksId,
-                IFNULL(coverImageUrl, '/static/images/book.png') AS coverImageUrl
-            FROM Books
-            INNER JOIN UserBooks
-                on Books.id = UserBooks.bookId
-            INNER JOIN CopyQualities
-                on UserBooks.copyQualityId = CopyQualities.id
-            INNER JOIN Users
-                on UserBooks.userId = Users.id
-            """
-        query_middle = " WHERE UserBooks.available == 1 AND ("
-        query_end = " ORDER BY "
-        params = []
-        author_exists = title_exists = False
-        if len(author) > 0:
-            author_exists = True
-        if len(title) > 0:
-            title_exists = True
-        if author_exists:
-            query_middle += "author LIKE '%'||?||'%' "
-            params.append(author)
-            if title_exists:
-                query_middle += " OR "
-        if title_exists:
-            query_middle += "title LIKE '%'||?||'%'"
-            query_end += " title = ? DESC,"
-            params += [title, title]
-        if author_exists:
-            query_end += " author = ? DESC,"
-            params.append(author)
-        if title_exists:
-            query_end += " title LIKE ?||'%' DESC,"
-            params.append(title)
-        if author_exists:
-            query_end += " author LIKE ?||'%' DESC,"
-            params.append(author)
-        if title_exists:
-            query_end += " title LIKE '%'||? DESC,"
-            params.append(title)
-        if author_exists:
-            query_end += " author LIKE '%'||? DESC,"
-            params.append(author)
-        query_middle += ")"
-        query_end += " author"
-        query = query_start + query_middle + query_end
-        params = tuple(params)
-        c = self.db.cursor()
-        try:
-            c.execute(query, params)
-            author_or_title_match = c.fetchall()
-            log.info("BSDB: get_books_by_author_or_title (local) Results")
-            self.print_results(author_or_title_match)
-            return author_or_title_match
+                      (match, page_size(limit)))
+            matches = c.fetchall()
+            self.log_results(caller, matches)
+            return matches
         except sqlite3.Error as e:
             log.error(e)
             return {}
 
-    def print_results(self, rows):
+    def log_results(self, caller, rows):
         """
-        Prints results.
+        Logs every column of every result row, at debug level.
         Accepts:
+            caller (str): name of the query the rows came from
             rows (Row objects): returns from SQL query
         Returns:
             None
         """
-        print("Printing Search Results:")
-        i = 1
-        for row in rows:
-            print(f"\t Result #{i}:")
-            for key in row.keys():
-                print(f"\t\t {key}: {row[key]}")
-            i += 1
-        return
+        if not log.isEnabledFor(logging.DEBUG):
+            return
+        log.debug("BSDB: %s (local) Results: %s", caller, [dict(row) for row in rows])
 
-    def get_available_copies(self, book_id, user_num):
+    def get_available_copies(self, book_id, user_num, after=None, limit=None):
         """
         Get_copies returns the available copies of the requested book that are
-            not in the library of the given user.
+            not in the library of the given user, oldest listing first, one
+            page at a time.
         Accepts:
             book_id (int): Books.id
             user_num (int): Users.id
+            after (string): cursor from the previous page's next_cursor, or
+                None for the first page
+            limit (int): page size, see page_size
         Returns:
-            List of Rows
+            Page of Rows
         """
+        limit = page_size(limit)
+        after = decode_cursor(after, 1)
         c = self.db.cursor()
         try:
             c.execute("""
@@ -1214,11 +1679,15 @@ class BookSwapDatabase:
                     WHERE
                         Books.id = ? AND
                         UserBooks.available = 1 AND
-                        UserBooks.userId != ?
+                        UserBooks.userId != ? AND
+                        UserBooks.id > ?
+                    ORDER BY
+                        UserBooks.id
+                    LIMIT ?
                         """,
-                      (book_id, user_num))
-            rows = c.fetchall()
-            log.info(f"Fetched all available books for Book {book_id} that are not owned by {user_num}")
+                      (book_id, user_num, after[0] if after else 0, limit + 1))
+            rows = make_page(c.fetchall(), limit, lambda row: (row['userBooksId'],))
+            log.info("Fetched all available books for Book %s that are not owned by %s", book_id, user_num)
         except sqlite3.Error as e:
             log.error(f"Error fetching available books for Book {book_id} that are not owned by{user_num} -- {e}")
             raise Exception
@@ -1259,52 +1728,154 @@ class BookSwapDatabase:
         Returns:
             List of sqlite3 Row objects
         """
-        c = self.db.cursor()
         try:
-            c.execute("""
+            return self._get_wishlist_books("Wishlists.id = ?", wishlist_id)
+        except sqlite3.Error as e:
+            log.error(f"Error getting books in wishlist {wishlist_id} -- {e}")
+            raise Exception
+
+    def get_wishlist_books_for_user(self, user_id):
+        """
+        Get_wishlist_books_for_user gets the rows for the `user/my-wishlist`
+            page for every one of a user's wishlists at once: each wished book
+            with the number of copies other users have available and the
+            fewest points one costs.
+        Accepts:
+            user_id (int): Users.id
+        Returns:
+            List of sqlite3 Row objects, by wishlist then book
+        """
+        try:
+            return self._get_wishlist_books("Wishlists.userId = ?", user_id)
+        except sqlite3.Error as e:
+            log.error(f"Error getting wishlist books for user {user_id} -- {e}")
+            raise Exception
+
+    def _get_wishlist_books(self, condition, value):
+        """
+        Reads the wished books of the wishlists matching `condition`, with
+            their availability from BookAvailability.  That counts every
+            available copy, so the wishlist owner's own copies are taken off;
+            only when the owner has one is the minimum looked up again.
+        Accepts:
+            condition (string): SQL condition on Wishlists, with one parameter
+            value: the condition's parameter
+        Returns:
+            List of sqlite3 Row objects, by wishlist then book
+        """
+        c = self.db.cursor()
+        c.execute(f"""
+                    WITH Wished AS (
                         SELECT
-                            Books.title AS title, 
-                            Books.coverImageUrl AS coverImageUrl,
-                            Books.author AS author,
-                            Books.ISBN AS ISBN,
-                            COUNT(UserBooks.id) AS numberAvailable,
-                            min(UserBooks.points) AS minPoints,
+                            Wishlists.userId AS userId,
                             WishlistsBooks.wishlistId AS wishlistId,
-                            Books.id AS bookId
-                        FROM 
-                            WishlistsBooks 
-                                INNER JOIN 
-                            Books 
-                                ON
-                                    WishlistsBooks.bookId=Books.id 
-                                INNER JOIN
+                            WishlistsBooks.bookId AS bookId,
+                            (SELECT COUNT(*)
+                             FROM UserBooks
+                             WHERE
+                                UserBooks.userId = Wishlists.userId AND
+                                UserBooks.bookId = WishlistsBooks.bookId AND
+                                UserBooks.available = 1) AS ownCopies
+                        FROM
                             Wishlists
+                                INNER JOIN
+                            WishlistsBooks
                                 ON
                                     WishlistsBooks.wishlistId = Wishlists.id
-                                LEFT JOIN
-                            UserBooks
+                        WHERE
+                            {condition}
+                    )
+                    SELECT
+                        Books.title AS title,
+                        Books.coverImageUrl AS coverImageUrl,
+                        Books.author AS author,
+                        Books.ISBN AS ISBN,
+                        IFNULL(BookAvailability.availableCount, 0) - Wished.ownCopies AS numberAvailable,
+                        CASE
+                            WHEN Wished.ownCopies = 0 THEN BookAvailability.minPoints
+                            ELSE (SELECT min(points)
+                                  FROM UserBooks
+                                  WHERE
+                                    UserBooks.bookId = Wished.bookId AND
+                                    UserBooks.available = 1 AND
+                                    UserBooks.userId != Wished.userId)
+                        END AS minPoints,
+                        Wished.wishlistId AS wishlistId,
+                        Books.id AS bookId
+                    FROM
+                        Wished
+                            INNER JOIN
+                        Books
+                            ON
+                                Wished.bookId = Books.id
+                            LEFT JOIN
+                        BookAvailability
+                            ON
+                                Wished.bookId = BookAvailability.bookId
+                    ORDER BY
+                        Wished.wishlistId,
+                        Wished.bookId""",
+                  (value,))
+        return c.fetchall()
+
+    def get_wishlist_matches(self, user_num, limit=None):
+        """
+        Get_wishlist_matches returns the user's unseen "now available" notices
+            for books on their wishlists, newest first (see wishlist_matches).
+        Accepts:
+            user_num (int): Users.id
+            limit (int): most notices to return, see page_size
+        Returns:
+            List of sqlite3 Row objects
+        """
+        c = self.db.cursor()
+        try:
+            c.execute("""
+                        SELECT
+                            Books.title AS title,
+                            Books.author AS author,
+                            Books.coverImageUrl AS coverImageUrl,
+                            WishlistInbox.bookId AS bookId,
+                            WishlistInbox.userBookId AS userBookId,
+                            WishlistInbox.dateAdded AS dateAdded,
+                            WishlistInbox.seen AS seen
+                        FROM
+                            WishlistInbox
+                                INNER JOIN
+                            Books
                                 ON
-                                    WishlistsBooks.bookId = UserBooks.bookId 
+                                    WishlistInbox.bookId = Books.id
                         WHERE
-                            WishlistsBooks.wishlistId = ? 
-                                AND
-                            (
-                                UserBooks.userId IS NULL OR
-                                (
-                                    UserBooks.userId != Wishlists.userId
-                                        AND
-                                    UserBooks.available = 1
-                                )
-                            )
-                        GROUP BY
-                            WishlistsBooks.bookId""",
-                      (wishlist_id,))
+                            WishlistInbox.userId = ? AND
+                            WishlistInbox.seen = 0
+                        ORDER BY
+                            WishlistInbox.dateAdded DESC
+                        LIMIT ?""",
+                      (user_num, page_size(limit)))
             rows = c.fetchall()
         except sqlite3.Error as e:
-            log.error(f"Error getting books in wishlist {wishlist_id} -- {e}")
+            log.error(f"Error getting wishlist notices for user {user_num} -- {e}")
             raise Exception
         return rows
 
+    def mark_wishlist_matches_seen(self, user_num, matches):
+        """
+        Mark_wishlist_matches_seen marks the notices the user has been shown
+            as seen, taking them off the wishlist badge.  A notice renewed
+            since it was read (a newer listing of the book) stays unseen.
+        Accepts:
+            user_num (int): Users.id
+            matches (list of dicts or Rows): notices from get_wishlist_matches
+        Returns:
+            None
+        """
+        with transaction(self.db):
+            self.db.executemany("""
+                        UPDATE WishlistInbox SET seen = 1
+                        WHERE userId = ? AND bookId = ? AND userBookId = ? AND dateAdded = ? AND seen = 0""",
+                                [(user_num, match['bookId'], match['userBookId'], match['dateAdded'])
+                                 for match in matches])
+
     def get_current_user_points(self, user_num):
         """
         Get_current_user_points returns the number of points of the requested
@@ -1334,7 +1905,8 @@ class BookSwapDatabase:
     def request_book(self, book, user_num):
         """
         Request_book places a request on UserBook entry `book`, for user 
-            `user_num`.
+            `user_num`.  The checks and all the changes are made in a single
+            transaction, so points and availability can't be half-applied.
         Accepts:
             book (dict):  UserBook information
             user_num (int): User ID of requester
@@ -1342,94 +1914,92 @@ class BookSwapDatabase:
             points left for requesting user (int)
         """
         c = self.db.cursor()
-        # Make sure user still has enough points
-        try:
-            points_available = self.get_current_user_points(user_num)
-        except sqlite3.Error as e:
-            log.error(f"Error trying to confirm user {user_num} has sufficient points. {e}")
-            raise Exception
-        #TODO: Fix 'POINTSNEEDED"
-        if points_available < book['pointsNeeded']:
-            log.warning(f"Requesting user does not have sufficient points for the trade.")
-            raise Exception
-        # Make sure book is still available
-        try:
-            c.execute("""
+        with transaction(self.db):
+            # Make sure user still has enough points
+            try:
+                points_available = self.get_current_user_points(user_num)
+            except sqlite3.Error as e:
+                log.error(f"Error trying to confirm user {user_num} has sufficient points. {e}")
+                raise Exception
+            #TODO: Fix 'POINTSNEEDED"
+            if points_available < book['pointsNeeded']:
+                log.warning(f"Requesting user does not have sufficient points for the trade.")
+                raise Exception
+            # Make sure book is still available
+            try:
+                c.execute("""
+                        SELECT
+                            available
+                        FROM
+                            UserBooks
+                        WHERE
+                            id = ?
+                        """,
+                          (book['userBooksId'],))
+                availability = c.fetchone()[0]
+                if availability != 1:
+                    log.warning(f"Book with UserBooks id {book['userBooksId']} is not available.")
+                    raise Exception
+            except sqlite3.Error as e:
+                log.error(
+                    f"Failed to see if book with UserBooks id {book['userBooksId']} is available or not -- {e}")
+                raise Exception
+            # Insert trade
+            try:
+                c.execute("""
+                    INSERT INTO Trades
+                        (userRequestedId, userBookId, statusId)
+                    VALUES
+                        (?, ?, ?)
+                    """,
+                          (user_num, book['userBooksId'], 2))
+            except sqlite3.Error as e:
+                log.error(f"{e}")
+                raise Exception
+            # Update Requesting User's points
+            try:
+                c.execute("""
+                    UPDATE
+                        Users
+                    SET
+                        points = points - ?
+                    WHERE
+                        id = ?
+                    """,
+                          (book['pointsNeeded'], user_num))
+            except sqlite3.Error as e:
+                log.error(f"{e}")
+                raise Exception
+            # Update availability of UserBook entry
+            try:
+                c.execute("""
+                    UPDATE
+                        UserBooks
+                    SET
+                        available = 0
+                    WHERE
+                        id = ?
+                    """,
+                          (book['userBooksId'],))
+            except sqlite3.Error as e:
+                log.error(f"{e}")
+                raise Exception
+            # Get current user's current point value
+            try:
+                c.execute("""
                     SELECT
-                        available
+                        points
                     FROM
-                        UserBooks
+                        Users
                     WHERE
                         id = ?
                     """,
-                      (book['userBooksId'],))
-            availability = c.fetchone()[0]
-            if availability != 1:
-                log.warning(f"Book with UserBooks id {book['userBooksId']} is not available.")
+                          (user_num,))
+                row = c.fetchone()
+                points_available = row[0]
+            except sqlite3.Error as e:
+                log.error(f"{e}")
                 raise Exception
-        except sqlite3.Error as e:
-            log.error(
-                f"Failed to see if book with UserBooks id {book['userBooksId']} is available or not -- {e}")
-            raise Exception
-        # Insert trade
-        try:
-            c.execute("""
-                INSERT INTO Trades
-                    (userRequestedId, userBookId, statusId)
-                VALUES
-                    (?, ?, ?)
-                """,
-                      (user_num, book['userBooksId'], 2))
-            self.db.commit()
-        except sqlite3.Error as e:
-            log.error(f"{e}")
-            raise Exception
-        # Update Requesting User's points
-        try:
-            c.execute("""
-                UPDATE
-                    Users
-                SET
-                    points = points - ?
-                WHERE
-                    id = ?
-                """,
-                      (book['pointsNeeded'], user_num))
-            self.db.commit()
-        except sqlite3.Error as e:
-            log.error(f"{e}")
-            raise Exception
-        # Update availability of UserBook entry
-        try:
-            c.execute("""
-                UPDATE
-                    UserBooks
-                SET
-                    available = 0
-                WHERE
-                    id = ?
-                """,
-                      (book['userBooksId'],))
-            self.db.commit()
-        except sqlite3.Error as e:
-            log.error(f"{e}")
-            raise Exception
-        # Get current user's current point value
-        try:
-            c.execute("""
-                SELECT
-                    points
-                FROM
-                    Users
-                WHERE
-                    id = ?
-                """,
-                      (user_num,))
-            row = c.fetchone()
-            points_available = row[0]
-        except sqlite3.Error as e:
-            log.error(f"{e}")
-            raise Exception
         return points_available
 
     def reject_trade(self, user_books_id):
@@ -1438,80 +2008,77 @@ class BookSwapDatabase:
             Listing user has book removed from their pending trades list
             Requesting user has their points restored
             Book marked as available once more
+        All three changes are made in a single transaction.
         Accepts:
             user_books_id (int):  UserBooksId number of requested book
         Returns:
             None
         """
         c = self.db.cursor()
-        # Change Trade state
-        try:
-            c.execute("""
-                    UPDATE
-                        Trades
-                    SET
-                        statusId = 4
-                    WHERE
-                        userBookId = ?
+        with transaction(self.db):
+            # Change Trade state
+            try:
+                c.execute("""
+                        UPDATE
+                            Trades
+                        SET
+                            statusId = 4
+                        WHERE
+                            userBookId = ?
+                            """,
+                          (user_books_id,))
+            except sqlite3.Error as e:
+                log.error(
+                    f"Error {e}.  Failed to change the trade status for UserBooks book number {user_books_id}")
+                flash("Error marking trade as rejected", "warning")
+                raise Exception
+            # Return points to requesting User
+            try:
+                c.execute("""
+                        UPDATE
+                            Users
+                        SET
+                            points = points + (
+                                SELECT 
+                                    points
+                                FROM 
+                                    UserBooks 
+                                WHERE
+                                    id = ?
+                                    )
+                        WHERE
+                            id =  (
+                                SELECT
+                                    userRequestedId
+                                FROM
+                                    Trades
+                                WHERE
+                                    userBookId = ?
+                                    )
                         """,
-                      (user_books_id,))
-            self.db.commit()
-            log.info(f"trade for book {user_books_id} changed to 'rejected by user'")
-        except sqlite3.Error as e:
-            log.error(
-                f"Error {e}.  Failed to change the trade status for UserBooks book number {user_books_id}")
-            flash("Error marking trade as rejected", "warning")
-            raise Exception
-        # Return points to requesting User
-        try:
-            c.execute("""
-                    UPDATE
-                        Users
-                    SET
-                        points = points + (
-                            SELECT 
-                                points
-                            FROM 
-                                UserBooks 
-                            WHERE
-                                id = ?
-                                )
-                    WHERE
-                        id =  (
-                            SELECT
-                                userRequestedId
-                            FROM
-                                Trades
-                            WHERE
-                                userBookId = ?
-                                )
-                    """,
-                      (user_books_id, user_books_id))
-            self.db.commit()
-            log.info(f"User received their points back")
-        except sqlite3.Error as e:
-            log.error(
-                f"Error {e}.  Failed to return points to the requesting user for book number {user_books_id}")
-            flash("Error returning points to requesting user", "warning")
-            raise Exception
-        # Set book as available
-        try:
-            c.execute("""
-                    UPDATE
-                        UserBooks
-                    SET
-                        available = 1
-                    WHERE
-                        id = ?
-                    """,
-                      (user_books_id,))
-            self.db.commit()
-            log.info(f" Book {user_books_id} set as avialable again")
-        except sqlite3.Error as e:
-            log.error(
-                f"Error {e}.  Failed to set the book number {user_books_id} as available.")
-            flash("Error marking the book as available", "warning")
-            raise Exception
+                          (user_books_id, user_books_id))
+            except sqlite3.Error as e:
+                log.error(
+                    f"Error {e}.  Failed to return points to the requesting user for book number {user_books_id}")
+                flash("Error returning points to requesting user", "warning")
+                raise Exception
+            # Set book as available
+            try:
+                c.execute("""
+                        UPDATE
+                            UserBooks
+                        SET
+                            available = 1
+                        WHERE
+                            id = ?
+                        """,
+                          (user_books_id,))
+            except sqlite3.Error as e:
+                log.error(
+                    f"Error {e}.  Failed to set the book number {user_books_id} as available.")
+                flash("Error marking the book as available", "warning")
+                raise Exception
+        log.info(f"trade for book {user_books_id} changed to 'rejected by user', points returned and book available again")
         return
 
     def get_login_user(self, username):
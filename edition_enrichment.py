@@ -0,0 +1,219 @@
+"""
+Background lookup of Open Library editions for newly stored works.
+
+With BOOKSWAP_DEFER_EDITION_LOOKUPS=1 (db_connector.DEFER_EDITION_LOOKUPS), a
+search stores each new work straight away from the search data (title,
+author, OLWorkKey), and queues the hunt for a suitable edition (ISBN and
+cover) in the EditionLookups table.  A daemon thread in each worker process drains the queue, asking /api/books about
+the edition keys of many pending works in one call, and fills in the Books
+row when it finds an edition.  A job is leased (its nextAttempt pushed ahead)
+while a worker holds it, so several processes can drain the same queue, and
+failed calls are retried with backoff.
+
+Drain the queue once from the command line (e.g. from cron) with:
+    python edition_enrichment.py [path/to/database.db]
+"""
+import os
+import sys
+import threading
+import time
+import logging
+
+import db_connector as dbc
+import openlibrary
+
+log = logging.getLogger('app.sub')
+
+MAX_JOBS = 200  # jobs considered per round
+LEASE = 60  # seconds a job is held by the worker that claimed it
+RETRY_DELAY = 30  # seconds before the first retry after a failed call, doubling each time
+MAX_ATTEMPTS = 5  # failed calls before a job is dropped, leaving the book without an edition
+POLL_INTERVAL = 30  # seconds the idle worker sleeps unless woken by a new job
+
+_wake = threading.Event()
+_worker = None
+_worker_pid = None
+_worker_lock = threading.Lock()
+_counters = {"queued": 0, "found": 0, "not_found": 0, "calls": 0, "failures": 0, "dropped": 0}
+_counters_lock = threading.Lock()
+
+
+def _count(name, n=1):
+    with _counters_lock:
+        _counters[name] += n
+
+
+def enqueue(db, book_id, edition_keys):
+    """
+    Queues the edition lookup for a Books row.  Runs on the caller's
+        connection, so it commits with the caller's insert; call notify()
+        once committed.
+    Accepts:
+        db (sqlite3.Connection): connection the Books row was inserted on
+        book_id (int): id of the Books row
+        edition_keys (list of strings): the work's edition keys, in
+            Open Library's order
+    """
+    now = time.time()
+    db.execute("""INSERT OR REPLACE INTO EditionLookups (bookId, editionKeys, nextAttempt, dateQueued)
+                  VALUES (?, ?, ?, ?)""",
+               (book_id, ",".join(edition_keys), now, now))
+    _count("queued")
+
+
+def notify():
+    """
+    Wakes this process's worker, starting it if need be.
+    """
+    start_worker()
+    _wake.set()
+
+
+def _claim(db, now):
+    """
+    Takes the due jobs, oldest first, whose next edition keys fit into one
+        /api/books call, and leases them.
+    Returns:
+        List of (bookId, editionKeys (list), checked, attempts, keys to ask
+            about now (list)) tuples
+    """
+    claimed = []
+    room = openlibrary.BIBKEY_BATCH
+    with dbc.transaction(db):
+        rows = db.execute("""SELECT bookId, editionKeys, checked, attempts FROM EditionLookups
+                             WHERE nextAttempt <= ? ORDER BY nextAttempt LIMIT ?""",
+                          (now, MAX_JOBS)).fetchall()
+        for book_id, edition_keys, checked, attempts in rows:
+            if room == 0:
+                break
+            edition_keys = edition_keys.split(",")
+            batch = edition_keys[checked:checked + room]
+            room -= len(batch)
+            claimed.append((book_id, edition_keys, checked, attempts, batch))
+        db.executemany("UPDATE EditionLookups SET nextAttempt = ? WHERE bookId = ?",
+                       [(now + LEASE, job[0]) for job in claimed])
+    return claimed
+
+
+def _edition_taken(db, edition_key):
+    row = db.execute("SELECT 1 FROM Books WHERE OLEditionKey = ?", (edition_key,)).fetchone()
+    return row is not None
+
+
+def drain_once(db):
+    """
+    Runs one round: claims a batch of jobs, makes one /api/books call for
+        all of them, and records what it found.
+    Accepts:
+        db (sqlite3.Connection): connection to the BookSwap database
+    Returns:
+        Number of jobs handled (int); 0 once nothing is due
+    """
+    now = time.time()
+    jobs = _claim(db, now)
+    if len(jobs) == 0:
+        return 0
+    bibkeys = [key for job in jobs for key in job[4]]
+    try:
+        payload = {'format': 'json', 'jscmd': 'details', 'bibkeys': ",".join(bibkeys)}
+        data = openlibrary.get_json('/api/books', payload)
+        _count("calls")
+    except openlibrary.OpenLibraryError:
+        _count("failures")
+        with dbc.transaction(db):
+            for book_id, _, _, attempts, _ in jobs:
+                if attempts + 1 >= MAX_ATTEMPTS:
+                    db.execute("DELETE FROM EditionLookups WHERE bookId = ?", (book_id,))
+                    _count("dropped")
+                else:
+                    db.execute("UPDATE EditionLookups SET attempts = ?, nextAttempt = ? WHERE bookId = ?",
+                               (attempts + 1, now + RETRY_DELAY * 2 ** attempts, book_id))
+        log.warning(f"Edition lookup for {len(jobs)} books failed, will retry")
+        return len(jobs)
+    with dbc.transaction(db):
+        for book_id, edition_keys, checked, _, batch in jobs:
+            for edition_key in batch:
+                isbn = openlibrary.isbn_from_details(data.get(edition_key, {}).get('details'))
+                if isbn is not None and not _edition_taken(db, edition_key):
+                    db.execute("""UPDATE Books SET OLEditionKey = ?, ISBN = ?, coverImageUrl = ?
+                                  WHERE id = ?""",
+                               (edition_key, isbn, openlibrary.cover_url(edition_key), book_id))
+                    db.execute("DELETE FROM EditionLookups WHERE bookId = ?", (book_id,))
+                    _count("found")
+                    break
+            else:
+                checked += len(batch)
+                if checked >= len(edition_keys):
+                    # No suitable edition: the book keeps its work-level details
+                    db.execute("DELETE FROM EditionLookups WHERE bookId = ?", (book_id,))
+                    _count("not_found")
+                else:
+                    db.execute("UPDATE EditionLookups SET checked = ?, nextAttempt = ? WHERE bookId = ?",
+                               (checked, now, book_id))
+    log.info(f"Looked up {len(bibkeys)} editions for {len(jobs)} books in one call")
+    return len(jobs)
+
+
+def drain(database=None):
+    """
+    Works through every job that is due.
+    Accepts:
+        database (string): database file, defaults to db_connector.DATABASE
+    Returns:
+        Number of jobs handled (int)
+    """
+    pool = dbc.get_pool(database)
+    db = pool.acquire()
+    try:
+        handled = 0
+        while True:
+            n = drain_once(db)
+            if n == 0:
+                return handled
+            handled += n
+    finally:
+        pool.release(db)
+
+
+def _run(database):
+    while True:
+        _wake.wait(POLL_INTERVAL)
+        _wake.clear()
+        try:
+            drain(database)
+        except Exception:
+            log.exception("Edition lookup worker failed, will try again")
+
+
+def start_worker(database=None):
+    """
+    Starts this process's worker thread, if it isn't running already.
+    """
+    global _worker, _worker_pid
+    with _worker_lock:
+        if _worker is None or _worker_pid != os.getpid() or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, args=(database,), name='edition-enrichment', daemon=True)
+            _worker.start()
+            _worker_pid = os.getpid()
+            _wake.set()  # pick up anything left from before
+
+
+def stats():
+    """
+    Returns this worker's counters, plus the number of jobs waiting.
+    """
+    with _counters_lock:
+        out = dict(_counters)
+    pool = dbc.get_pool()
+    db = pool.acquire()
+    try:
+        out["pending"] = db.execute("SELECT COUNT(*) FROM EditionLookups").fetchone()[0]
+    finally:
+        pool.release(db)
+    return out
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    database = sys.argv[1] if len(sys.argv) > 1 else dbc.DATABASE
+    print(f"{database}: handled {drain(database)} edition lookup job(s)")
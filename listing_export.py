@@ -0,0 +1,211 @@
+"""
+Bulk export of the listings available to trade, for partners syncing our
+inventory (/api/listings/export).
+
+The export is produced by generators straight off one SQL cursor, a batch of
+rows at a time, so the server's memory use doesn't grow with the catalogue.
+Every row carries the `version` of the listing's latest change (see
+DatabaseSpecs/migrations/0009_listing_changes.sql) and the response's
+X-Export-Version header is the newest version it covers:
+    GET /api/listings/export                  every available listing
+    GET /api/listings/export?since=<version>  only listings changed since;
+                                              ones taken off offer or deleted
+                                              come as {"removed": true} rows
+Rows come in version order, as NDJSON (default) or CSV (format=csv), and are
+gzipped while streaming when the client accepts it.
+
+Export to a file from the command line with:
+    python listing_export.py [ndjson|csv] [since] > listings.ndjson
+"""
+import csv
+import io
+import json
+import sys
+import zlib
+import logging
+
+import db_connector as dbc
+import metrics
+
+log = logging.getLogger('app.sub')
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+FIELDS = ("version", "userBooksId", "removed", "bookId", "title", "author", "ISBN", "coverImageUrl",
+          "copyQuality", "points", "listingUser", "dateCreated")
+BATCH = 1000  # rows fetched, and written as one chunk, at a time
+GZIP_LEVEL = 6
+
+
+def current_version(db):
+    """
+    Returns the version of the latest listing change (int), 0 if none.
+    """
+    return db.execute("SELECT coalesce(max(version), 0) FROM ListingChanges").fetchone()[0]
+
+
+def listing_rows(db, since=None, until=None):
+    """
+    Yields the listings changed after `since` and up to `until`, in version
+        order, as tuples of FIELDS.  Without `since`, yields only the
+        available ones; with it, a listing that is no longer available is a
+        "removed" row carrying just its version and id.
+    Accepts:
+        db (sqlite3.Connection): connection to the BookSwap database
+        since (int): version the client last saw, or None for everything
+        until (int): last version to include, see current_version
+    """
+    available = "" if since is not None else "AND UserBooks.available = 1"
+    c = db.cursor()
+    c.row_factory = None  # plain tuples
+    c.execute(f"""
+                SELECT
+                    ListingChanges.version,
+                    ListingChanges.userBookId,
+                    coalesce(UserBooks.available, 0) = 0 AS removed,
+                    Books.id,
+                    Books.title,
+                    Books.author,
+                    Books.ISBN,
+                    Books.coverImageUrl,
+                    CopyQualities.qualityDescription,
+                    UserBooks.points,
+                    Users.username,
+                    UserBooks.dateCreated
+                FROM
+                    ListingChanges
+                        LEFT JOIN
+                    UserBooks ON UserBooks.id = ListingChanges.userBookId
+                        LEFT JOIN
+                    Books ON Books.id = UserBooks.bookId
+                        LEFT JOIN
+                    CopyQualities ON CopyQualities.id = UserBooks.copyQualityId
+                        LEFT JOIN
+                    Users ON Users.id = UserBooks.userId
+                WHERE
+                    ListingChanges.version > ? AND
+                    ListingChanges.version <= ?
+                    {available}
+                ORDER BY
+                    ListingChanges.version
+                """,
+              (since or 0, until if until is not None else current_version(db)))
+    try:
+        while True:
+            rows = c.fetchmany(BATCH)
+            if not rows:
+                return
+            yield from rows
+    finally:
+        c.close()
+
+
+def _batches(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ndjson_chunks(rows):
+    """
+    Yields the rows as NDJSON, one string per batch of rows.
+    """
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+    for batch in _batches(rows):
+        yield "".join(dumps(_row_dict(row)) + "\n" for row in batch)
+
+
+def _row_dict(row):
+    if row[2]:
+        return {"version": row[0], "userBooksId": row[1], "removed": True}
+    out = dict(zip(FIELDS, row))
+    out["removed"] = False
+    return out
+
+
+def csv_chunks(rows):
+    """
+    Yields the rows as CSV with a header line, one string per batch of rows.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    for batch in _batches(rows):
+        writer.writerows(row if not row[2] else row[:3] for row in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def gzip_chunks(chunks, level=GZIP_LEVEL):
+    """
+    Gzips a stream of strings as it goes, flushing after each one so the
+        client gets every batch as soon as it is ready.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip header and trailer
+    for chunk in chunks:
+        yield compressor.compress(chunk.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def export(fmt="ndjson", since=None, compress=False, database=None):
+    """
+    Starts an export: reads the newest version now, then returns it with a
+        generator of the response body.  The generator borrows a pooled
+        connection once it is started, and gives it back when it is finished
+        or closed; one that is never started (e.g. for a HEAD request)
+        holds nothing.
+    Accepts:
+        fmt (string): a key of FORMATS
+        since (int): version the client last saw, or None for everything
+        compress (bool): gzip the body
+        database (string): database file, defaults to db_connector.DATABASE
+    Returns:
+        Tuple of (version (int), generator of bytes)
+    """
+    pool = dbc.get_pool(database)
+    db = pool.acquire()
+    try:
+        until = current_version(db)
+    finally:
+        pool.release(db)
+
+    def body():
+        exported = 0
+
+        def counted(rows):
+            nonlocal exported
+            for row in rows:
+                exported += 1
+                yield row
+
+        db = pool.acquire()
+        try:
+            chunks = (ndjson_chunks if fmt == "ndjson" else csv_chunks)(counted(listing_rows(db, since, until)))
+            if compress:
+                yield from gzip_chunks(chunks)
+            else:
+                for chunk in chunks:
+                    yield chunk.encode()
+        finally:
+            pool.release(db)
+            metrics.inc("bookswap_export_rows_total", exported, format=fmt)
+            log.info("Exported %d listings as %s, versions %s to %d", exported, fmt, since or 0, until)
+
+    return until, body()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    fmt = sys.argv[1] if len(sys.argv) > 1 else "ndjson"
+    since = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    version, body = export(fmt, since)
+    for data in body:
+        sys.stdout.buffer.write(data)
+    log.info("Export version %d; pass it as `since` next time", version)
@@ -0,0 +1,131 @@
+"""
+Logging set-up for the web app.
+
+Request threads never write log output themselves: the 'app' logger (Flask's
+app.logger, as app.py names the app LOGGER however it is started, and
+'app.sub' used by the other modules) has a QueueHandler that
+puts each record on an in-memory queue, and a QueueListener thread formats
+and writes them.  Messages use %-style arguments, e.g.
+    log.debug("Found %d copies: %s", len(rows), rows)
+so nothing is turned into a string unless the logger's level lets the record
+through, and then only on the listener thread.  Arguments are formatted
+after the call returns, so don't change them afterwards.
+
+Levels are set per logger with BOOKSWAP_LOG_LEVELS, e.g.
+    BOOKSWAP_LOG_LEVELS="app=INFO,app.sub=DEBUG"
+('app' defaults to WARNING).  High-volume debug lines are sampled: of the
+DEBUG records logged from the same place, only the first and then every
+BOOKSWAP_LOG_SAMPLE_EVERY-th (default 10) is written; 1 writes them all.
+"""
+import atexit
+import itertools
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+LOGGER = 'app'
+DEFAULT_LEVELS = {LOGGER: 'WARNING'}
+SAMPLE_EVERY = int(os.environ.get('BOOKSWAP_LOG_SAMPLE_EVERY', '10'))
+FORMAT = '[%(asctime)s] %(levelname)s in %(module)s: %(message)s'
+
+_listener = None
+_handler = None
+
+
+def parse_levels(spec):
+    """
+    Parses "name=LEVEL,name=LEVEL" into {name: LEVEL}.
+    """
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, level = item.partition('=')
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Passes every record at INFO and above, but only the first and then every
+    `every`-th DEBUG record logged from each place (logger and message
+    template).
+    """
+
+    def __init__(self, every=SAMPLE_EVERY):
+        super().__init__()
+        self.every = every
+        self._seen = {}  # (logger, msg) -> itertools.count
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.every <= 1:
+            return True
+        key = (record.name, record.msg)
+        with self._lock:
+            seen = self._seen.get(key)
+            if seen is None:
+                seen = self._seen[key] = itertools.count()
+            return next(seen) % self.every == 0
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread.  (The
+    standard one formats each message on the logging thread, so the queue
+    can cross processes.)
+    """
+
+    def prepare(self, record):
+        if record.exc_info and not record.exc_text:
+            # Tracebacks are rendered now, while the frames are as they were
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        return record
+
+
+def configure(levels=None, stream=None, sample_every=None):
+    """
+    Routes the 'app' loggers through a queue to a listener thread writing to
+        `stream` (default stderr), and sets their levels.  Calling it again
+        replaces the previous set-up.
+    Accepts:
+        levels (dict): logger name to level name, added to DEFAULT_LEVELS;
+            default from BOOKSWAP_LOG_LEVELS
+        stream (file): where log lines are written
+        sample_every (int): keep 1 in this many DEBUG records from each place
+    Returns:
+        The QueueListener
+    """
+    global _listener, _handler
+    shutdown()
+    if levels is None:
+        levels = parse_levels(os.environ.get('BOOKSWAP_LOG_LEVELS', ''))
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(logging.Formatter(FORMAT))
+    records = queue.SimpleQueue()
+    _handler = DeferredQueueHandler(records)
+    _handler.addFilter(SamplingFilter(SAMPLE_EVERY if sample_every is None else sample_every))
+    logger = logging.getLogger(LOGGER)
+    logger.addHandler(_handler)
+    for name, level in dict(DEFAULT_LEVELS, **levels).items():
+        logging.getLogger(name).setLevel(level)
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+    return _listener
+
+
+def shutdown():
+    """
+    Writes out any queued records and stops the listener thread.
+    """
+    global _listener, _handler
+    if _handler is not None:
+        logging.getLogger(LOGGER).removeHandler(_handler)
+        _handler = None
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown)
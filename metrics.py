@@ -0,0 +1,332 @@
+"""
+Application metrics in the Prometheus text format.
+
+Counters and histograms are kept in memory per worker process, so recording
+one is a dict update under a lock.  Every FLUSH_INTERVAL seconds a background
+thread in each worker writes a snapshot of its totals to a small shared
+Sqlite database, one row per process, so no request waits on it; /metrics adds up the snapshots of every worker, so it
+reports the whole server whichever worker answers.  Rows are keyed by pid and
+a random token, so a new worker given a dead worker's pid doesn't overwrite
+its totals; the totals of workers that have exited are folded into one
+'exited' row.  So counters never go backwards.
+
+Metrics recorded:
+    bookswap_http_requests_total, bookswap_http_request_duration_seconds
+        per endpoint, method and status (app.py)
+    bookswap_db_request_seconds, bookswap_db_statements_total
+        DB time and statements per request, per endpoint (app.py, from sql_trace)
+    bookswap_openlibrary_call_duration_seconds, bookswap_openlibrary_calls_total
+        per Open Library endpoint and outcome (openlibrary.py)
+    bookswap_cache_lookups_total
+        per cache and hit/miss (openlibrary_cache.py, query_cache.py), and
+        bookswap_cache_hit_ratio worked out from them
+    bookswap_export_rows_total
+        listings sent by the listing export, per format (listing_export.py)
+"""
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+
+log = logging.getLogger('app.sub')
+
+METRICS_DATABASE = 'DatabaseSpecs/metrics.db'
+FLUSH_INTERVAL = 5  # seconds between a worker's snapshots
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds
+
+METRICS = {
+    "bookswap_http_requests_total": ("counter", "HTTP requests handled"),
+    "bookswap_http_request_duration_seconds": ("histogram", "Time to handle an HTTP request"),
+    "bookswap_db_request_seconds": ("histogram", "Database time per HTTP request"),
+    "bookswap_db_statements_total": ("counter", "SQL statements run while handling HTTP requests"),
+    "bookswap_openlibrary_call_duration_seconds": ("histogram", "Time taken by Open Library API calls"),
+    "bookswap_openlibrary_calls_total": ("counter", "Open Library API calls, by outcome"),
+    "bookswap_cache_lookups_total": ("counter", "Cache lookups, by cache and result"),
+    "bookswap_cache_hit_ratio": ("gauge", "Fraction of cache lookups that were hits, by cache"),
+    "bookswap_export_rows_total": ("counter", "Listings sent by the listing export, by format"),
+}
+
+_lock = threading.Lock()
+_counters = {}  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+_wake = threading.Event()
+_flusher = None
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+_process = None  # this process's ProcessMetrics key
+EXITED = 'exited'  # ProcessMetrics key of the totals of exited workers
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    """
+    Adds `amount` to a counter.
+    """
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name, value, **labels):
+    """
+    Records one observation (in seconds) in a histogram.
+    """
+    key = (name, _labels(labels))
+    with _lock:
+        entry = _histograms.get(key)
+        if entry is None:
+            entry = _histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                entry[i] += 1
+                break
+        else:
+            entry[len(BUCKETS)] += 1
+        entry[-1] += value
+
+
+def _forked():
+    """
+    Starts a forked worker with no metrics of its own: what it inherited is
+        its parent's, and already in the parent's snapshot.  The locks are
+        made afresh, as another thread of the parent may have held them.
+    """
+    global _lock, _flusher_lock, _wake, _process
+    _lock = threading.Lock()
+    _flusher_lock = threading.Lock()
+    _wake = threading.Event()
+    _counters.clear()
+    _histograms.clear()
+    _process = None
+
+
+os.register_at_fork(after_in_child=_forked)
+
+
+def process_key():
+    """
+    Returns this process's ProcessMetrics key: its pid and a random token.
+    """
+    global _process
+    if _process is None:
+        _process = f"{os.getpid()}-{uuid.uuid4().hex}"
+    return _process
+
+
+def snapshot():
+    """
+    Returns this process's totals as a JSON-serialisable dict.
+    """
+    with _lock:
+        return {"counters": [[name, list(labels), value] for (name, labels), value in _counters.items()],
+                "histograms": [[name, list(labels), list(entry)] for (name, labels), entry in _histograms.items()]}
+
+
+def _add(counters, histograms, data):
+    """
+    Adds a snapshot's totals into the counters and histograms dicts.
+    """
+    for name, labels, value in data["counters"]:
+        key = (name, tuple(tuple(label) for label in labels))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, entry in data["histograms"]:
+        key = (name, tuple(tuple(label) for label in labels))
+        total = histograms.setdefault(key, [0] * len(entry))
+        for i, value in enumerate(entry):
+            total[i] += value
+
+
+def _connect():
+    conn = sqlite3.connect(METRICS_DATABASE, timeout=1)
+    conn.execute("PRAGMA journal_mode = WAL")
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(ProcessMetrics)")]
+    if "process" not in columns:
+        with conn:
+            if columns:  # snapshots used to be keyed by the bare pid
+                conn.execute("ALTER TABLE ProcessMetrics RENAME TO ProcessMetricsByPid")
+            conn.execute("""CREATE TABLE ProcessMetrics
+                            (
+                                process  TEXT    NOT NULL PRIMARY KEY,
+                                pid      INTEGER,
+                                snapshot TEXT    NOT NULL,
+                                updated  REAL    NOT NULL
+                            )""")
+            if columns:
+                conn.execute("""INSERT INTO ProcessMetrics (process, pid, snapshot, updated)
+                                SELECT pid || '-old', pid, snapshot, updated FROM ProcessMetricsByPid""")
+                conn.execute("DROP TABLE ProcessMetricsByPid")
+    return conn
+
+
+def _running(pid, process):
+    """
+    Tells whether the worker that wrote a snapshot may still be running.
+    """
+    if not pid or pid < 0:
+        return False
+    if pid == os.getpid():
+        return process == process_key()
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # e.g. someone else's process
+    return True
+
+
+def _fold_exited(conn):
+    """
+    Adds the snapshots of workers that have exited into the EXITED row, and
+        deletes them.  Run inside a transaction.
+    """
+    exited = [(process, snapshot) for process, pid, snapshot in conn.execute(
+        "SELECT process, pid, snapshot FROM ProcessMetrics WHERE process != ?", (EXITED,))
+        if not _running(pid, process)]
+    if not exited:
+        return
+    counters, histograms = {}, {}
+    row = conn.execute("SELECT snapshot FROM ProcessMetrics WHERE process = ?", (EXITED,)).fetchone()
+    for data in ([row[0]] if row else []) + [snapshot for _, snapshot in exited]:
+        _add(counters, histograms, json.loads(data))
+    total = {"counters": [[name, list(labels), value] for (name, labels), value in counters.items()],
+             "histograms": [[name, list(labels), entry] for (name, labels), entry in histograms.items()]}
+    conn.execute("INSERT OR REPLACE INTO ProcessMetrics (process, pid, snapshot, updated) VALUES (?, NULL, ?, ?)",
+                 (EXITED, json.dumps(total), time.time()))
+    conn.executemany("DELETE FROM ProcessMetrics WHERE process = ?", [(process,) for process, _ in exited])
+
+
+def flush():
+    """
+    Writes this process's snapshot to the shared metrics database, folding
+        in the snapshots of workers that have exited.
+    """
+    try:
+        conn = _connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            _fold_exited(conn)
+            conn.execute("INSERT OR REPLACE INTO ProcessMetrics (process, pid, snapshot, updated) VALUES (?, ?, ?, ?)",
+                         (process_key(), os.getpid(), json.dumps(snapshot()), time.time()))
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        log.error(f"Writing metrics snapshot -- {e}")
+
+
+def _run():
+    while True:
+        _wake.wait(FLUSH_INTERVAL)
+        _wake.clear()
+        try:
+            flush()
+        except Exception:
+            log.exception("Metrics flush failed, will try again")
+
+
+def start_flusher():
+    """
+    Starts this process's flushing thread, if it isn't running already.
+        Cheap enough to call after every request.
+    """
+    global _flusher, _flusher_pid
+    if _flusher_pid == os.getpid() and _flusher.is_alive():
+        return
+    with _flusher_lock:
+        if _flusher is None or _flusher_pid != os.getpid() or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_run, name='metrics-flush', daemon=True)
+            _flusher.start()
+            _flusher_pid = os.getpid()
+
+
+atexit.register(flush)
+
+
+def collect():
+    """
+    Adds up the latest snapshot of every worker process.
+    Returns:
+        (counters, histograms) dicts keyed by (name, labels)
+    """
+    flush()
+    counters, histograms = {}, {}
+    try:
+        conn = _connect()
+        try:
+            rows = conn.execute("SELECT snapshot FROM ProcessMetrics").fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        log.error(f"Reading metrics snapshots -- {e}")
+        rows = [(json.dumps(snapshot()),)]
+    for row in rows:
+        _add(counters, histograms, json.loads(row[0]))
+    return counters, histograms
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def render():
+    """
+    Returns the metrics of every worker in the Prometheus text format.
+    """
+    counters, histograms = collect()
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        if name == "bookswap_cache_hit_ratio":
+            lookups = {}
+            for (metric, labels), value in counters.items():
+                if metric == "bookswap_cache_lookups_total":
+                    labels = dict(labels)
+                    entry = lookups.setdefault(labels["cache"], [0, 0])
+                    entry[0] += value if labels["result"] == "hit" else 0
+                    entry[1] += value
+            for cache, (hits, total) in sorted(lookups.items()):
+                lines.append(f"{name}{_format_labels([('cache', cache)])} {hits / total if total else 0.0}")
+        elif kind == "counter":
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+        else:
+            for (metric, labels), entry in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(BUCKETS, entry):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                cumulative += entry[len(BUCKETS)]
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {entry[-1]}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """
+    Forgets this process's metrics (for tests).
+    """
+    global _process
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+    _process = None
@@ -0,0 +1,138 @@
+"""
+Versioned schema migrations for the BookSwap database.
+
+Each file in DatabaseSpecs/migrations is named `NNNN_description.sql` and is
+applied once, in order, inside its own transaction.  The database records the
+last version applied in `PRAGMA user_version`, so upgrading an existing
+database is done in place and keeps its data.  An empty database is first
+built from DatabaseSpecs/database-definition-queries.sql (version 0).
+
+Upgrade a database file from the command line with:
+    python migrations.py [path/to/database.db]
+"""
+import os
+import re
+import sqlite3
+import sys
+import logging
+
+import sql_trace
+
+log = logging.getLogger('app.sub')
+
+SPECS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'DatabaseSpecs')
+BASE_SCHEMA = os.path.join(SPECS_DIR, 'database-definition-queries.sql')
+MIGRATIONS_DIR = os.path.join(SPECS_DIR, 'migrations')
+
+_MIGRATION_NAME = re.compile(r"^(\d{4})_(\w+)\.sql$")
+
+
+def available_migrations():
+    """
+    Lists the migration files shipped with the app.
+    Returns:
+        List of (version (int), name (string), path (string)) tuples, oldest
+            first
+    """
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = _MIGRATION_NAME.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2),
+                               os.path.join(MIGRATIONS_DIR, filename)))
+    return sorted(migrations)
+
+
+def current_version(db):
+    """
+    Returns the schema version recorded in the database (int).
+    """
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _statements(script):
+    """
+    Splits a SQL script into complete statements, keeping trigger bodies
+        whole.
+    """
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement.strip()
+            statement = ""
+    if statement.strip() and not statement.strip().startswith(("--", "/*")):
+        raise sqlite3.ProgrammingError(f"Incomplete SQL statement in migration: {statement.strip()[:60]}")
+
+
+def _has_base_schema(db):
+    row = db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Books'").fetchone()
+    return row is not None
+
+
+@sql_trace.untraced()
+def upgrade(db, target=None):
+    """
+    Applies every migration newer than the database's version, each in its
+        own BEGIN IMMEDIATE transaction.  Safe to run from several workers at
+        once: the version is re-checked after the write lock is taken.
+    Accepts:
+        db (sqlite3.Connection): open connection to the database
+        target (int): highest version to apply, defaults to the newest
+    Returns:
+        List of versions applied (ints)
+    """
+    db.commit()
+    if not _has_base_schema(db):
+        log.info("Empty database, creating base schema")
+        with open(BASE_SCHEMA) as f:
+            db.executescript(f.read())
+        db.execute("PRAGMA user_version = 0")
+    applied = []
+    for version, name, path in available_migrations():
+        if target is not None and version > target:
+            break
+        if version <= current_version(db):
+            continue
+        with open(path) as f:
+            script = f.read()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= current_version(db):
+                # Another worker got here first
+                db.rollback()
+                continue
+            for statement in _statements(script):
+                db.execute(statement)
+            db.execute(f"PRAGMA user_version = {version}")
+        except sqlite3.Error as e:
+            db.rollback()
+            log.error(f"Migration {version:04d}_{name} failed, database left at version "
+                      f"{current_version(db)} -- {e}")
+            raise
+        db.commit()
+        log.info(f"Applied migration {version:04d}_{name}")
+        applied.append(version)
+    return applied
+
+
+def upgrade_file(database):
+    """
+    Opens the database file, upgrades it, and closes it again.
+    Returns:
+        List of versions applied (ints)
+    """
+    db = sqlite3.connect(database)
+    try:
+        return upgrade(db)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    from db_connector import DATABASE
+    database = sys.argv[1] if len(sys.argv) > 1 else DATABASE
+    applied = upgrade_file(database)
+    db = sqlite3.connect(database)
+    print(f"{database}: applied {len(applied)} migration(s), now at version {current_version(db)}")
+    db.close()
@@ -20,9 +20,15 @@ class MyRequests:
         self.user_num = user_num
         self.bsdb = bsdb
 
-    def get_all_open_requests(self):
+    def get_all_open_requests(self, after=None):
+        """
+        Returns one page of the user's requests, newest first.
+        Accepts:
+            after (string): next_cursor of the previous page, or None for the
+                first page
+        """
         try:
-            requests = self.bsdb.get_all_open_requests(self.user_num)
+            requests = self.bsdb.get_all_open_requests(self.user_num, after)
         except Exception:
             log.error("Error getting open requests")
         return requests
@@ -0,0 +1,304 @@
+"""
+Client for the Open Library API.
+
+Every call goes through one pooled, keep-alive requests.Session per worker
+process, with connect/read timeouts and bounded retries with backoff, so a
+slow or stuck Open Library response can't hang a worker.  Independent lookups
+can be fanned out on a small, bounded thread pool with submit().  Each call's
+latency is recorded: totals per endpoint are available from stats(), and
+record_calls() collects the calls made while answering a single search.
+Responses are read through the disk cache in openlibrary_cache.
+"""
+import concurrent.futures
+import contextlib
+import contextvars
+import os
+import threading
+import time
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+import openlibrary_cache
+
+log = logging.getLogger('app.sub')
+
+BASE_URL = os.environ.get('OPENLIBRARY_URL', 'https://openlibrary.org')  # e.g. a local stand-in for tests
+CONNECT_TIMEOUT = 3.05  # seconds
+READ_TIMEOUT = 10  # seconds
+MAX_RETRIES = 2
+BACKOFF_FACTOR = 0.3  # sleeps 0.3s, 0.6s, ... between retries
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+POOL_SIZE = 10  # keep-alive connections held open to Open Library
+LOOKUP_WORKERS = 10  # threads for concurrent lookups, per worker process (matches POOL_SIZE)
+BIBKEY_BATCH = 50  # edition keys per /api/books call
+
+# Only the search fields we use: work details, plus the best-matching edition
+# of each work, so most results need no /api/books follow-up
+SEARCH_FIELDS = ('key', 'title', 'author_name', 'edition_key',
+                 'editions', 'editions.key', 'editions.language', 'editions.isbn', 'editions.cover_i')
+
+
+class OpenLibraryError(Exception):
+    """Raised when an Open Library call fails, after any retries"""
+    pass
+
+
+class CallLog:
+    """
+    CallLog collects the Open Library calls made during one piece of work,
+        such as a single search.
+    """
+
+    def __init__(self):
+        self.calls = []  # (endpoint, milliseconds, succeeded) tuples
+
+    def add(self, endpoint, ms, ok):
+        self.calls.append((endpoint, ms, ok))
+
+    @property
+    def count(self):
+        return len(self.calls)
+
+    @property
+    def failures(self):
+        return sum(1 for _, _, ok in self.calls if not ok)
+
+    @property
+    def total_ms(self):
+        return sum(ms for _, ms, _ in self.calls)
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_stats = {}
+_stats_lock = threading.Lock()
+_call_log = contextvars.ContextVar('openlibrary_call_log', default=None)
+
+
+def get_session():
+    """
+    get_session returns this worker's shared Open Library session, creating
+        it on first use.
+    """
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            retry = Retry(total=MAX_RETRIES,
+                          backoff_factor=BACKOFF_FACTOR,
+                          status_forcelist=RETRY_STATUSES,
+                          allowed_methods=frozenset(['GET']),
+                          raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE,
+                                  max_retries=retry)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+            _session_pid = os.getpid()
+        return _session
+
+
+def submit(fn, *args):
+    """
+    submit runs fn(*args) on this worker's lookup thread pool and returns a
+        concurrent.futures.Future.  Calls made by fn are recorded as if they
+        were made by the caller.  Meant for network-only work: keep database
+        access on the request thread.
+    """
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=LOOKUP_WORKERS,
+                                                              thread_name_prefix='openlibrary')
+            _executor_pid = os.getpid()
+        executor = _executor
+    context = contextvars.copy_context()
+    return executor.submit(context.run, fn, *args)
+
+
+@contextlib.contextmanager
+def record_calls():
+    """
+    record_calls yields a CallLog that collects every Open Library call made
+        inside the block (including from work handed to other threads with
+        contextvars.copy_context()).
+    """
+    calls = CallLog()
+    token = _call_log.set(calls)
+    try:
+        yield calls
+    finally:
+        _call_log.reset(token)
+
+
+def _record(endpoint, ms, ok):
+    with _stats_lock:
+        entry = _stats.setdefault(endpoint, {"calls": 0, "failures": 0, "total_ms": 0.0, "max_ms": 0.0})
+        entry["calls"] += 1
+        entry["total_ms"] += ms
+        entry["max_ms"] = max(entry["max_ms"], ms)
+        if not ok:
+            entry["failures"] += 1
+    metrics.observe("bookswap_openlibrary_call_duration_seconds", ms / 1000, endpoint=endpoint)
+    metrics.inc("bookswap_openlibrary_calls_total", endpoint=endpoint, outcome="ok" if ok else "error")
+    calls = _call_log.get()
+    if calls is not None:
+        calls.add(endpoint, ms, ok)
+
+
+def get_json(endpoint, params=None):
+    """
+    Makes a GET request to an Open Library endpoint and returns the decoded
+        JSON body.  Answers from the response cache when it can, and caches
+        successful responses.
+    Accepts:
+        endpoint (string): path under BASE_URL, e.g. '/search.json'
+        params (dict): query parameters; None values are left out
+    Returns:
+        Decoded JSON (dict)
+    Raises:
+        OpenLibraryError if the call fails after retries, times out, or
+            doesn't return JSON
+    """
+    cache_key = openlibrary_cache.make_key(endpoint, params)
+    cached = openlibrary_cache.get(endpoint, cache_key)
+    if cached is not None:
+        return cached
+    start = time.perf_counter()
+    try:
+        r = get_session().get(BASE_URL + endpoint, params=params,
+                              timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        r.raise_for_status()
+        data = r.json()
+    except (requests.RequestException, ValueError) as e:
+        ms = (time.perf_counter() - start) * 1000
+        _record(endpoint, ms, False)
+        log.error(f"Open Library call to {endpoint} failed after {ms:.0f} ms -- {e}")
+        raise OpenLibraryError(e) from e
+    ms = (time.perf_counter() - start) * 1000
+    _record(endpoint, ms, True)
+    log.debug("Open Library call to %s took %.0f ms", endpoint, ms)
+    openlibrary_cache.put(endpoint, cache_key, data)
+    return data
+
+
+def stats():
+    """
+    Returns call counts, failures and latency totals per endpoint, for this
+        worker process.
+    """
+    with _stats_lock:
+        out = {}
+        for endpoint, entry in _stats.items():
+            out[endpoint] = dict(entry)
+            out[endpoint]["mean_ms"] = entry["total_ms"] / entry["calls"]
+        return out
+
+
+def search(title=None, author=None, isbn=None, limit=10):
+    """
+    Searches Open Library for works, asking only for the fields we use and
+        only as many results as we need.
+    Accepts:
+        title, author, isbn (strings or None): search criteria
+        limit (int): most works to return
+    Returns:
+        List of search result dicts ('docs')
+    Raises:
+        OpenLibraryError if Open Library can't be reached
+    """
+    payload = {'title': title,
+               'author': author,
+               'isbn': isbn,
+               'lang': 'en',  # prefer English editions in the 'editions' field
+               'limit': limit,
+               'fields': ','.join(SEARCH_FIELDS)}
+    return get_json('/search.json', payload).get('docs', [])[:limit]
+
+
+def _isbn_13(isbns):
+    """
+    Returns the first 13-digit ISBN in the list as an int, or None.
+    """
+    for isbn in isbns:
+        digits = isbn.replace('-', '').replace(' ', '')
+        if len(digits) == 13 and digits.isdigit():
+            return int(digits)
+    return None
+
+
+def cover_url(edition_key):
+    """
+    Returns the URL of the large cover image for an edition.
+    """
+    return "http://covers.openlibrary.org/b/olid/" + edition_key + "-L.jpg"
+
+
+def isbn_from_details(details):
+    """
+    Checks edition details from /api/books: the edition is suitable if it is
+        English only, with a cover and an ISBN-13.
+    Accepts:
+        details (dict): the 'details' of one bibkey, or None
+    Returns:
+        The ISBN-13 (int) of a suitable edition, otherwise None
+    """
+    if details and 'languages' in details and 'covers' in details and 'isbn_13' in details:
+        languages = details['languages']
+        if len(languages) == 1 and languages[0].get('key') == '/languages/eng':
+            return _isbn_13(details['isbn_13'])
+    return None
+
+
+def edition_from_search_result(search_result):
+    """
+    Picks a suitable edition straight from a search result's 'editions'
+        field: English only, with a cover and an ISBN-13.  No network calls.
+    Accepts:
+        search_result (dict): one of the docs from search()
+    Returns:
+        (edition_key, isbn) tuple, or None if the search result doesn't have
+            a suitable edition and /api/books must be asked
+    """
+    for edition in search_result.get('editions', {}).get('docs', []):
+        isbn = _isbn_13(edition.get('isbn', []))
+        if edition.get('language') == ['eng'] and 'cover_i' in edition and isbn is not None:
+            return edition['key'].split('/')[-1], isbn
+    return None
+
+
+def find_english_edition(search_result):
+    """
+    Finds the first English-language edition, with a cover and an ISBN-13,
+        of a work.  Uses the edition in the search result if it is suitable,
+        otherwise asks /api/books about the work's editions, BIBKEY_BATCH at
+        a time.
+    Accepts:
+        search_result (dict): one of the docs from search()
+    Returns:
+        (edition_key, isbn) tuple, or (None, None) if no edition is suitable
+    Raises:
+        OpenLibraryError if Open Library can't be reached
+    """
+    edition = edition_from_search_result(search_result)
+    if edition is not None:
+        return edition
+    edition_keys = search_result.get('edition_key', [])
+    for i in range(0, len(edition_keys), BIBKEY_BATCH):
+        payload = {'format': 'json',
+                   'jscmd': 'details',
+                   'bibkeys': ','.join(edition_keys[i:i + BIBKEY_BATCH])}
+        data = get_json('/api/books', payload)
+        for candidate in data.keys():
+            isbn = isbn_from_details(data[candidate]['details'])
+            if isbn is not None:
+                return candidate, isbn
+    return None, None
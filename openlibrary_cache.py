@@ -0,0 +1,235 @@
+"""
+Disk-backed cache of Open Library responses.
+
+Responses are stored as JSON in a small Sqlite database next to the app
+database, keyed by endpoint and normalised query parameters (case and spacing
+of titles and authors, and hyphens in ISBNs, don't matter).  Entries expire
+after a per-endpoint TTL, and once the cache grows past CACHE_MAX_BYTES the
+least recently used entries are evicted.  Any error in the cache is logged and
+treated as a miss, so the cache can never break a search.
+
+Inspect or empty the cache from the command line with:
+    python openlibrary_cache.py stats
+    python openlibrary_cache.py purge [--expired]
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import logging
+
+import metrics
+
+log = logging.getLogger('app.sub')
+
+CACHE_DATABASE = 'DatabaseSpecs/openlibrary-cache.db'
+CACHE_ENABLED = True
+CACHE_TTL = {'/search.json': 24 * 60 * 60,  # seconds; search results change as books are added
+             '/api/books': 30 * 24 * 60 * 60}  # edition details hardly ever change
+DEFAULT_TTL = 24 * 60 * 60
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+EVICT_TO = 0.9  # fraction of CACHE_MAX_BYTES left after an eviction
+
+_local = threading.local()
+_counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "errors": 0}
+_counters_lock = threading.Lock()
+
+
+def _count(name, n=1):
+    with _counters_lock:
+        _counters[name] += n
+    if name in ("hits", "misses"):
+        metrics.inc("bookswap_cache_lookups_total", n, cache="openlibrary",
+                    result="hit" if name == "hits" else "miss")
+
+
+def _get_conn():
+    """
+    Returns this thread's connection to the cache database, opening it (and
+        creating the table) on first use.
+    """
+    key = (CACHE_DATABASE, os.getpid())
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.key != key:
+        conn = sqlite3.connect(CACHE_DATABASE, timeout=5)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS OpenLibraryCache
+            (
+                cacheKey    TEXT    NOT NULL PRIMARY KEY,
+                endpoint    TEXT    NOT NULL,
+                response    TEXT    NOT NULL,
+                size        INTEGER NOT NULL,
+                hits        INTEGER NOT NULL DEFAULT 0,
+                dateCreated REAL    NOT NULL,
+                lastUsed    REAL    NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS OpenLibraryCache_lastUsed
+                ON OpenLibraryCache (lastUsed);
+            """)
+        _local.conn = conn
+        _local.key = key
+    return conn
+
+
+def make_key(endpoint, params=None):
+    """
+    Builds the cache key for a call: the endpoint plus its parameters, sorted,
+        lower-cased and with runs of whitespace collapsed.  ISBNs also lose
+        hyphens and spaces.  Parameters set to None are left out, as they are
+        by requests.
+    Accepts:
+        endpoint (string): e.g. '/search.json'
+        params (dict): query parameters
+    Returns:
+        Cache key (string)
+    """
+    parts = []
+    for name in sorted(params or {}):
+        value = params[name]
+        if value is None:
+            continue
+        value = " ".join(str(value).lower().split())
+        if name == 'isbn':
+            value = value.replace('-', '').replace(' ', '')
+        parts.append(f"{name}={value}")
+    return endpoint + "?" + "&".join(parts)
+
+
+def get(endpoint, key):
+    """
+    Looks up a cached response.
+    Accepts:
+        endpoint (string): endpoint the key belongs to, for its TTL
+        key (string): from make_key()
+    Returns:
+        Decoded JSON, or None on a miss (absent or expired)
+    """
+    if not CACHE_ENABLED:
+        return None
+    now = time.time()
+    try:
+        conn = _get_conn()
+        row = conn.execute("SELECT response FROM OpenLibraryCache WHERE cacheKey = ? AND dateCreated > ?",
+                           (key, now - CACHE_TTL.get(endpoint, DEFAULT_TTL))).fetchone()
+        if row is None:
+            _count("misses")
+            return None
+        conn.execute("UPDATE OpenLibraryCache SET lastUsed = ?, hits = hits + 1 WHERE cacheKey = ?", (now, key))
+        conn.commit()
+    except sqlite3.Error as e:
+        _count("errors")
+        log.error(f"Reading Open Library cache -- {e}")
+        return None
+    _count("hits")
+    return json.loads(row[0])
+
+
+def put(endpoint, key, data):
+    """
+    Stores a response, evicting the least recently used entries if the cache
+        has grown past CACHE_MAX_BYTES.
+    Accepts:
+        endpoint (string): e.g. '/search.json'
+        key (string): from make_key()
+        data: JSON-serialisable response
+    """
+    if not CACHE_ENABLED:
+        return
+    response = json.dumps(data, separators=(',', ':'))
+    now = time.time()
+    try:
+        conn = _get_conn()
+        conn.execute("""INSERT OR REPLACE INTO OpenLibraryCache
+                            (cacheKey, endpoint, response, size, dateCreated, lastUsed)
+                        VALUES (?, ?, ?, ?, ?, ?)""",
+                     (key, endpoint, response, len(response), now, now))
+        conn.commit()
+        _count("stores")
+        _evict(conn)
+    except sqlite3.Error as e:
+        _count("errors")
+        log.error(f"Writing Open Library cache -- {e}")
+
+
+def _evict(conn):
+    """
+    Removes least recently used entries until the cache is back under
+        EVICT_TO of CACHE_MAX_BYTES.
+    """
+    total = conn.execute("SELECT IFNULL(SUM(size), 0) FROM OpenLibraryCache").fetchone()[0]
+    if total <= CACHE_MAX_BYTES:
+        return
+    target = total - CACHE_MAX_BYTES * EVICT_TO
+    # Oldest first, until the running total of freed bytes reaches the target
+    removed = conn.execute("""
+            DELETE FROM OpenLibraryCache
+            WHERE cacheKey IN (
+                SELECT cacheKey FROM (
+                    SELECT cacheKey, size,
+                           SUM(size) OVER (ORDER BY lastUsed ROWS UNBOUNDED PRECEDING) AS freed
+                    FROM OpenLibraryCache
+                )
+                WHERE freed - size < ?
+            )""", (target,)).rowcount
+    conn.commit()
+    _count("evictions", removed)
+    log.info(f"Evicted {removed} least recently used Open Library cache entries")
+
+
+def purge(expired_only=False):
+    """
+    Deletes cache entries.
+    Accepts:
+        expired_only (bool): only delete entries past their TTL
+    Returns:
+        Number of entries deleted (int)
+    """
+    conn = _get_conn()
+    if expired_only:
+        now = time.time()
+        deleted = 0
+        for endpoint, in conn.execute("SELECT DISTINCT endpoint FROM OpenLibraryCache").fetchall():
+            deleted += conn.execute("DELETE FROM OpenLibraryCache WHERE endpoint = ? AND dateCreated <= ?",
+                                    (endpoint, now - CACHE_TTL.get(endpoint, DEFAULT_TTL))).rowcount
+    else:
+        deleted = conn.execute("DELETE FROM OpenLibraryCache").rowcount
+    conn.commit()
+    return deleted
+
+
+def stats():
+    """
+    Returns this worker's hit/miss counters, plus the size of the cache on
+        disk per endpoint.
+    """
+    with _counters_lock:
+        out = dict(_counters)
+    lookups = out["hits"] + out["misses"]
+    out["hit_ratio"] = out["hits"] / lookups if lookups else 0.0
+    out["endpoints"] = {}
+    try:
+        for endpoint, entries, size, hits in _get_conn().execute(
+                """SELECT endpoint, COUNT(*), SUM(size), SUM(hits)
+                   FROM OpenLibraryCache GROUP BY endpoint"""):
+            out["endpoints"][endpoint] = {"entries": entries, "bytes": size, "stored_hits": hits}
+    except sqlite3.Error as e:
+        log.error(f"Reading Open Library cache -- {e}")
+    return out
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == 'stats':
+        print(f"{CACHE_DATABASE}:")
+        for endpoint, entry in stats()["endpoints"].items():
+            print(f"  {endpoint}: {entry['entries']} entries, {entry['bytes']} bytes, "
+                  f"{entry['stored_hits']} hits")
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'purge':
+        expired_only = '--expired' in sys.argv[2:]
+        print(f"Deleted {purge(expired_only)} {'expired ' if expired_only else ''}entries from {CACHE_DATABASE}")
+    else:
+        print(__doc__)
+        sys.exit(1)
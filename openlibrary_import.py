@@ -0,0 +1,200 @@
+"""
+Bulk import of Open Library dump files into the Books table.
+
+Reads the dumps from https://openlibrary.org/developers/dumps one line at a
+time, plain or gzipped, either in their tab separated form (type, key,
+revision, last modified, JSON) or as one JSON record per line.  Memory use
+doesn't grow with the size of the dump: author names are staged in a
+temporary table, and rows are written with executemany in transactions of
+BATCH_SIZE rows.
+
+Only English, printed editions with a cover and an ISBN-13 are kept, the same
+test the app applies to live lookups, and each work is stored once, with the
+first such edition seen.  Works already in Books keep their details; if they
+have no edition yet, they get the imported one.
+
+Pass the authors dump before the editions dump so editions can be given
+their author's name:
+    python openlibrary_import.py ol_dump_authors.txt.gz ol_dump_editions.txt.gz
+"""
+import gzip
+import json
+import sys
+import time
+import logging
+
+import db_connector as dbc
+import openlibrary
+
+log = logging.getLogger('app.sub')
+
+BATCH_SIZE = 50000  # rows per executemany, and per transaction
+PROGRESS_EVERY = 1000000  # lines between progress messages
+NOT_PRINTED = ('e-book', 'ebook', 'electronic', 'audio', 'cd', 'dvd', 'cassette', 'microform', 'online')
+
+STAGE_AUTHOR = "INSERT OR REPLACE INTO temp.ImportAuthors (authorKey, name) VALUES (?, ?)"
+
+UPSERT_BOOK = """
+    INSERT INTO Books (title, author, ISBN, OLWorkKey, OLEditionKey, coverImageUrl)
+    SELECT ?, COALESCE((SELECT name FROM temp.ImportAuthors WHERE authorKey = ?), ?), ?, ?, ?, ?
+    WHERE true
+    ON CONFLICT (OLWorkKey) DO UPDATE
+        SET ISBN = excluded.ISBN, OLEditionKey = excluded.OLEditionKey, coverImageUrl = excluded.coverImageUrl
+        WHERE Books.OLEditionKey IS NULL
+          AND NOT EXISTS (SELECT 1 FROM Books AS other WHERE other.OLEditionKey = excluded.OLEditionKey)
+    ON CONFLICT DO NOTHING"""
+
+
+class ImportReport:
+    """
+    ImportReport counts what an import read and wrote.
+    """
+
+    def __init__(self):
+        self.lines = 0
+        self.malformed = 0
+        self.authors = 0
+        self.editions = 0  # editions that passed the filter
+        self.rows = 0  # Books rows inserted or updated
+        self.seconds = 0.0
+
+    @property
+    def lines_per_sec(self):
+        return self.lines / self.seconds if self.seconds else 0.0
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f"{self.lines} lines ({self.malformed} malformed), {self.authors} authors, "
+                f"{self.editions} suitable editions, {self.rows} Books rows written in {self.seconds:.1f} s "
+                f"({self.lines_per_sec:.0f} lines/s, {self.rows_per_sec:.0f} rows/s)")
+
+
+def read_records(path, report):
+    """
+    Yields the type and JSON record on each line of a dump file, skipping
+        (and counting) lines that can't be parsed.
+    Accepts:
+        path (string): dump file, gzipped if it ends in .gz
+        report (ImportReport): counts lines read
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            report.lines += 1
+            if report.lines % PROGRESS_EVERY == 0:
+                log.info(f"Import progress: {report}")
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line if line.startswith('{') else line.split('\t', 4)[4])
+                kind = record['type']['key']
+            except (IndexError, KeyError, TypeError, ValueError):
+                report.malformed += 1
+                continue
+            yield kind, record
+
+
+def _printed(record):
+    physical_format = record.get('physical_format', '').lower()
+    return not any(word in physical_format for word in NOT_PRINTED)
+
+
+def _short_key(key):
+    return key.split('/')[-1]
+
+
+def book_row(record):
+    """
+    Turns an edition record into the parameters for UPSERT_BOOK.
+    Returns:
+        Tuple of parameters, or None if the edition isn't English, printed,
+            and with a cover and an ISBN-13, or doesn't belong to a work
+    """
+    isbn = openlibrary.isbn_from_details(record)
+    if isbn is None or not _printed(record) or not any(isinstance(cover, int) and cover > 0 for cover in record['covers']):
+        return None
+    works = record.get('works') or []
+    title = record.get('title')
+    if len(works) == 0 or not title:
+        return None
+    edition_key = _short_key(record['key'])
+    authors = record.get('authors') or [{}]
+    author_key = _short_key(authors[0].get('key', '')) or None
+    return (title, author_key, record.get('by_statement') or 'Unknown Author', isbn,
+            _short_key(works[0]['key']), edition_key, openlibrary.cover_url(edition_key))
+
+
+def _flush(db, sql, rows):
+    """
+    Writes the rows in one executemany and one transaction, and empties the
+        list.  Returns the number of rows changed (int).
+    """
+    if len(rows) == 0:
+        return 0
+    with dbc.transaction(db):
+        changed = db.executemany(sql, rows).rowcount
+    rows.clear()
+    return changed
+
+
+def import_dumps(paths, database=None):
+    """
+    Imports editions (and author names) from Open Library dump files.
+    Accepts:
+        paths (list of strings): dump files, authors before editions
+        database (string): database file, defaults to db_connector.DATABASE
+    Returns:
+        ImportReport
+    """
+    report = ImportReport()
+    start = time.perf_counter()
+    pool = dbc.get_pool(database)
+    db = pool.acquire()
+    try:
+        db.execute("CREATE TEMP TABLE IF NOT EXISTS ImportAuthors (authorKey TEXT PRIMARY KEY, name TEXT NOT NULL)")
+        authors, books = [], []
+        for path in paths:
+            for kind, record in read_records(path, report):
+                if kind == '/type/author' and record.get('name'):
+                    authors.append((_short_key(record['key']), record['name']))
+                    report.authors += 1
+                    if len(authors) >= BATCH_SIZE:
+                        _flush(db, STAGE_AUTHOR, authors)
+                elif kind == '/type/edition':
+                    try:
+                        row = book_row(record)
+                    except (AttributeError, KeyError, TypeError, ValueError):
+                        # Well-formed JSON, but not shaped like an edition
+                        report.malformed += 1
+                        continue
+                    if row is not None:
+                        books.append(row)
+                        report.editions += 1
+                        if len(books) >= BATCH_SIZE:
+                            # Authors read so far must be staged before the editions that name them
+                            _flush(db, STAGE_AUTHOR, authors)
+                            report.rows += _flush(db, UPSERT_BOOK, books)
+        _flush(db, STAGE_AUTHOR, authors)
+        report.rows += _flush(db, UPSERT_BOOK, books)
+        with dbc.transaction(db):
+            # Books that got their edition from the dump don't need a live lookup any more
+            db.execute("""DELETE FROM EditionLookups
+                          WHERE bookId IN (SELECT id FROM Books WHERE OLEditionKey IS NOT NULL)""")
+    finally:
+        db.execute("DROP TABLE IF EXISTS temp.ImportAuthors")
+        pool.release(db)
+    report.seconds = time.perf_counter() - start
+    log.info(f"Import finished: {report}")
+    return report
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO)
+    print(f"{dbc.DATABASE}: {import_dumps(sys.argv[1:])}")
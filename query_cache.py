@@ -0,0 +1,97 @@
+"""
+In-process cache for front-page query results.
+
+Decorate a BookSwapDatabase method with @cached('listings') and its results
+are kept in memory, keyed by the method, its arguments and the database.
+Each entry remembers the data version it was computed at: the version
+counters live in the DataVersions table and are bumped by triggers on every
+write that could change the results, so a cached result is served only while
+a one-row read of DataVersions shows it is still current.  That holds across
+worker processes, each with their own cache, because the counters are shared
+through the database.
+
+Results also expire at the end of the (UTC) day, as they may include ages in
+days.  Empty results are not cached.
+"""
+import collections
+import functools
+import threading
+import time
+
+import metrics
+
+MAX_ENTRIES = 256
+
+_entries = collections.OrderedDict()  # key -> (versions, value), least recently used first
+_lock = threading.Lock()
+_counters = {}  # query name -> {"hits": n, "misses": n}
+
+
+def data_versions(db, names):
+    """
+    Reads the current version of each named data set.
+    Returns:
+        Tuple of versions (ints), in the order of `names`
+    """
+    rows = dict(db.execute(f"SELECT name, version FROM DataVersions WHERE name IN ({','.join('?' * len(names))})",
+                           names).fetchall())
+    return tuple(rows.get(name, 0) for name in names)
+
+
+def _count(query, hit):
+    counters = _counters.setdefault(query, {"hits": 0, "misses": 0})
+    counters["hits" if hit else "misses"] += 1
+    metrics.inc("bookswap_cache_lookups_total", cache=f"query.{query}", result="hit" if hit else "miss")
+
+
+def cached(*names):
+    """
+    Decorator for BookSwapDatabase methods whose results depend only on the
+        data sets `names` (e.g. 'listings') and the method's arguments.  The
+        cached value is shared, so callers must not change it.
+    """
+    def decorator(method):
+        query = method.__name__
+
+        @functools.wraps(method)
+        def wrapper(self, *args):
+            versions = data_versions(self.db, names)
+            key = (self.database, query, args, time.strftime('%Y-%m-%d', time.gmtime()))
+            with _lock:
+                entry = _entries.get(key)
+                hit = entry is not None and entry[0] == versions
+                _count(query, hit)
+                if hit:
+                    _entries.move_to_end(key)
+                    return entry[1]
+            value = method(self, *args)
+            if value:
+                with _lock:
+                    _entries[key] = (versions, value)
+                    _entries.move_to_end(key)
+                    while len(_entries) > MAX_ENTRIES:
+                        _entries.popitem(last=False)
+            return value
+        return wrapper
+    return decorator
+
+
+def clear():
+    """
+    Empties this process's cache and zeroes its counters.
+    """
+    with _lock:
+        _entries.clear()
+        _counters.clear()
+
+
+def stats():
+    """
+    Returns this worker's hits, misses and hit ratio per cached query.
+    """
+    with _lock:
+        out = {"entries": len(_entries), "queries": {}}
+        for query, counters in _counters.items():
+            lookups = counters["hits"] + counters["misses"]
+            out["queries"][query] = dict(counters, hit_ratio=counters["hits"] / lookups if lookups else 0.0)
+    return out
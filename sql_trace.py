@@ -0,0 +1,291 @@
+"""
+Per-request SQL instrumentation.
+
+Pooled connections are TracedConnections: while a StatementLog is active
+(see record_statements()), every statement run on them is recorded with its
+normalised SQL, duration (executing plus fetching) and rows fetched.  The
+BookSwapDatabase method (or other function) that ran it is looked up only
+with BOOKSWAP_SQL_DEBUG=1, or once a statement has run more than
+N_PLUS_ONE_THRESHOLD times; rows stepped through one at a time by iterating
+the cursor are only timed and counted with BOOKSWAP_SQL_DEBUG=1.  With no log
+active, connections hand out plain cursors and statements run untouched.
+
+app.py keeps a log for every request: the totals go out in a Server-Timing
+header, statements repeated more than N_PLUS_ONE_THRESHOLD times in one
+request are logged as likely N+1 queries, and with BOOKSWAP_SQL_DEBUG=1 the
+full detail of the last DEBUG_HISTORY requests is kept for /_sql-debug.
+"""
+import collections
+import contextlib
+import contextvars
+import functools
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import logging
+
+log = logging.getLogger('app.sub')
+
+DEBUG = os.environ.get('BOOKSWAP_SQL_DEBUG', '0') == '1'
+DEBUG_HISTORY = 50  # requests kept for /_sql-debug
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('BOOKSWAP_N_PLUS_ONE_THRESHOLD', '5'))
+
+_current = contextvars.ContextVar('sql_statement_log', default=None)
+_history = collections.deque(maxlen=DEBUG_HISTORY)
+_history_lock = threading.Lock()
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE = re.compile(r"\s+")
+_THIS_FILE = os.path.normcase(__file__)
+
+
+@functools.lru_cache(maxsize=1024)
+def normalise(sql):
+    """
+    Reduces a statement to its shape, so repeats with different values group
+        together: literals become ?, lists of placeholders become (...), and
+        whitespace is collapsed.
+    """
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("(...)", sql)
+    return _SPACE.sub(" ", sql).strip()
+
+
+def _caller():
+    """
+    Names the function that ran the statement: the nearest BookSwapDatabase
+        (db_connector) method if there is one, otherwise the nearest
+        function outside this module.
+    """
+    frame = sys._getframe(2)
+    first = None
+    while frame is not None:
+        code = frame.f_code
+        if os.path.normcase(code.co_filename) != _THIS_FILE:
+            module = frame.f_globals.get('__name__', '?')
+            if first is None:
+                first = f"{module}.{code.co_name}"
+            if module == 'db_connector':
+                return f"{module}.{code.co_name}"
+        frame = frame.f_back
+    return first or '?'
+
+
+class Statement:
+    """One statement run during a request"""
+
+    __slots__ = ('sql', 'caller', 'ms', 'rows')  # caller is None unless looked up
+
+    def __init__(self, sql, caller):
+        self.sql = sql
+        self.caller = caller
+        self.ms = 0.0
+        self.rows = 0
+
+    def as_dict(self):
+        return {"sql": self.sql, "caller": self.caller, "ms": round(self.ms, 3), "rows": self.rows}
+
+
+class StatementLog:
+    """
+    StatementLog collects the statements run during one piece of work, such
+        as a request.
+    """
+
+    def __init__(self):
+        self.statements = []
+        self._runs = collections.Counter()  # normalised sql -> times run
+
+    def add(self, sql):
+        """
+        Records a statement about to run, and returns its Statement.
+        """
+        sql = normalise(sql)
+        self._runs[sql] += 1
+        statement = Statement(sql, _caller() if DEBUG or self._runs[sql] > N_PLUS_ONE_THRESHOLD else None)
+        self.statements.append(statement)
+        return statement
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def total_ms(self):
+        return sum(statement.ms for statement in self.statements)
+
+    @property
+    def rows(self):
+        return sum(statement.rows for statement in self.statements)
+
+    def repeated(self, threshold=None):
+        """
+        Returns {normalised sql: (times run, set of callers)} for statements
+            run more than `threshold` times (default N_PLUS_ONE_THRESHOLD).
+        """
+        threshold = N_PLUS_ONE_THRESHOLD if threshold is None else threshold
+        return {sql: (n, {s.caller for s in self.statements if s.sql == sql and s.caller is not None})
+                for sql, n in self._runs.items() if n > threshold}
+
+    def summary(self):
+        return {"statements": self.count, "total_ms": round(self.total_ms, 3), "rows": self.rows}
+
+
+@contextlib.contextmanager
+def record_statements():
+    """
+    record_statements yields a StatementLog that collects every statement
+        run on a TracedConnection inside the block, on this thread.
+    """
+    statements = StatementLog()
+    token = _current.set(statements)
+    try:
+        yield statements
+    finally:
+        _current.reset(token)
+
+
+@contextlib.contextmanager
+def untraced():
+    """
+    untraced runs the block, or the function it decorates, with no
+        StatementLog active: for work such as migrations, whose repeated
+        statements are expected and not worth recording.
+    """
+    token = _current.set(None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def start():
+    """
+    Starts a StatementLog for a request.  Returns (log, token); pass the
+        token to stop().
+    """
+    statements = StatementLog()
+    return statements, _current.set(statements)
+
+
+def stop(token):
+    _current.reset(token)
+
+
+def remember(request_info, statements):
+    """
+    Keeps a request's full statement detail for /_sql-debug, if BOOKSWAP_SQL_DEBUG
+        is set.
+    """
+    if not DEBUG:
+        return
+    entry = dict(request_info, **statements.summary(),
+                 detail=[statement.as_dict() for statement in statements.statements])
+    with _history_lock:
+        _history.append(entry)
+
+
+def history():
+    """
+    Returns the detail kept for the most recent requests, newest first.
+    """
+    with _history_lock:
+        return list(reversed(_history))
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor that records its statements in the active StatementLog"""
+
+    _statement = None
+
+    def _begin(self, sql):
+        statements = _current.get()
+        self._statement = statements.add(sql) if statements is not None else None
+        return self._statement
+
+    def execute(self, sql, parameters=()):
+        statement = self._begin(sql)
+        if statement is None:
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            statement.ms += (time.perf_counter() - start) * 1000
+
+    def executemany(self, sql, seq_of_parameters):
+        statement = self._begin(sql)
+        if statement is None:
+            return super().executemany(sql, seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            statement.ms += (time.perf_counter() - start) * 1000
+            statement.rows = max(self.rowcount, 0)
+
+    def _fetch(self, fetch, *args):
+        statement = self._statement
+        if statement is None:
+            return fetch(*args)
+        start = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            statement.ms += (time.perf_counter() - start) * 1000
+
+    def fetchone(self):
+        row = self._fetch(super().fetchone)
+        if row is not None and self._statement is not None:
+            self._statement.rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._fetch(super().fetchmany, size if size is not None else self.arraysize)
+        if self._statement is not None:
+            self._statement.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(super().fetchall)
+        if self._statement is not None:
+            self._statement.rows += len(rows)
+        return rows
+
+
+
+class DebugCursor(TracedCursor):
+    """TracedCursor that also times and counts rows read by iterating it"""
+
+    def __next__(self):
+        row = self._fetch(super().__next__)
+        if self._statement is not None:
+            self._statement.rows += 1
+        return row
+
+
+class TracedConnection(sqlite3.Connection):
+    """
+    Connection whose cursors are TracedCursors while a StatementLog is
+        active, and plain cursors otherwise.
+    """
+
+    def cursor(self, factory=None):
+        if factory is None:
+            if _current.get() is None:
+                factory = sqlite3.Cursor
+            else:
+                factory = DebugCursor if DEBUG else TracedCursor
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
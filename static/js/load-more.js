@@ -0,0 +1,24 @@
+function loadMore(button, cursor)
+/*
+ * LoadMore fetches the next page of this page's lists and adds its rows to
+ *  the end of each list.  Every paged table has an id and a data-paged
+ *  attribute; the rows of the table with the same id on the next page are
+ *  appended to it, and the next page's "Show More" button (if any) replaces
+ *  this one.
+ * accepts:
+ *  button (element): the "Show More" button that was clicked
+ *  cursor (string): next_cursor of the page shown last
+ * returns:
+ *  null
+ */
+{
+    $(button).prop('disabled', true);
+    $.get(window.location.pathname, {'after': cursor}, function (html) {
+        var next = $('<div/>').append($.parseHTML(html));
+        $('table[data-paged]').each(function () {
+            var rows = next.find('#' + this.id + ' > tbody > tr');
+            $(this).children('tbody').last().append(rows);
+        });
+        $(button).closest('.load-more').replaceWith(next.find('.load-more').first());
+    });
+}
@@ -106,10 +106,25 @@ function seeCopies(book)
     $('<th/>').attr("scope", "col").text("Copy Quality").appendTo(headRow);
     $('<th/>').attr("scope", "col").text("Point Cost").appendTo(headRow);
     $('<th/>').attr("scope", "col").text("Request Trade").appendTo(headRow);
-    let tableBody = $('<tbody/>').attr('id', 'showCopiesModalTableBody')
+    $('<tbody/>').attr('id', 'showCopiesModalTableBody')
         .appendTo(copiesTable);
+    loadCopies(book, null);
+}
 
-    let data = {"request": "copiesModal", "book": JSON.stringify(book)};
+function loadCopies(book, after)
+/*****************************************************************************\
+ * LoadCopies fetches one page of copies of a book and adds them to the
+ *  copiesModal table, with a "Show More Copies" button while there are more.
+ * Accepts:
+ *  book (object): JSON-ified copy of book dictionary
+ *  after (string): "next" cursor from the previous page, or null for the
+ *      first page
+ * Returns:
+ *  Null
+ \*****************************************************************************/ {
+    var tableBody = $('#showCopiesModalTableBody');
+    var footer = $('#showCopiesModalFooter');
+    let data = {"request": "copiesModal", "book": JSON.stringify(book), "after": after};
     $.ajax({
         url: '/wishlist',
         type: 'POST',
@@ -117,11 +132,13 @@ function seeCopies(book)
         contentType: 'application/json; charset=utf-8',
         dataType: 'json',
         success: function (data) {
-            title = data['title'];
-            $('#showCopiesModalTitle').text(title);
-            $('#showCopiesModalNumber').text(data['count']);
             var copies = data['copies'];
-            $('#showCopiesModalCover').attr("src", copies[0]['coverImageUrl']);
+            if (after == null) {
+                title = data['title'];
+                $('#showCopiesModalTitle').text(title);
+                $('#showCopiesModalNumber').text(data['count']);
+                $('#showCopiesModalCover').attr("src", copies[0]['coverImageUrl']);
+            }
             $.each(copies, function(i)
                 {
                     var row = $('<tr/>').appendTo(tableBody);
@@ -150,6 +167,17 @@ function seeCopies(book)
                         button.html("Need More Points");
                     }
                 });
+            footer.empty();
+            if (data['next']) {
+                var moreButton = $('<button/>')
+                        .attr("type", "button")
+                        .addClass("btn btn-outline-primary btn-sm")
+                        .on("click", function() {
+                            loadCopies(book, data['next']);
+                        })
+                        .text("Show More Copies")
+                        .appendTo(footer);
+            }
             var closeButton = $('<button/>')
                     .attr("type", "button")
                     .addClass("btn btn-secondary btn-sm")
@@ -157,7 +185,8 @@ function seeCopies(book)
                     .text("Close")
                     .appendTo(footer);
 
-            $('#showCopiesModal').modal("show");
+            if (after == null)
+                $('#showCopiesModal').modal("show");
         }
     });
 }
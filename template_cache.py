@@ -0,0 +1,68 @@
+"""
+Compiled templates for the web app, ready before the first request.
+
+Jinja compiles a template to Python the first time it is rendered, so without
+help every worker pays for compiling layout.html, the macros and the larger
+pages on the first request for each.  Two things avoid that:
+  - a filesystem bytecode cache: compiled templates are kept in CACHE_DIR
+    (BOOKSWAP_TEMPLATE_CACHE_DIR, default a per-user directory under the
+    system temp directory) and loaded from there by every later worker, until
+    the template's source changes;
+  - preloading: at startup every template under templates/ is loaded into the
+    Jinja environment's in-memory cache, from the bytecode cache when it can
+    be, so no request waits for it.  With workers forked from a preloaded
+    app, the loaded templates are shared with every worker.
+"""
+import os
+import time
+import logging
+
+from jinja2 import FileSystemBytecodeCache, TemplateError
+
+log = logging.getLogger('app.sub')
+
+CACHE_DIR = os.environ.get('BOOKSWAP_TEMPLATE_CACHE_DIR')  # None for Jinja's default
+BYTECODE_CACHE = True
+PRELOAD = True
+
+
+def configure(app):
+    """
+    Gives the app's Jinja environment a filesystem bytecode cache, if
+        BYTECODE_CACHE, then preloads its templates, if PRELOAD.
+    Accepts:
+        app (Flask): the web app
+    """
+    if BYTECODE_CACHE:
+        if CACHE_DIR:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(CACHE_DIR)
+    if PRELOAD:
+        preload(app)
+
+
+def preload(app):
+    """
+    Loads every template the app can find into its Jinja environment, so the
+        first request for each doesn't compile it.  A template that fails to
+        compile is logged and left to fail when it is rendered.
+    Accepts:
+        app (Flask): the web app
+    Returns:
+        Number of templates loaded (int)
+    """
+    env = app.jinja_env
+    names = env.list_templates()
+    if env.cache is not None and env.cache.capacity < len(names):
+        log.warning("Jinja cache holds %d templates but there are %d; raise cache_size",
+                    env.cache.capacity, len(names))
+    start = time.perf_counter()
+    loaded = 0
+    for name in names:
+        try:
+            env.get_template(name)
+            loaded += 1
+        except TemplateError as e:
+            log.error("Template %s failed to compile -- %s", name, e)
+    log.info("Preloaded %d templates in %.0f ms", loaded, (time.perf_counter() - start) * 1000)
+    return loaded
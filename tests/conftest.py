@@ -0,0 +1,67 @@
+import os
+import sqlite3
+
+import pytest
+import db_connector as dbc
+import metrics
+import openlibrary
+import openlibrary_cache
+import wishlist_matches
+from tests.openlibrary_stub import OpenLibraryStub
+
+SCHEMA = os.path.join(os.path.dirname(__file__), os.pardir, 'DatabaseSpecs', 'database-definition-queries.sql')
+
+
+@pytest.fixture
+def tmp_db(tmp_path, monkeypatch):
+    """
+    Builds a fresh, fully migrated copy of the sample database and points
+    db_connector at it.  Listings are matched to wishlists straight away
+    rather than by a background thread.
+    """
+    path = str(tmp_path / "bookswap.db")
+    conn = sqlite3.connect(path)
+    with open(SCHEMA) as f:
+        conn.executescript(f.read())
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(dbc, "DATABASE", path)
+    monkeypatch.setattr(wishlist_matches, "BACKGROUND", False)
+    dbc.get_pool(path)
+    yield path
+    dbc.get_pool(path).close_all()
+
+
+@pytest.fixture(autouse=True)
+def tmp_openlibrary_cache(tmp_path, monkeypatch):
+    """
+    Keeps every test's Open Library response cache in its own directory.
+    """
+    monkeypatch.setattr(openlibrary_cache, "CACHE_DATABASE", str(tmp_path / "openlibrary-cache.db"))
+
+
+@pytest.fixture(scope="session")
+def openlibrary_stub_server():
+    with OpenLibraryStub() as stub:
+        yield stub
+
+
+@pytest.fixture(autouse=True)
+def openlibrary_stub(openlibrary_stub_server, monkeypatch):
+    """
+    Points every test at the local Open Library stand-in, so the suite runs
+    offline.  Tests can change its latency or error rate; they are reset for
+    the next test.
+    """
+    openlibrary_stub_server.reset()
+    monkeypatch.setattr(openlibrary, "BASE_URL", openlibrary_stub_server.url)
+    yield openlibrary_stub_server
+
+
+@pytest.fixture(autouse=True)
+def tmp_metrics(tmp_path, monkeypatch):
+    """
+    Keeps every test's metrics snapshots in its own directory.
+    """
+    monkeypatch.setattr(metrics, "METRICS_DATABASE", str(tmp_path / "metrics.db"))
+    metrics.reset()
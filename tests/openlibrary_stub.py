@@ -0,0 +1,194 @@
+"""
+A local stand-in for openlibrary.org, for tests and load runs.
+
+Serves search.json and /api/books on localhost.  Searches listed in
+tests/fixtures/openlibrary-canned.json get their canned results; any other
+search gets `num_docs` made-up works, the same ones every time for the same
+query.  Like the real API it honours `limit` and `fields`.  Latency, the
+fraction of calls that fail with a 503, and the padding added to each record
+(to make payloads bigger) are all configurable.
+
+Point the app at it with the OPENLIBRARY_URL environment variable, e.g.:
+    python -m tests.openlibrary_stub --port 8081 --latency 0.1 --error-rate 0.05
+    OPENLIBRARY_URL=http://127.0.0.1:8081 python app.py
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'openlibrary-canned.json')
+DEFAULT_PAGE = 100  # search.json results when no limit is given
+
+
+class OpenLibraryStub:
+    """
+    OpenLibraryStub runs the stand-in server on a background thread.  Use it
+        as a context manager, or call start() and stop().
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, num_docs=DEFAULT_PAGE, padding=0,
+                 fixtures=FIXTURES, port=0, seed=0):
+        self.latency = latency  # seconds added to every response
+        self.error_rate = error_rate  # fraction of calls answered with a 503
+        self.num_docs = num_docs  # made-up works per search
+        self.padding = padding  # bytes of filler added to every record
+        self.port = port
+        self.url = None
+        with open(fixtures) as f:
+            canned = json.load(f)
+        self.search_docs = canned['search']
+        self.books = canned['books']
+        self.requests = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, name='openlibrary-stub', daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def reset(self, latency=0.0, error_rate=0.0, num_docs=DEFAULT_PAGE, padding=0):
+        """
+        Restores the default behaviour and zeroes the counters.
+        """
+        with self._lock:
+            self.latency, self.error_rate, self.num_docs, self.padding = latency, error_rate, num_docs, padding
+            self.requests = self.errors = self.bytes_sent = 0
+
+    def _handle(self, request):
+        url = urlsplit(request.path)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        with self._lock:
+            self.requests += 1
+            fail = self._rng.random() < self.error_rate
+        time.sleep(self.latency)
+        if fail:
+            status, body = 503, b'{"error": "stub failure"}'
+        elif url.path == '/search.json':
+            status, body = 200, json.dumps(self.search(params)).encode()
+        elif url.path == '/api/books':
+            status, body = 200, json.dumps(self.api_books(params)).encode()
+        else:
+            status, body = 404, b'{"error": "notfound"}'
+        with self._lock:
+            self.errors += status != 200
+            self.bytes_sent += len(body)
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def _pad(self, record):
+        if self.padding:
+            record = dict(record, description='x' * self.padding)
+        return record
+
+    def _made_up_docs(self, params):
+        query = '&'.join(f"{name}={params[name]}" for name in ('title', 'author', 'isbn') if name in params)
+        prefix = int(hashlib.sha1(query.encode()).hexdigest()[:6], 16)
+        docs = []
+        for i in range(self.num_docs):
+            work = f"OL{prefix}{i:03d}"
+            editions = [f"{work}{e}M" for e in range(3)]
+            docs.append({'key': f"/works/{work}W",
+                         'title': f"{params.get('title') or 'Book'} {i}",
+                         'author_name': [params.get('author') or 'A. Writer'],
+                         'edition_key': editions,
+                         'edition_count': len(editions),
+                         # The best match is only suitable for every other work, so the rest need /api/books
+                         'editions': {'numFound': len(editions), 'start': 0, 'numFoundExact': True,
+                                      'docs': [{'key': f"/books/{editions[2 if i % 2 else 0]}",
+                                                'language': ['eng' if i % 2 else 'fre'],
+                                                'isbn': [str(9780000000000 + prefix % 1000000 * 1000 + i)],
+                                                'cover_i': i + 1}]}})
+        return docs
+
+    def search(self, params):
+        query = '&'.join(f"{name}={' '.join(params[name].lower().split())}"
+                         for name in ('title', 'author', 'isbn') if name in params)
+        docs = self.search_docs.get(query)
+        if docs is None:
+            docs = self._made_up_docs(params)
+        docs = [self._pad(doc) for doc in docs[:int(params.get('limit', DEFAULT_PAGE))]]
+        if 'fields' in params:
+            fields = params['fields'].split(',')
+            edition_fields = {field.split('.', 1)[1] for field in fields if field.startswith('editions.')}
+            projected = []
+            for doc in docs:
+                doc = {name: value for name, value in doc.items() if name in fields}
+                if 'editions' in doc:
+                    doc['editions'] = dict(doc['editions'],
+                                           docs=[{name: value for name, value in edition.items()
+                                                  if name in edition_fields}
+                                                 for edition in doc['editions']['docs']])
+                projected.append(doc)
+            docs = projected
+        return {'numFound': len(docs), 'start': 0, 'docs': docs}
+
+    def api_books(self, params):
+        out = {}
+        for bibkey in params.get('bibkeys', '').split(','):
+            if bibkey in self.books:
+                out[bibkey] = self._pad(self.books[bibkey])
+            elif bibkey.startswith('OL') and bibkey.endswith('M'):
+                # Made-up editions: only the last of each work (ending 2M) is suitable
+                suitable = bibkey.endswith('2M')
+                details = {'title': bibkey, 'key': f"/books/{bibkey}",
+                           'languages': [{'key': '/languages/eng' if suitable else '/languages/fre'}],
+                           'isbn_13': [str(9780000000000 + int(hashlib.sha1(bibkey.encode()).hexdigest()[:9], 16)
+                                           % 10000000000)]}
+                if suitable:
+                    details['covers'] = [1]
+                out[bibkey] = self._pad({'bib_key': bibkey, 'details': details})
+        return out
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local stand-in for openlibrary.org")
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of calls that fail with a 503")
+    parser.add_argument('--num-docs', type=int, default=DEFAULT_PAGE, help="made-up works per search")
+    parser.add_argument('--padding', type=int, default=0, help="bytes of filler added to every record")
+    args = parser.parse_args()
+    stub = OpenLibraryStub(latency=args.latency, error_rate=args.error_rate, num_docs=args.num_docs,
+                           padding=args.padding, port=args.port).start()
+    print(f"Open Library stub listening on {stub.url}, stop with Ctrl-C")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.stop()
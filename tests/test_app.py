@@ -0,0 +1,82 @@
+import re
+
+from flask import g, session
+
+import db_connector as dbc
+import app as app_module
+from app import app
+
+
+def test_user_summary_is_only_looked_up_when_read(tmp_db):
+    with app.test_request_context():
+        session["user_num"] = 1
+        app.preprocess_request()
+        assert "username" not in g.__dict__
+        assert getattr(g, "_database", None) is None  # no connection borrowed yet
+        assert g.username == "admin"
+        assert isinstance(g.num_trade_requests, int)
+
+
+def test_missing_user_is_logged_out(tmp_db):
+    with app.test_request_context():
+        session["user_num"] = -1
+        app.preprocess_request()
+        assert getattr(g, "points", None) is None
+        assert session["user_num"] is None
+
+
+def test_navbar_follows_the_loaded_user_summary(tmp_db):
+    # Without the HTML comments, so nothing else in the page reads g first
+    source, _, _ = app.jinja_loader.get_source(app.jinja_env, "layout.html")
+    layout = app.jinja_env.from_string(re.sub(r"<!--.*?-->", "", source, flags=re.S))
+    for user_num, logged_in in ((1, True), (-1, False)):
+        with app.test_request_context():
+            session["user_num"] = user_num
+            app.preprocess_request()
+            body = layout.render()
+        assert ("Log Out" in body) == logged_in and ("Sign Up" in body) != logged_in
+
+
+def test_my_books_pages_through_listings(tmp_db, monkeypatch):
+    monkeypatch.setattr(dbc, "PAGE_SIZE", 1)
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_num"] = 1
+    first = client.get("/my-books")
+    assert first.status_code == 200
+    assert b"loadMore(this," in first.data
+    after_all = client.get("/my-books?after=" + dbc.encode_cursor([10 ** 9]))
+    assert after_all.status_code == 200
+    assert b"loadMore(this," not in after_all.data
+
+
+def test_wrongly_typed_cursor_gives_the_first_page(tmp_db):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_num"] = 2
+    bad = dbc.encode_cursor([{"a": 1}])
+    for page in ("/my-books", "/received-requests", "/my-requests"):
+        assert client.get(page + "?after=" + bad).status_code == 200
+
+
+def test_user_summary_survives_a_busy_pool(tmp_db, monkeypatch):
+    def busy():
+        raise dbc.PoolTimeoutError()
+
+    monkeypatch.setattr("app.get_bsdb", busy)
+    with app.test_request_context():
+        session["user_num"] = 1
+        app.preprocess_request()
+        assert getattr(g, "points", None) is None
+        assert session["user_num"] is None
+
+
+def test_stats_routes_are_off_unless_enabled(tmp_db, monkeypatch):
+    client = app.test_client()
+    routes = ["/_db-pool-stats", "/_openlibrary-stats", "/_edition-lookup-stats", "/_query-cache-stats",
+              "/_wishlist-match-stats"]
+    for route in routes:
+        assert client.get(route).status_code == 404
+    monkeypatch.setattr(app_module, "STATS_ROUTES", True)
+    for route in routes:
+        assert client.get(route).status_code == 200
@@ -0,0 +1,17 @@
+from flask import Flask
+
+import db_connector as dbc
+from book_search import BookSearch
+
+
+def test_local_book_search_gives_each_listing_once_as_dicts(tmp_db):
+    with Flask(__name__).app_context():
+        search = BookSearch(("9781627795227", "rowling", "harry"), dbc.BookSwapDatabase())
+        first = search.local_book_search(1)
+        second = search.local_book_search(10, first.next_cursor)
+        dbc.release_db()
+    # The ISBN, author and title, and author or title tiers all match Harry
+    # Potter's listings, but each comes once
+    assert all(isinstance(result, dict) for result in first + second)
+    assert [result["userBooksId"] for result in first + second] == [2, 1]
+    assert second.next_cursor is None
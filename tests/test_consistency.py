@@ -0,0 +1,110 @@
+import sqlite3
+
+import consistency
+import db_connector as dbc
+from flask import Flask
+
+
+def _counters(db, user_num):
+    return db.execute("SELECT numTradeRequests, numOpenTrades FROM UserTradeCounters WHERE userId = ?",
+                      (user_num,)).fetchone()
+
+
+def test_trade_counters_follow_trades(tmp_db):
+    app = Flask(__name__)
+    with app.app_context():
+        bsdb = dbc.BookSwapDatabase()
+        db = bsdb.db
+        assert tuple(_counters(db, 1)) == (1, 0)
+        bsdb.accept_trade(7)
+        assert tuple(_counters(db, 1)) == (0, 1)
+        bsdb.reject_trade(8)
+        assert tuple(_counters(db, 3)) == (0, 1)
+        with dbc.transaction(db):
+            db.execute("INSERT INTO Trades (userRequestedId, userBookId, statusId) VALUES (2, 1, 2)")
+            db.execute("DELETE FROM Trades WHERE userBookId = 9")
+        assert (bsdb.get_num_trade_requests(1), bsdb.get_num_open_trades(1)) == (1, 1)
+        assert (bsdb.get_num_trade_requests(2), bsdb.get_num_open_trades(2)) == (1, 0)
+        assert consistency.check_trade_counters(db) == []
+        dbc.release_db()
+
+
+def test_drift_is_reported_and_repaired(tmp_db):
+    db = sqlite3.connect(tmp_db)
+    db.execute("UPDATE UserTradeCounters SET numOpenTrades = 9 WHERE userId = 1")
+    db.commit()
+    assert consistency.check_trade_counters(db) == [(1, (1, 9), (1, 0))]
+    consistency.check_trade_counters(db, repair=True)
+    assert consistency.check_all(db)["UserTradeCounters"] == []
+    db.close()
+
+
+def _availability(db):
+    return [tuple(row) for row in db.execute("SELECT * FROM BookAvailability ORDER BY bookId")]
+
+
+def test_book_availability_follows_listings(tmp_db):
+    app = Flask(__name__)
+    with app.app_context():
+        bsdb = dbc.BookSwapDatabase()
+        db = bsdb.db
+        with dbc.transaction(db):
+            db.execute("INSERT INTO UserBooks (userId, bookId, copyQualityId, points, dateCreated) "
+                       "VALUES (2, 1, 1, 0, '2030-01-01 00:00:00')")
+            db.execute("UPDATE UserBooks SET points = points + 4 WHERE bookId = 2")
+            db.execute("UPDATE UserBooks SET available = 0 WHERE id = (SELECT min(id) FROM UserBooks WHERE bookId = 3)")
+            db.execute("UPDATE UserBooks SET bookId = 4 WHERE id = (SELECT min(id) FROM UserBooks WHERE bookId = 5)")
+            db.execute("DELETE FROM UserBooks WHERE bookId = 6")
+        bsdb.request_book({'userBooksId': 16, 'pointsNeeded': 3}, 1)
+        assert db.execute("SELECT availableCount, minPoints, newestListing FROM BookAvailability "
+                          "WHERE bookId = 1").fetchone()[:3] == (2, 0, '2030-01-01 00:00:00')
+        assert db.execute("SELECT COUNT(*) FROM BookAvailability WHERE bookId = 6").fetchone()[0] == 0
+        assert consistency.check_book_availability(db) == []
+        dbc.release_db()
+
+
+def test_book_availability_skips_copies_without_points(tmp_db):
+    db = sqlite3.connect(tmp_db)
+    points = db.execute("SELECT minPoints FROM BookAvailability WHERE bookId = 1").fetchone()[0]
+    db.execute("INSERT INTO UserBooks (userId, bookId, copyQualityId, points) VALUES (2, 1, 1, NULL)")
+    db.execute("UPDATE UserBooks SET points = NULL WHERE id = (SELECT max(id) FROM UserBooks WHERE bookId = 2)")
+    db.execute("UPDATE UserBooks SET bookId = 2 WHERE id = (SELECT max(id) FROM UserBooks WHERE bookId = 1)")
+    db.execute("UPDATE UserBooks SET bookId = 1 WHERE id = (SELECT max(id) FROM UserBooks WHERE bookId = 2)")
+    db.commit()
+    assert db.execute("SELECT minPoints FROM BookAvailability WHERE bookId = 1").fetchone()[0] == points
+    assert consistency.check_book_availability(db) == []
+
+
+def test_book_availability_drift_is_repaired_and_rebuilt(tmp_db):
+    db = sqlite3.connect(tmp_db)
+    expected = _availability(db)
+    db.execute("UPDATE BookAvailability SET minPoints = 99 WHERE bookId = 1")
+    db.execute("DELETE FROM BookAvailability WHERE bookId = 2")
+    db.execute("INSERT INTO BookAvailability VALUES (9999, 1, 1, NULL)")
+    db.commit()
+    drift = consistency.check_book_availability(db, repair=True)
+    assert [(book_id, stored is None, expected is None) for book_id, stored, expected in drift] == \
+        [(1, False, False), (2, True, False), (9999, False, True)]
+    assert _availability(db) == expected
+    db.execute("DELETE FROM BookAvailability")
+    db.commit()
+    consistency.rebuild_all(db)
+    assert _availability(db) == expected
+    assert not any(consistency.check_all(db).values())
+    db.close()
+
+
+def test_wishlist_counts_leave_out_the_owners_copies(tmp_db):
+    app = Flask(__name__)
+    with app.app_context():
+        bsdb = dbc.BookSwapDatabase()
+        before = {row["bookId"]: (row["numberAvailable"], row["minPoints"])
+                  for row in bsdb.get_wishlist_books_for_user(3)}
+        book_id = next(iter(before))
+        with dbc.transaction(bsdb.db):
+            bsdb.db.execute("INSERT INTO UserBooks (userId, bookId, copyQualityId, points) VALUES (3, ?, 1, 0)",
+                            (book_id,))
+        after = {row["bookId"]: (row["numberAvailable"], row["minPoints"])
+                 for row in bsdb.get_wishlist_books_for_user(3)}
+        assert after == before
+        dbc.release_db()
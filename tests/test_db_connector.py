@@ -1,5 +1,9 @@
+import time
+
 import pytest
 import db_connector as dbc
+import openlibrary
+import sql_trace
 from flask import Flask, render_template, url_for, flash, redirect, session, g
 
 
@@ -10,15 +14,266 @@ def app():
     yield app
 
 
-def test_search_books_openlibrary_1(app):
+def test_search_books_openlibrary_1(app, tmp_db):
     with app.app_context():
         bsdb = dbc.BookSwapDatabase()
         out = bsdb.search_books_openlibrary(title="lord", author="tolkien")
         print([o['id'] for o in out])
+    assert [o['OLWorkKey'] for o in out] == ["OL27448W"]
 
 
-def test_search_books_openlibrary_5(app):
+def test_search_books_openlibrary_5(app, tmp_db, openlibrary_stub):
     with app.app_context():
         bsdb = dbc.BookSwapDatabase()
         out = bsdb.search_books_openlibrary(title="harry potter", author="rowling", num_results=5)
         print([o['id'] for o in out])
+    assert len(out) == 5
+    # One search, plus one /api/books call for the result whose best edition has no cover
+    assert openlibrary_stub.requests == 2
+    assert out[2]['OLEditionKey'] == "OL9406046M"
+
+
+def test_search_books_openlibrary_through_slow_flaky_server(app, tmp_db, openlibrary_stub, monkeypatch):
+    monkeypatch.setattr(openlibrary, "MAX_RETRIES", 0)
+    openlibrary_stub.reset(latency=0.05, error_rate=1.0)
+    with app.app_context():
+        assert dbc.BookSwapDatabase().search_books_openlibrary(title="anything") == []
+    openlibrary_stub.reset(num_docs=20, padding=2000)
+    with app.app_context():
+        out = dbc.BookSwapDatabase().search_books_openlibrary(title="anything", num_results=20)
+    assert len(out) == 20
+    # Every other made-up work needs its editions looked up
+    assert sum(1 for o in out if o['OLEditionKey'] is not None) == 20
+    assert openlibrary_stub.requests == 11
+
+
+def test_pool_reuses_connections(app, tmp_db):
+    before = dbc.pool_stats()
+    with app.app_context():
+        first = dbc.get_db()
+        dbc.release_db()
+        second = dbc.get_db()
+        dbc.release_db()
+    assert first is second
+    after = dbc.pool_stats()
+    assert after["opens"] == 1
+    assert after["hits"] - before["hits"] == 2
+
+
+def test_pool_connections_are_tuned(tmp_db):
+    pool = dbc.get_pool()
+    conn = pool.acquire()
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+    pool.release(conn)
+
+
+def test_pool_waits_when_full(tmp_db):
+    pool = dbc.ConnectionPool(tmp_db, size=1, timeout=0.05)
+    conn = pool.acquire()
+    with pytest.raises(dbc.PoolTimeoutError):
+        pool.acquire()
+    assert pool.stats()["waits"] == 1
+    pool.release(conn)
+    assert pool.acquire() is conn
+    pool.close_all()
+
+
+def test_request_book_commits_once(app, tmp_db):
+    with app.app_context():
+        bsdb = dbc.BookSwapDatabase()
+        statements = []
+        bsdb.db.set_trace_callback(statements.append)
+        points = bsdb.request_book({'userBooksId': 16, 'pointsNeeded': 3}, 1)
+        bsdb.db.set_trace_callback(None)
+    assert points == 7
+    assert [s for s in statements if s in ("BEGIN IMMEDIATE", "COMMIT")] == ["BEGIN IMMEDIATE", "COMMIT"]
+
+
+def test_reject_trade_rolls_back_as_a_unit(app, tmp_db):
+    with app.test_request_context():
+        bsdb = dbc.BookSwapDatabase()
+        # Make the last step of the rejection fail
+        bsdb.db.execute("""CREATE TEMP TRIGGER fail_availability BEFORE UPDATE OF available ON UserBooks
+                           BEGIN SELECT RAISE(ABORT, 'boom'); END""")
+        with pytest.raises(Exception):
+            bsdb.reject_trade(7)
+        status = bsdb.db.execute("SELECT statusId FROM Trades WHERE userBookId = 7").fetchone()[0]
+        points = bsdb.get_current_user_points(2)
+    assert status == 2
+    assert points == 10
+
+
+def test_fts_prefix_query_strips_syntax():
+    assert dbc.fts_prefix_query('harry pot') == '"harry"* "pot"*'
+    assert dbc.fts_prefix_query('title: OR (') == '"title"* "OR"*'
+    assert dbc.fts_prefix_query('"(*') is None
+
+
+def test_author_and_title_search_matches_prefixes(app, tmp_db):
+    with app.app_context():
+        bsdb = dbc.BookSwapDatabase()
+        rows = bsdb.get_books_by_author_and_title("rowl", "harry pot")
+    assert [row["userBooksId"] for row in rows] == [1]
+    assert rows[0]["booksId"] == 1
+    assert rows[0]["pointsNeeded"] == 1
+
+
+def test_full_text_index_follows_new_books(app, tmp_db):
+    with app.app_context():
+        bsdb = dbc.BookSwapDatabase()
+        c = bsdb.db.execute("INSERT INTO Books (title, author) VALUES ('Middlemarch', 'George Eliot')")
+        bsdb.user_add_book_by_id(c.lastrowid, 2, 1, 1)
+        rows = bsdb.get_books_by_author_or_title("", "middle")
+    assert [row["title"] for row in rows] == ["Middlemarch"]
+
+
+def test_search_local_books_ranks_tiers_once_each(app, tmp_db):
+    with app.app_context():
+        bsdb = dbc.BookSwapDatabase()
+        rows = bsdb.search_local_books("9781627795227", "rowling", "harry", 10)
+        limited = bsdb.search_local_books("9781627795227", "rowling", "harry", 1)
+    # ISBN match, then the author and title match; the author or title
+    # tier matches Harry Potter again but it is not repeated
+    assert [row["userBooksId"] for row in rows] == [2, 1]
+    assert [row["userBooksId"] for row in limited] == [2]
+
+
+def test_search_books_openlibrary_survives_outage(app, tmp_db, monkeypatch):
+    monkeypatch.setattr(openlibrary, "BASE_URL", "http://127.0.0.1:9")
+    monkeypatch.setattr(openlibrary, "MAX_RETRIES", 0)
+    monkeypatch.setattr(openlibrary, "_session", None)
+    with app.app_context():
+        bsdb = dbc.BookSwapDatabase()
+        assert bsdb.search_books_openlibrary(title="sula") == []
+
+
+def test_search_books_openlibrary_keeps_search_order(app, tmp_db, monkeypatch):
+    def get_json(endpoint, params=None):
+        if endpoint == '/search.json':
+            return {"docs": [{"key": f"/works/OL{i}W", "title": f"Book {i}", "edition_key": [f"OL{i}M"]}
+                             for i in range(4)]}
+        bibkey = params['bibkeys']
+        time.sleep(0.04 - 0.01 * int(bibkey[2]))  # later results answer first
+        return {bibkey: {"details": {"languages": [{"key": "/languages/eng"}], "covers": [1],
+                                     "isbn_13": [f"978000000000{bibkey[2]}"]}}}
+    monkeypatch.setattr(openlibrary, "get_json", get_json)
+    with app.app_context():
+        bsdb = dbc.BookSwapDatabase()
+        out = bsdb.search_books_openlibrary(title="book", num_results=4)
+    assert [book["OLWorkKey"] for book in out] == ["OL0W", "OL1W", "OL2W", "OL3W"]
+    assert [book["OLEditionKey"] for book in out] == ["OL0M", "OL1M", "OL2M", "OL3M"]
+
+
+def test_user_summary_matches_separate_lookups(app, tmp_db):
+    with app.app_context():
+        bsdb = dbc.BookSwapDatabase()
+        user_nums = [row[0] for row in bsdb.db.execute("SELECT id FROM Users")]
+        for user_num in user_nums:
+            summary = bsdb.get_user_summary(user_num)
+            settings = bsdb.get_account_settings(user_num)
+            assert (summary["username"], summary["points"]) == (settings["username"], settings["points"])
+            assert summary["numTradeRequests"] == bsdb.get_num_trade_requests(user_num)
+            assert summary["numOpenTrades"] == bsdb.get_num_open_trades(user_num)
+        assert bsdb.get_user_summary(-1) is None
+
+
+def test_wishlist_books_for_user_in_one_query(app, tmp_db):
+    with app.app_context():
+        bsdb = dbc.BookSwapDatabase()
+        with dbc.transaction(bsdb.db):
+            wishlist_id = bsdb.db.execute("INSERT INTO Wishlists (userId) VALUES (3)").lastrowid
+            bsdb.db.execute("INSERT INTO WishlistsBooks (wishlistId, bookId) SELECT ?, bookId FROM UserBooks "
+                            "WHERE userId != 3 LIMIT 1", (wishlist_id,))
+        for user_num in (1, 2, 3):
+            per_list = [dict(row) for wishlist in bsdb.get_wishlists_by_userid(user_num)
+                        for row in bsdb.get_book_details_for_wishlist(wishlist["id"])]
+            with sql_trace.record_statements() as statements:
+                batched = [dict(row) for row in bsdb.get_wishlist_books_for_user(user_num)]
+            assert batched == per_list
+            assert statements.count == 1
+        assert {row["wishlistId"] for row in batched} == {3, wishlist_id}
+
+
+def _all_pages(fetch):
+    rows, after = [], None
+    while True:
+        page = fetch(after)
+        rows.extend(page)
+        if page.next_cursor is None:
+            return rows
+        after = page.next_cursor
+
+
+def test_listing_pages_cover_every_listing_once(app, tmp_db):
+    with app.app_context():
+        bsdb = dbc.BookSwapDatabase()
+        for book_id in (1, 2, 3, 4, 5):
+            bsdb.user_add_book_by_id(book_id, 2, 1, 1)
+        everything = bsdb.get_listed_books(2, limit=dbc.MAX_PAGE_SIZE)
+        paged = _all_pages(lambda after: bsdb.get_listed_books(2, after=after, limit=2))
+        first = bsdb.get_listed_books(2, limit=2)
+    assert len(everything) > 4 and everything.next_cursor is None
+    assert [row["id"] for row in paged] == [row["id"] for row in everything]
+    assert len(first) == 2 and first.next_cursor is not None
+
+
+def test_trade_pages_cover_every_trade_once(app, tmp_db):
+    with app.app_context():
+        bsdb = dbc.BookSwapDatabase()
+        requester = bsdb.db.execute("SELECT userRequestedId FROM Trades GROUP BY userRequestedId "
+                                    "ORDER BY COUNT(*) DESC LIMIT 1").fetchone()[0]
+        everything = bsdb.get_all_open_requests(requester)
+        paged = _all_pages(lambda after: bsdb.get_all_open_requests(requester, after=after, limit=1))
+        owner = bsdb.db.execute("SELECT UserBooks.userId FROM Trades JOIN UserBooks ON UserBooks.id = Trades.userBookId "
+                                "LIMIT 1").fetchone()[0]
+        trades = bsdb.get_trade_info(owner)
+        paged_trades = _all_pages(lambda after: bsdb.get_trade_info(owner, after=after, limit=1))
+    assert len(everything) > 1
+    assert [row["tradeId"] for row in paged] == [row["tradeId"] for row in everything]
+    # Newest first
+    keys = [(row["dateInitiated"], row["tradeId"]) for row in everything]
+    assert keys == sorted(keys, reverse=True)
+    assert len(trades) > 0
+    assert [row["tradeId"] for row in paged_trades] == [row["tradeId"] for row in trades]
+
+
+def test_search_local_books_pages_follow_the_ranking(app, tmp_db):
+    with app.app_context():
+        bsdb = dbc.BookSwapDatabase()
+        first = bsdb.search_local_books("9781627795227", "rowling", "harry", 1)
+        second = bsdb.search_local_books("9781627795227", "rowling", "harry", 1, first.next_cursor)
+    assert [row["userBooksId"] for row in first] == [2]
+    assert [row["userBooksId"] for row in second] == [1]
+    assert second.next_cursor is None
+
+
+def test_search_pages_survive_changes_to_the_search_index(app, tmp_db):
+    with app.app_context():
+        bsdb = dbc.BookSwapDatabase()
+        book_id = bsdb.search_local_books("", "rowling", "harry", 1)[0]["booksId"]
+        for user in (2, 3):
+            bsdb.user_add_book_by_id(book_id, user, 1, 1)
+        expected = [row["userBooksId"] for row in bsdb.search_local_books("", "rowling", "harry", 10)]
+        page = bsdb.search_local_books("", "rowling", "harry", 1)
+        seen = [row["userBooksId"] for row in page]
+        while page.next_cursor and len(seen) <= len(expected):
+            # New books change every match's score, but not the listings' order
+            with dbc.transaction(bsdb.db):
+                bsdb.db.execute("INSERT INTO Books (title, author) VALUES ('Harry Harry Harry', 'Rowling')")
+            page = bsdb.search_local_books("", "rowling", "harry", 1, page.next_cursor)
+            seen += [row["userBooksId"] for row in page]
+    assert len(expected) > 1
+    assert seen == expected
+
+
+def test_bad_cursor_gives_the_first_page(app, tmp_db):
+    with app.app_context():
+        bsdb = dbc.BookSwapDatabase()
+        first = bsdb.get_listed_books(1, limit=1)
+        for cursor in ("not a cursor", dbc.encode_cursor([1, 2]), dbc.encode_cursor([{"a": 1}]),
+                       dbc.encode_cursor([[1]]), dbc.encode_cursor([True])):
+            assert [row["id"] for row in bsdb.get_listed_books(1, after=cursor, limit=1)] == [first[0]["id"]]
+    assert dbc.page_size(10 ** 6) == dbc.MAX_PAGE_SIZE
+    assert dbc.page_size(0) == 1
@@ -0,0 +1,88 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import textwrap
+
+import pytest
+import db_connector as dbc
+import edition_enrichment
+import openlibrary
+from flask import Flask
+
+
+@pytest.fixture
+def deferred(tmp_db, monkeypatch):
+    monkeypatch.setattr(dbc, "DEFER_EDITION_LOOKUPS", True)
+    monkeypatch.setattr(edition_enrichment, "start_worker", lambda database=None: None)
+    calls = []
+
+    def get_json(endpoint, params=None):
+        calls.append(endpoint)
+        if endpoint == '/search.json':
+            return {"docs": [{"key": f"/works/OL90{i}W", "title": f"Queued Book {i}", "author_name": ["A. Writer"],
+                              "edition_key": [f"OL90{i}0M", f"OL90{i}1M"]} for i in range(3)]}
+        # Only the second edition of each work is suitable
+        return {key: {"details": {"languages": [{"key": "/languages/eng"}], "covers": [1],
+                                  "isbn_13": [f"978000000{key[2:6]}"]} if key.endswith("1M") else {}}
+                for key in params['bibkeys'].split(",")}
+    monkeypatch.setattr(openlibrary, "get_json", get_json)
+    return calls
+
+
+def test_deferred_search_stores_books_then_worker_fills_editions(deferred, tmp_db):
+    app = Flask(__name__)
+    with app.app_context():
+        out = dbc.BookSwapDatabase().search_books_openlibrary(title="queued", num_results=3)
+    assert deferred == ['/search.json']
+    assert [book["OLEditionKey"] for book in out] == [None, None, None]
+    assert edition_enrichment.drain(tmp_db) == 3
+    # Every pending work's edition keys went in the one call
+    assert deferred == ['/search.json', '/api/books']
+    db = sqlite3.connect(tmp_db)
+    rows = db.execute("SELECT OLWorkKey, OLEditionKey, ISBN, coverImageUrl FROM Books "
+                      "WHERE OLWorkKey LIKE 'OL90_W' ORDER BY OLWorkKey").fetchall()
+    assert [row[1] for row in rows] == ["OL9001M", "OL9011M", "OL9021M"]
+    assert rows[0][2] == 9780000009001
+    assert rows[0][3] == openlibrary.cover_url("OL9001M")
+    assert db.execute("SELECT COUNT(*) FROM EditionLookups").fetchone()[0] == 0
+    db.close()
+
+
+def test_failed_lookup_is_retried_later(deferred, tmp_db, monkeypatch):
+    app = Flask(__name__)
+    with app.app_context():
+        dbc.BookSwapDatabase().search_books_openlibrary(title="queued", num_results=1)
+
+    def unreachable(endpoint, params=None):
+        raise openlibrary.OpenLibraryError("down")
+    monkeypatch.setattr(openlibrary, "get_json", unreachable)
+    assert edition_enrichment.drain(tmp_db) == 1
+    db = sqlite3.connect(tmp_db)
+    attempts, = db.execute("SELECT attempts FROM EditionLookups").fetchone()
+    db.close()
+    assert attempts == 1
+    # Not due again until the backoff has passed
+    assert edition_enrichment.drain(tmp_db) == 0
+
+
+def test_environment_switch_defers_lookups(tmp_db):
+    # A new process, as the switch is read when db_connector is imported
+    script = textwrap.dedent(f"""
+        import db_connector as dbc, edition_enrichment, openlibrary
+        from flask import Flask
+        assert dbc.DEFER_EDITION_LOOKUPS
+        def get_json(endpoint, params=None):
+            assert endpoint == '/search.json', endpoint
+            return {{"docs": [{{"key": "/works/OL950W", "title": "Switched Book", "author_name": ["A. Writer"],
+                               "edition_key": ["OL9500M"]}}]}}
+        openlibrary.get_json = get_json
+        dbc.DATABASE = {tmp_db!r}
+        with Flask(__name__).app_context():
+            out = dbc.BookSwapDatabase().search_books_openlibrary(title="switched", num_results=1)
+        print(out[0]["OLEditionKey"], edition_enrichment.stats()["pending"])
+    """)
+    env = dict(os.environ, BOOKSWAP_DEFER_EDITION_LOOKUPS="1")
+    out = subprocess.run([sys.executable, "-c", script], cwd=os.path.join(os.path.dirname(__file__), os.pardir),
+                         env=env, capture_output=True, text=True, check=True).stdout
+    assert out.split() == ["None", "1"]
@@ -0,0 +1,84 @@
+import csv
+import gzip
+import io
+import json
+
+import db_connector as dbc
+import listing_export
+from app import app
+
+
+def _ndjson(response):
+    return [json.loads(line) for line in response.get_data().decode().splitlines()]
+
+
+def _available_ids(path):
+    db = dbc.get_pool(path).acquire()
+    try:
+        return {row[0] for row in db.execute("SELECT id FROM UserBooks WHERE available = 1")}
+    finally:
+        dbc.get_pool(path).release(db)
+
+
+def test_full_export_streams_every_available_listing(tmp_db, monkeypatch):
+    monkeypatch.setattr(listing_export, "BATCH", 3)
+    response = app.test_client().get("/api/listings/export", buffered=False)
+    chunks = list(response.response)
+    rows = [json.loads(line) for line in b"".join(chunks).decode().splitlines()]
+    assert response.status_code == 200
+    assert len(chunks) == -(-len(rows) // 3)  # one chunk per batch of rows
+    assert response.mimetype == "application/x-ndjson"
+    assert {row["userBooksId"] for row in rows} == _available_ids(tmp_db)
+    assert not any(row["removed"] for row in rows)
+    assert all(row["title"] and row["listingUser"] for row in rows)
+    versions = [row["version"] for row in rows]
+    assert versions == sorted(versions)
+    assert int(response.headers["X-Export-Version"]) >= versions[-1]
+
+
+def test_since_sends_only_changes(tmp_db):
+    client = app.test_client()
+    version = int(client.get("/api/listings/export").headers["X-Export-Version"])
+    assert _ndjson(client.get(f"/api/listings/export?since={version}")) == []
+    with app.app_context():
+        db = dbc.BookSwapDatabase().db
+        repriced, taken = sorted(_available_ids(tmp_db))[:2]
+        with dbc.transaction(db):
+            db.execute("UPDATE UserBooks SET points = points + 1 WHERE id = ?", (repriced,))
+            db.execute("UPDATE UserBooks SET available = 0 WHERE id = ?", (taken,))
+        dbc.release_db()
+    response = client.get(f"/api/listings/export?since={version}")
+    rows = _ndjson(response)
+    assert [(row["userBooksId"], row["removed"]) for row in rows] == [(repriced, False), (taken, True)]
+    assert rows[1] == {"version": rows[1]["version"], "userBooksId": taken, "removed": True}
+    assert int(response.headers["X-Export-Version"]) == rows[-1]["version"]
+
+
+def test_csv_export_is_gzipped_when_accepted(tmp_db):
+    client = app.test_client()
+    response = client.get("/api/listings/export?format=csv", headers={"Accept-Encoding": "gzip, deflate"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    rows = list(csv.DictReader(io.StringIO(gzip.decompress(response.data).decode())))
+    assert {int(row["userBooksId"]) for row in rows} == _available_ids(tmp_db)
+    assert list(rows[0]) == list(listing_export.FIELDS)
+
+
+def test_export_rejects_bad_arguments(tmp_db):
+    client = app.test_client()
+    assert client.get("/api/listings/export?format=xml").status_code == 400
+    assert client.get("/api/listings/export?since=yesterday").status_code == 400
+
+
+def test_unread_exports_hold_no_connection(tmp_db):
+    client = app.test_client()
+    for _ in range(3):
+        assert client.head("/api/listings/export").status_code == 200
+        client.get("/api/listings/export", buffered=False).close()
+    stats = dbc.get_pool(tmp_db).stats()
+    assert stats["idle"] == stats["open"]
+
+
+def test_gzip_refused_with_zero_quality(tmp_db):
+    response = app.test_client().get("/api/listings/export", headers={"Accept-Encoding": "gzip;q=0, identity"})
+    assert "Content-Encoding" not in response.headers
+    assert _ndjson(response)
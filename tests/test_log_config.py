@@ -0,0 +1,62 @@
+import io
+import logging
+import os
+import subprocess
+import sys
+
+import log_config
+
+
+class CountingStr:
+    def __init__(self):
+        self.calls = 0
+
+    def __str__(self):
+        self.calls += 1
+        return "formatted"
+
+
+def test_queued_records_are_formatted_only_when_enabled():
+    out = io.StringIO()
+    log = logging.getLogger('app.sub')
+    skipped, kept = CountingStr(), CountingStr()
+    try:
+        log_config.configure({"app": "INFO"}, stream=out, sample_every=1)
+        log.debug("skipped %s", skipped)
+        log.info("kept %s", kept)
+    finally:
+        log_config.shutdown()
+        log_config.configure()
+    assert skipped.calls == 0 and kept.calls >= 1
+    assert out.getvalue().endswith("INFO in test_log_config: kept formatted\n")
+
+
+def test_debug_records_are_sampled_per_message():
+    out = io.StringIO()
+    log = logging.getLogger('app.sub')
+    try:
+        log_config.configure({"app": "DEBUG"}, stream=out, sample_every=3)
+        for i in range(7):
+            log.debug("row %d", i)
+            log.info("info %d", i)
+    finally:
+        log_config.shutdown()
+        log_config.configure()
+    lines = out.getvalue().splitlines()
+    assert [line.split(": ")[-1] for line in lines if "DEBUG" in line] == ["row 0", "row 3", "row 6"]
+    assert len([line for line in lines if "INFO" in line]) == 7
+
+
+def test_parse_levels():
+    assert log_config.parse_levels("app=info, app.sub=DEBUG,") == {"app": "INFO", "app.sub": "DEBUG"}
+
+
+def test_app_logger_is_queued_however_the_app_is_started():
+    # As `python app.py` does, but without starting the server
+    script = ("import runpy, flask.logging, log_config; "
+              "app = runpy.run_path('app.py', run_name='not_app')['app']; "
+              "print(app.logger.name, log_config._handler in app.logger.handlers, "
+              "flask.logging.default_handler in app.logger.handlers)")
+    out = subprocess.run([sys.executable, "-c", script], cwd=os.path.join(os.path.dirname(__file__), os.pardir),
+                         capture_output=True, text=True, check=True).stdout
+    assert out.split() == ["app", "True", "False"]
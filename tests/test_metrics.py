@@ -0,0 +1,94 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+from app import app
+
+
+def test_render_adds_up_every_worker():
+    metrics.inc("bookswap_openlibrary_calls_total", endpoint="/search.json", outcome="ok")
+    metrics.observe("bookswap_openlibrary_call_duration_seconds", 0.2, endpoint="/search.json")
+    metrics.inc("bookswap_cache_lookups_total", cache="openlibrary", result="hit")
+    metrics.flush()
+    # Another worker process's snapshot
+    other = {"counters": [["bookswap_openlibrary_calls_total", [["endpoint", "/search.json"], ["outcome", "ok"]], 2],
+                          ["bookswap_cache_lookups_total", [["cache", "openlibrary"], ["result", "miss"]], 3]],
+             "histograms": [["bookswap_openlibrary_call_duration_seconds", [["endpoint", "/search.json"]],
+                             [0] * len(metrics.BUCKETS) + [1, 30.0]]]}
+    db = sqlite3.connect(metrics.METRICS_DATABASE)
+    db.execute("INSERT INTO ProcessMetrics VALUES (?, ?, ?, 0)", ("parent", os.getppid(), json.dumps(other)))
+    db.commit()
+    db.close()
+    lines = metrics.render().splitlines()
+    assert 'bookswap_openlibrary_calls_total{endpoint="/search.json",outcome="ok"} 3' in lines
+    assert 'bookswap_openlibrary_call_duration_seconds_bucket{endpoint="/search.json",le="0.25"} 1' in lines
+    assert 'bookswap_openlibrary_call_duration_seconds_bucket{endpoint="/search.json",le="+Inf"} 2' in lines
+    assert 'bookswap_openlibrary_call_duration_seconds_sum{endpoint="/search.json"} 30.2' in lines
+    assert 'bookswap_cache_hit_ratio{cache="openlibrary"} 0.25' in lines
+
+
+def test_a_reused_pid_keeps_the_dead_workers_totals():
+    metrics.inc("bookswap_cache_lookups_total", 2, cache="openlibrary", result="hit")
+    metrics.flush()
+    # The worker exits, and a new one is started with the same pid
+    metrics.reset()
+    metrics.inc("bookswap_cache_lookups_total", cache="openlibrary", result="hit")
+    metrics.flush()
+    assert 'bookswap_cache_lookups_total{cache="openlibrary",result="hit"} 3' in metrics.render().splitlines()
+    # The dead worker's totals were folded into the row kept for exited workers
+    db = sqlite3.connect(metrics.METRICS_DATABASE)
+    processes = {row[0] for row in db.execute("SELECT process FROM ProcessMetrics")}
+    db.close()
+    assert processes == {metrics.EXITED, metrics.process_key()}
+
+
+def test_snapshots_keyed_by_the_bare_pid_are_kept():
+    db = sqlite3.connect(metrics.METRICS_DATABASE)
+    db.execute("CREATE TABLE ProcessMetrics (pid INTEGER NOT NULL PRIMARY KEY, snapshot TEXT NOT NULL, "
+               "updated REAL NOT NULL)")
+    old = {"counters": [["bookswap_cache_lookups_total", [["cache", "openlibrary"], ["result", "hit"]], 4]],
+           "histograms": []}
+    db.execute("INSERT INTO ProcessMetrics VALUES (?, ?, 0)", (os.getpid(), json.dumps(old)))
+    db.commit()
+    db.close()
+    metrics.inc("bookswap_cache_lookups_total", cache="openlibrary", result="hit")
+    assert 'bookswap_cache_lookups_total{cache="openlibrary",result="hit"} 5' in metrics.render().splitlines()
+
+
+def test_snapshots_are_written_by_a_background_thread():
+    metrics.inc("bookswap_cache_lookups_total", cache="openlibrary", result="miss")
+    metrics.start_flusher()
+    metrics._wake.set()  # rather than wait FLUSH_INTERVAL
+    assert metrics._flusher.name == "metrics-flush" and metrics._flusher is not threading.current_thread()
+    db = sqlite3.connect(metrics.METRICS_DATABASE, timeout=1)
+    for _ in range(500):
+        if db.execute("SELECT name FROM sqlite_master WHERE name = 'ProcessMetrics'").fetchone() and \
+                db.execute("SELECT COUNT(*) FROM ProcessMetrics").fetchone()[0]:
+            break
+        time.sleep(0.01)
+    snapshot, = db.execute("SELECT snapshot FROM ProcessMetrics WHERE process = ?", (metrics.process_key(),)).fetchone()
+    db.close()
+    assert json.loads(snapshot)["counters"][0][2] == 1
+
+
+def test_a_forked_worker_gets_fresh_locks():
+    old = metrics._lock
+    with old:
+        metrics._forked()
+        assert not metrics._lock.locked()
+    metrics.inc("bookswap_cache_lookups_total", cache="openlibrary", result="hit")
+    assert metrics._lock is not old
+
+
+def test_requests_are_counted_per_endpoint_and_status(tmp_db):
+    client = app.test_client()
+    client.get("/learn-how")
+    client.get("/no-such-page")
+    body = client.get("/metrics").get_data(as_text=True)
+    assert 'bookswap_http_requests_total{endpoint="learn_how",method="GET",status="200"} 1' in body
+    assert 'bookswap_http_requests_total{endpoint="none",method="GET",status="404"} 1' in body
+    assert 'bookswap_http_request_duration_seconds_count{endpoint="learn_how",method="GET",status="200"} 1' in body
+    assert 'bookswap_db_request_seconds_count{endpoint="learn_how"} 1' in body
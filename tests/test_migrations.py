@@ -0,0 +1,43 @@
+import os
+import shutil
+import sqlite3
+
+import migrations
+
+
+def _index_names(path):
+    db = sqlite3.connect(path)
+    names = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    db.close()
+    return names
+
+
+def test_upgrade_existing_database_in_place(tmp_path):
+    path = str(tmp_path / "old.db")
+    shutil.copy(os.path.join(migrations.SPECS_DIR, "test-db.db"), path)
+    applied = migrations.upgrade_file(path)
+    assert applied == [version for version, _, _ in migrations.available_migrations()]
+    assert "UserBooks_userId_available" in _index_names(path)
+    db = sqlite3.connect(path)
+    # Data survives the upgrade
+    assert db.execute("SELECT COUNT(*) FROM UserBooks").fetchone()[0] == 21
+    db.close()
+    # Nothing left to do the second time round
+    assert migrations.upgrade_file(path) == []
+
+
+def test_upgrade_builds_empty_database(tmp_path):
+    path = str(tmp_path / "new.db")
+    migrations.upgrade_file(path)
+    db = sqlite3.connect(path)
+    assert db.execute("SELECT COUNT(*) FROM Books").fetchone()[0] > 0
+    assert migrations.current_version(db) == migrations.available_migrations()[-1][0]
+    db.close()
+
+
+def test_listed_books_query_uses_index(tmp_db):
+    db = sqlite3.connect(tmp_db)
+    plan = " ".join(row[-1] for row in db.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM UserBooks WHERE userId = ? AND available == 1", (1,)))
+    db.close()
+    assert "UserBooks_userId_available" in plan
@@ -0,0 +1,85 @@
+import pytest
+
+import openlibrary
+import openlibrary_cache
+
+
+@pytest.fixture
+def unreachable(monkeypatch):
+    # Nothing listens on the discard port, so connections are refused at once
+    monkeypatch.setattr(openlibrary, "BASE_URL", "http://127.0.0.1:9")
+    monkeypatch.setattr(openlibrary, "MAX_RETRIES", 0)
+    monkeypatch.setattr(openlibrary, "_session", None)
+
+
+def test_failed_calls_raise_and_are_recorded(unreachable):
+    with openlibrary.record_calls() as calls:
+        with pytest.raises(openlibrary.OpenLibraryError):
+            openlibrary.get_json("/search.json", {"title": "sula"})
+    assert calls.count == 1
+    assert calls.failures == 1
+    assert openlibrary.stats()["/search.json"]["failures"] >= 1
+
+
+def test_session_is_shared(unreachable):
+    assert openlibrary.get_session() is openlibrary.get_session()
+
+
+def test_cache_key_is_normalised():
+    assert (openlibrary_cache.make_key("/search.json", {"title": " Harry  Potter", "author": None, "isbn": "978-1"})
+            == openlibrary_cache.make_key("/search.json", {"isbn": "9781", "title": "harry potter"}))
+
+
+def test_get_json_reads_through_cache(unreachable):
+    key = openlibrary_cache.make_key("/search.json", {"title": "Sula"})
+    openlibrary_cache.put("/search.json", key, {"docs": []})
+    # Open Library is unreachable, so this can only come from the cache
+    assert openlibrary.get_json("/search.json", {"title": "sula "}) == {"docs": []}
+
+
+def test_cache_expires_and_evicts(monkeypatch):
+    openlibrary_cache.put("/api/books", "a", {"x": 1})
+    monkeypatch.setattr(openlibrary_cache, "CACHE_TTL", {"/api/books": -1})
+    assert openlibrary_cache.get("/api/books", "a") is None
+    monkeypatch.setattr(openlibrary_cache, "CACHE_TTL", {"/api/books": 60})
+    monkeypatch.setattr(openlibrary_cache, "CACHE_MAX_BYTES", 20)
+    openlibrary_cache.put("/api/books", "b", {"y": 2})
+    openlibrary_cache.get("/api/books", "a")  # a is now the most recently used
+    openlibrary_cache.put("/api/books", "c", {"z": 3})
+    assert openlibrary_cache.get("/api/books", "b") is None
+    assert openlibrary_cache.get("/api/books", "a") == {"x": 1}
+    assert openlibrary_cache.get("/api/books", "c") == {"z": 3}
+
+
+def test_search_asks_for_projection_and_limit(monkeypatch):
+    seen = {}
+
+    def get_json(endpoint, params=None):
+        seen.update(params)
+        return {"docs": [{"key": f"/works/OL{i}W"} for i in range(20)]}
+    monkeypatch.setattr(openlibrary, "get_json", get_json)
+    assert len(openlibrary.search(title="sula", limit=5)) == 5
+    assert seen["limit"] == 5
+    assert seen["fields"].split(",") == list(openlibrary.SEARCH_FIELDS)
+
+
+def test_edition_comes_from_search_result_without_calls(monkeypatch):
+    monkeypatch.setattr(openlibrary, "get_json", None)  # any call would fail
+    result = {"edition_key": ["OL1M", "OL2M"],
+              "editions": {"docs": [{"key": "/books/OL2M", "language": ["eng"], "cover_i": 7,
+                                     "isbn": ["0123456789", "978-0-12-345678-9"]}]}}
+    assert openlibrary.find_english_edition(result) == ("OL2M", 9780123456789)
+
+
+def test_edition_lookup_batches_cover_every_key_once(monkeypatch):
+    asked = []
+
+    def get_json(endpoint, params=None):
+        asked.append(params["bibkeys"].split(","))
+        return {key: {"details": {}} for key in asked[-1]}
+    monkeypatch.setattr(openlibrary, "get_json", get_json)
+    monkeypatch.setattr(openlibrary, "BIBKEY_BATCH", 10)
+    keys = [f"OL{i}M" for i in range(25)]
+    assert openlibrary.find_english_edition({"edition_key": keys}) == (None, None)
+    assert [len(batch) for batch in asked] == [10, 10, 5]
+    assert sum(asked, []) == keys
@@ -0,0 +1,57 @@
+import gzip
+import os
+import shutil
+import sqlite3
+
+import openlibrary
+import openlibrary_import
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "openlibrary-dump.txt")
+
+
+def test_import_keeps_english_printed_editions(tmp_db, tmp_path):
+    dump = str(tmp_path / "dump.txt.gz")
+    with open(FIXTURE, "rb") as src, gzip.open(dump, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    db = sqlite3.connect(tmp_db)
+    db.execute("INSERT INTO Books (title, author, OLWorkKey) VALUES ('Already Listed', 'Someone', 'OL300W')")
+    db.commit()
+    report = openlibrary_import.import_dumps([dump], tmp_db)
+    assert report.lines == 10
+    assert report.malformed == 1
+    assert report.editions == 4
+    assert report.rows == 3
+    rows = {row[0]: row[1:] for row in db.execute(
+        "SELECT OLWorkKey, OLEditionKey, title, author, ISBN, coverImageUrl FROM Books WHERE OLWorkKey IS NOT NULL")}
+    db.close()
+    assert set(rows) == {"OL200W", "OL300W", "OL400W"}
+    # The first suitable edition of a work wins, named after its author
+    assert rows["OL200W"] == ("OL201M", "Kindred", "Octavia E. Butler", 9780807083697,
+                              openlibrary.cover_url("OL201M"))
+    # Existing works only gain an edition
+    assert rows["OL300W"][:3] == ("OL301M", "Already Listed", "Someone")
+    assert rows["OL400W"][2] == "by O. Butler"
+
+
+def test_import_is_idempotent(tmp_db):
+    openlibrary_import.import_dumps([FIXTURE], tmp_db)
+    assert openlibrary_import.import_dumps([FIXTURE], tmp_db).rows == 0
+
+
+def test_import_skips_editions_it_cannot_read(tmp_db, tmp_path):
+    dump = str(tmp_path / "dump.txt")
+    edition = ('{"title": "Odd", "works": [{"key": "/works/OL900W"}], "languages": %s, "isbn_13": %s, '
+               '"covers": %s, "key": "/books/OL90%dM", "type": {"key": "/type/edition"}}')
+    with open(dump, "w") as f:
+        f.write(edition % ('[{"key": "/languages/eng"}]', '["9780807083697 (pbk.)"]', '[1]', 1) + "\n")
+        f.write(edition % ('[{"name": "English"}]', '["9780807083697"]', '[1]', 2) + "\n")
+        f.write(edition % ('["eng"]', '["9780807083697"]', '[1]', 3) + "\n")
+        f.write(edition % ('[{"key": "/languages/eng"}]', '["9780807083697"]', '7', 4) + "\n")
+        f.write(edition % ('[{"key": "/languages/eng"}]', '["9780807083697"]', '[1]', 5) + "\n")
+    report = openlibrary_import.import_dumps([FIXTURE, dump], tmp_db)
+    # The unreadable editions are counted and skipped; the import carries on
+    assert report.malformed == 1 + 2
+    db = sqlite3.connect(tmp_db)
+    keys = {row[0] for row in db.execute("SELECT OLEditionKey FROM Books WHERE OLWorkKey = 'OL900W'")}
+    db.close()
+    assert keys == {"OL905M"}
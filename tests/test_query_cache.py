@@ -0,0 +1,33 @@
+import sqlite3
+
+import db_connector as dbc
+import query_cache
+from flask import Flask
+
+
+def test_recent_additions_cached_until_listings_change(tmp_db):
+    query_cache.clear()
+    app = Flask(__name__)
+    with app.app_context():
+        bsdb = dbc.BookSwapDatabase()
+        first = bsdb.get_recent_additions(8)
+        assert bsdb.get_recent_additions(8) is first
+        # A write from another connection (as from another worker process) bumps the version
+        other = sqlite3.connect(tmp_db)
+        other.execute("UPDATE UserBooks SET available = 0 WHERE id = ?", (first[0]["userBooksId"],))
+        other.commit()
+        fresh = bsdb.get_recent_additions(8)
+        assert first[0]["userBooksId"] not in [row["userBooksId"] for row in fresh]
+        # A cover found later changes what the listings show, too
+        other.execute("""UPDATE Books SET coverImageUrl = 'http://example.com/c.jpg'
+                         WHERE id = (SELECT bookId FROM UserBooks WHERE id = ?)""", (fresh[0]["userBooksId"],))
+        other.commit()
+        assert 'http://example.com/c.jpg' in [row["coverImageUrl"] for row in bsdb.get_recent_additions(8)]
+        # Points changing on a trade don't touch the listings
+        other.execute("UPDATE Users SET points = points + 1 WHERE id = 2")
+        other.commit()
+        bsdb.get_recent_additions(8)
+        other.close()
+        dbc.release_db()
+    stats = query_cache.stats()["queries"]["get_recent_additions"]
+    assert (stats["hits"], stats["misses"]) == (2, 3)
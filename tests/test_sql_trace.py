@@ -0,0 +1,56 @@
+import sqlite3
+
+import db_connector as dbc
+import migrations
+import query_cache
+import sql_trace
+from app import app
+from flask import Flask
+
+
+def test_normalise_groups_statements_by_shape():
+    assert (sql_trace.normalise("SELECT *\n  FROM Books WHERE id = 12 AND title = 'it''s' AND id IN (?, ?,?)")
+            == "SELECT * FROM Books WHERE id = ? AND title = ? AND id IN (...)")
+
+
+def test_statements_are_recorded_with_caller_and_rows(tmp_db, monkeypatch):
+    monkeypatch.setattr(sql_trace, "DEBUG", True)
+    query_cache.clear()
+    with Flask(__name__).app_context():
+        bsdb = dbc.BookSwapDatabase()
+        with sql_trace.record_statements() as statements:
+            rows = bsdb.get_recent_additions(3)
+            for user_num in range(1, 8):
+                bsdb.get_user_summary(user_num)
+        dbc.release_db()
+    recent = [s for s in statements.statements if s.caller == "db_connector.get_recent_additions"]
+    assert recent[-1].rows == len(rows) == 3
+    repeated = statements.repeated(threshold=5)
+    assert len(repeated) == 1
+    (times, callers), = repeated.values()
+    assert times == 7 and callers == {"db_connector.get_user_summary"}
+
+
+def test_callers_are_only_looked_up_for_repeated_statements(tmp_db):
+    with Flask(__name__).app_context():
+        bsdb = dbc.BookSwapDatabase()
+        assert type(bsdb.db.cursor()) is sqlite3.Cursor
+        with sql_trace.record_statements() as statements:
+            assert type(bsdb.db.cursor()) is sql_trace.TracedCursor
+            for user_num in range(1, 8):
+                bsdb.get_user_summary(user_num)
+            migrations.upgrade(bsdb.db)
+        dbc.release_db()
+    assert [s.caller for s in statements.statements] == [None] * 5 + ["db_connector.get_user_summary"] * 2
+    (times, callers), = statements.repeated().values()
+    assert times == 7 and callers == {"db_connector.get_user_summary"}
+
+
+def test_responses_carry_server_timing(tmp_db):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_num"] = 1
+    response = client.get("/learn-how")
+    timings = response.headers.getlist("Server-Timing")
+    assert timings[0].startswith("db;dur=") and 'desc="1 queries"' in timings[0]
+    assert client.get("/_sql-debug").status_code == 404
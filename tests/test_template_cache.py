@@ -0,0 +1,48 @@
+import os
+
+import pytest
+from flask import Flask
+
+import template_cache
+from app import app
+
+APP_DIR = os.path.join(os.path.dirname(__file__), os.pardir)
+
+
+@pytest.fixture
+def fresh_app(tmp_path, monkeypatch):
+    """
+    A bare Flask app using the real templates and a bytecode cache in its own
+    directory, so each test compiles from scratch.
+    """
+    monkeypatch.setattr(template_cache, "CACHE_DIR", str(tmp_path / "jinja"))
+    return lambda: Flask("app", root_path=APP_DIR)
+
+
+def test_app_starts_with_every_template_loaded():
+    assert len(app.jinja_env.cache) == len(app.jinja_env.list_templates())
+
+
+def test_preload_fills_the_bytecode_cache(fresh_app):
+    first = fresh_app()
+    template_cache.configure(first)
+    assert len(os.listdir(template_cache.CACHE_DIR)) == len(first.jinja_env.list_templates())
+
+    # A new worker loads them from the cache instead of compiling them
+    second = fresh_app()
+
+    def compile(*args, **kwargs):
+        raise AssertionError("compiled again")
+
+    second.jinja_env.compile = compile
+    template_cache.configure(second)
+    assert len(second.jinja_env.cache) == len(second.jinja_env.list_templates())
+
+
+def test_preload_can_be_turned_off(fresh_app, monkeypatch):
+    monkeypatch.setattr(template_cache, "PRELOAD", False)
+    monkeypatch.setattr(template_cache, "BYTECODE_CACHE", False)
+    bare = fresh_app()
+    template_cache.configure(bare)
+    assert bare.jinja_env.bytecode_cache is None
+    assert len(bare.jinja_env.cache) == 0
@@ -0,0 +1,74 @@
+import consistency
+import db_connector as dbc
+import wishlist_matches
+from app import app
+
+WISHED_ISBN = '9781627795227'  # on user 3's wishlist in the sample data
+
+
+def _wished_book(db):
+    return db.execute("SELECT id FROM Books WHERE ISBN = ?", (WISHED_ISBN,)).fetchone()[0]
+
+
+def test_listing_a_wished_book_notifies_the_wisher(tmp_db):
+    with app.app_context():
+        bsdb = dbc.BookSwapDatabase()
+        book_id = _wished_book(bsdb.db)
+        bsdb.user_add_book_by_id(book_id, 2, 1, 1)
+        bsdb.user_add_book_by_id(book_id, 4, 1, 2)
+        matches = bsdb.get_wishlist_matches(3)
+        assert [(match["bookId"], match["seen"]) for match in matches] == [(book_id, 0)]
+        assert bsdb.get_user_summary(3)["numWishlistMatches"] == 1
+        assert bsdb.get_wishlist_matches(2) == []
+        bsdb.mark_wishlist_matches_seen(3, matches)
+        assert bsdb.get_user_summary(3)["numWishlistMatches"] == 0
+        assert bsdb.get_wishlist_matches(3) == []
+        # Listing it again brings the notice back; the lister's own copy doesn't
+        bsdb.user_add_book_by_id(book_id, 3, 1, 1)
+        assert bsdb.get_user_summary(3)["numWishlistMatches"] == 0
+        bsdb.user_add_book_by_id(book_id, 5, 1, 1)
+        assert bsdb.get_user_summary(3)["numWishlistMatches"] == 1
+        assert bsdb.db.execute("SELECT COUNT(*) FROM WishlistMatchQueue").fetchone()[0] == 0
+        assert consistency.check_wishlist_inbox_counts(bsdb.db) == []
+        dbc.release_db()
+
+
+def test_listings_arriving_together_are_matched_in_one_round(tmp_db, monkeypatch):
+    monkeypatch.setattr(wishlist_matches, "MAX_LISTINGS", 3)
+    with app.app_context():
+        db = dbc.BookSwapDatabase().db
+        book_id = _wished_book(db)
+        with dbc.transaction(db):
+            db.executemany("INSERT INTO UserBooks (userId, bookId, copyQualityId) VALUES (?, ?, 1)",
+                           [(user_num, book_id) for user_num in (1, 2, 4, 5)])
+        assert wishlist_matches.drain_once(db) == 3
+        assert wishlist_matches.drain_once(db) == 1
+        assert wishlist_matches.drain_once(db) == 0
+        assert db.execute("SELECT unseen FROM WishlistInboxCounts WHERE userId = 3").fetchone()[0] == 1
+        dbc.release_db()
+
+
+def test_wishlist_page_shows_and_clears_notices(tmp_db):
+    with app.app_context():
+        bsdb = dbc.BookSwapDatabase()
+        bsdb.user_add_book_by_id(_wished_book(bsdb.db), 2, 1, 1)
+        dbc.release_db()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_num"] = 3
+    assert "Now available" in client.get("/wishlist").get_data(as_text=True)
+    assert "Now available" not in client.get("/wishlist").get_data(as_text=True)
+
+
+def test_only_the_notices_shown_are_marked_seen(tmp_db):
+    with app.app_context():
+        bsdb = dbc.BookSwapDatabase()
+        book_id = _wished_book(bsdb.db)
+        bsdb.user_add_book_by_id(book_id, 2, 1, 1)
+        shown = bsdb.get_wishlist_matches(3)
+        # Another copy is listed between the page being read and marked seen
+        bsdb.user_add_book_by_id(book_id, 4, 1, 1)
+        bsdb.mark_wishlist_matches_seen(3, shown)
+        assert bsdb.get_user_summary(3)["numWishlistMatches"] == 1
+        assert [match["userBookId"] for match in bsdb.get_wishlist_matches(3)] != [shown[0]["userBookId"]]
+        dbc.release_db()
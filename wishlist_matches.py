@@ -0,0 +1,171 @@
+"""
+Tells wishers when a book on their wishlist is listed.
+
+Triggers on UserBooks queue every listing that becomes available in the
+WishlistMatchQueue table.  Each round takes up to MAX_LISTINGS queued
+listings, finds everyone wishing for their books through the
+WishlistsBooks_bookId index, and writes a "now available" WishlistInbox row
+for each wisher and book, all in one INSERT ... SELECT in one transaction;
+the queue rows go in the same transaction, so no listing is matched twice.
+The lister isn't told about their own copy.
+
+With BACKGROUND on, a daemon thread in each worker process does the matching,
+so listing a popular book doesn't wait for its fan-out; listings that arrive
+while it works are matched together in its next round.  With it off, the
+listing request matches its own listing straight after committing it.
+
+Match everything queued once from the command line (e.g. from cron) with:
+    python wishlist_matches.py [path/to/database.db]
+"""
+import os
+import sys
+import threading
+import logging
+
+import db_connector as dbc
+
+log = logging.getLogger('app.sub')
+
+BACKGROUND = True
+MAX_LISTINGS = 500  # listings matched per round
+POLL_INTERVAL = 30  # seconds the idle worker sleeps unless woken by a new listing
+
+_wake = threading.Event()
+_worker = None
+_worker_pid = None
+_worker_lock = threading.Lock()
+_counters = {"rounds": 0, "listings": 0, "notices": 0}
+_counters_lock = threading.Lock()
+
+
+def _count(name, n=1):
+    with _counters_lock:
+        _counters[name] += n
+
+
+def notify(db):
+    """
+    Has the listings just committed on `db` matched: wakes this process's
+        worker (starting it if need be), or with BACKGROUND off matches them
+        now on `db`.
+    """
+    if not BACKGROUND:
+        while drain_once(db):
+            pass
+        return
+    start_worker()
+    _wake.set()
+
+
+def drain_once(db):
+    """
+    Runs one round: matches up to MAX_LISTINGS queued listings, oldest first.
+    Accepts:
+        db (sqlite3.Connection): connection to the BookSwap database
+    Returns:
+        Number of listings handled (int); 0 once the queue is empty
+    """
+    with dbc.transaction(db):
+        listings = [row[0] for row in db.execute(
+            "SELECT userBookId FROM WishlistMatchQueue ORDER BY dateQueued LIMIT ?", (MAX_LISTINGS,))]
+        if len(listings) == 0:
+            return 0
+        placeholders = ",".join("?" * len(listings))
+        # A book listed twice in one round (or wished for on two of a user's
+        # lists) gives one notice, for the latest listing
+        notices = db.execute(f"""
+                    INSERT INTO WishlistInbox (userId, bookId, userBookId)
+                    SELECT
+                        Wishlists.userId, UserBooks.bookId, UserBooks.id
+                    FROM
+                        UserBooks
+                            INNER JOIN
+                        WishlistsBooks
+                            ON
+                                WishlistsBooks.bookId = UserBooks.bookId
+                            INNER JOIN
+                        Wishlists
+                            ON
+                                Wishlists.id = WishlistsBooks.wishlistId
+                    WHERE
+                        UserBooks.id IN ({placeholders}) AND
+                        UserBooks.available = 1 AND
+                        Wishlists.userId != UserBooks.userId
+                    ORDER BY
+                        UserBooks.id
+                    ON CONFLICT (userId, bookId) DO UPDATE
+                        SET userBookId = excluded.userBookId,
+                            dateAdded  = current_timestamp,
+                            seen       = 0""",
+                             listings).rowcount
+        db.execute(f"DELETE FROM WishlistMatchQueue WHERE userBookId IN ({placeholders})", listings)
+    _count("rounds")
+    _count("listings", len(listings))
+    _count("notices", notices)
+    log.info("Matched %d listings to %d wishlist notices", len(listings), notices)
+    return len(listings)
+
+
+def drain(database=None):
+    """
+    Matches every queued listing.
+    Accepts:
+        database (string): database file, defaults to db_connector.DATABASE
+    Returns:
+        Number of listings handled (int)
+    """
+    pool = dbc.get_pool(database)
+    db = pool.acquire()
+    try:
+        handled = 0
+        while True:
+            n = drain_once(db)
+            if n == 0:
+                return handled
+            handled += n
+    finally:
+        pool.release(db)
+
+
+def _run(database):
+    while True:
+        _wake.wait(POLL_INTERVAL)
+        _wake.clear()
+        try:
+            drain(database)
+        except Exception:
+            log.exception("Wishlist match worker failed, will try again")
+
+
+def start_worker(database=None):
+    """
+    Starts this process's worker thread, if it isn't running already.
+    """
+    global _worker, _worker_pid
+    with _worker_lock:
+        if _worker is None or _worker_pid != os.getpid() or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, args=(database,), name='wishlist-matches', daemon=True)
+            _worker.start()
+            _worker_pid = os.getpid()
+            _wake.set()  # pick up anything left from before
+
+
+def stats():
+    """
+    Returns this worker's counters, plus the number of listings waiting.
+    """
+    with _counters_lock:
+        out = dict(_counters)
+    pool = dbc.get_pool()
+    db = pool.acquire()
+    try:
+        out["pending"] = db.execute("SELECT COUNT(*) FROM WishlistMatchQueue").fetchone()[0]
+    finally:
+        pool.release(db)
+    return out
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    database = sys.argv[1] if len(sys.argv) > 1 else dbc.DATABASE
+    print(f"{database}: matched {drain(database)} listing(s)")
@@ -29,50 +29,10 @@ class Wishlists:
             List of dicts.  Each dict is a book in a user's wishlist.
         """
         try:
-            wishlists = self._get_all_wishlists_for_user()
-            books = self._get_books_for_wishlists(wishlists)
+            # Every list in one query, however many lists the user has
+            books = [dict(book) for book in self.bsdb.get_wishlist_books_for_user(self.user_num)]
             log.info(f"Created books in wishlist for user {self.user_num}")
         except Exception:
             log.error(f"Error retrieving book details for wishlists for user {self.user_num}")
             raise Exception
         return books
-
-
-    def _get_all_wishlists_for_user(self):
-        """
-        _Get_all_wishlists_for_user returns a list of wishlist ids belonging 
-            to that user.
-        Accepts:
-            None
-        Returns:
-            List of ints
-        """
-        try:
-            wishlist_rows = self.bsdb.get_wishlists_by_userid(self.user_num)
-        except Exception:
-            log.error(f"Error getting wishlists for user {self.user_num}")
-            raise Exception
-        wishlists = [row['id'] for row in wishlist_rows]
-        return wishlists
-
-
-    def _get_books_for_wishlists(self, wishlists):
-        """
-        _Get_books_for_wishlists gives a list of dictionaries, each
-            representing a book in the user's wishlist.
-        Accepts:
-            wishlists (list of ints): List of Wishlists.id
-        Returns:
-            List of dictionaries
-        """
-        books = []
-        for wishlist in wishlists:
-            try:
-                books += self.bsdb.get_book_details_for_wishlist(wishlist)
-            except Exception:
-                log.error(f"Error getting books for wishlist {wishlist}")
-                raise Exception
-        books = [dict(book) for book in books]
-        return books
-
-       